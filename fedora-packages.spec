@@ -34,7 +34,7 @@ BuildRequires: python-moksha-wsgi
 BuildRequires: python-tw2-jqplugins-ui
 BuildRequires: python-bunch
 BuildRequires: python-dogpile-core > 0.4.0
-BuildRequires: python-dogpile-cache > 0.4.1
+BuildRequires: python-dogpile-cache >= 0.5.0
 BuildRequires: python-memcached
 BuildRequires: python-retask
 BuildRequires: python-daemon
@@ -66,7 +66,7 @@ Requires: python-bugzilla
 Requires: xapian-bindings-python
 Requires: python-xappy
 Requires: python-dogpile-core > 0.4.0
-Requires: python-dogpile-cache > 0.4.1
+Requires: python-dogpile-cache >= 0.5.0
 Requires: python-memcached
 Requires: python-retask
 # For spectool
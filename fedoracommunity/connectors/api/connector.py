@@ -34,12 +34,16 @@ NotImplementedError if the value is set to anything but None
 from utils import QueryPath, ParamFilter, WeightedSearch
 from tg import config
 from dogpile.cache import make_region
+from dogpile.cache.api import NO_VALUE
+from dogpile.cache.proxy import ProxyBackend
 # TODO -- phase out beaker cache in favor of dogpile.
 from beaker.cache import Cache
 from kitchen.text.converters import to_bytes
 
+import time
 import hashlib
 import inspect
+import threading
 import retask.task
 import retask.queue
 import json
@@ -122,6 +126,188 @@ def cache_key_generator(namespace, fn):
     return generate_key
 
 
+class ClientPool(object):
+    """ Keeps the expensive clients connectors talk through (koji sessions,
+    ProxyClients, YumBases) around between requests.
+
+    A client is checked out by one connector at a time and handed back at
+    the end of the request, so clients which are not thread safe are never
+    shared.  At most max_idle clients are kept per key and max_total over
+    all keys, the longest idle going first.  Clients older than max_age
+    seconds, or idle for more than max_idle_time, are thrown away rather
+    than reused.
+    """
+
+    def __init__(self, max_idle=4, max_age=3600, max_total=16,
+                 max_idle_time=600):
+        self.max_idle = max_idle
+        self.max_age = max_age
+        self.max_total = max_total
+        self.max_idle_time = max_idle_time
+        self.hits = 0
+        self.misses = 0
+        # {key: [(client, created, released)]}
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _reap(self, now):
+        """ Drop the idle clients of every key which are too old or have
+        been idle too long, call with the lock held
+        """
+        for key, idle in self._idle.items():
+            idle[:] = [entry for entry in idle
+                       if now - entry[1] < self.max_age and
+                       now - entry[2] < self.max_idle_time]
+            if not idle:
+                del self._idle[key]
+
+    def acquire(self, key, factory):
+        """ Returns (client, created) for an idle client stored under key
+        or a new one from factory
+        """
+        self._lock.acquire()
+        try:
+            self._reap(time.time())
+            idle = self._idle.get(key)
+            if idle:
+                client, created, released = idle.pop()
+                self.hits += 1
+                return client, created
+            self.misses += 1
+        finally:
+            self._lock.release()
+
+        return factory(), time.time()
+
+    def release(self, key, client, created, max_idle=None):
+        if max_idle is None:
+            max_idle = self.max_idle
+
+        now = time.time()
+        if now - created >= self.max_age:
+            return
+
+        self._lock.acquire()
+        try:
+            self._reap(now)
+            idle = self._idle.setdefault(key, [])
+            if len(idle) >= max_idle:
+                return
+
+            if self.max_total <= 0:
+                return
+
+            total = sum([len(entries) for entries in self._idle.values()])
+            if total >= self.max_total:
+                # make room by dropping the client idle the longest, each
+                # key's clients are kept in the order they came back
+                oldest = min([entries for entries in self._idle.values()
+                              if entries], key=lambda entries: entries[0][2])
+                oldest.pop(0)
+
+            idle.append((client, created, now))
+        finally:
+            self._lock.release()
+
+    def idle_count(self):
+        """ How many clients are kept idle over all keys """
+        self._lock.acquire()
+        try:
+            return sum([len(idle) for idle in self._idle.values()])
+        finally:
+            self._lock.release()
+
+
+_client_pool = None
+
+
+def get_client_pool():
+    global _client_pool
+    if _client_pool is None:
+        _client_pool = ClientPool(
+            int(config.get('fedoracommunity.connector.client-pool.max-idle', 4)),
+            int(config.get('fedoracommunity.connector.client-pool.max-age', 3600)),
+            int(config.get('fedoracommunity.connector.client-pool.max-total', 16)),
+            int(config.get('fedoracommunity.connector.client-pool.max-idle-time', 600)))
+
+    return _client_pool
+
+
+# where the clients checked out during a request are kept in its environ
+POOLED_CLIENTS_KEY = 'fedoracommunity.pooled_clients'
+
+
+def release_pooled_clients(environ):
+    """ Hand the clients checked out during a request back to the pool """
+    pooled_clients = environ.pop(POOLED_CLIENTS_KEY, [])
+    pool = get_client_pool()
+    for key, client, created, max_idle in pooled_clients:
+        pool.release(key, client, created, max_idle)
+
+
+# the (key, creation time) of the cached values which went through the
+# dogpile backend on this thread since start_cache_watch was called
+_cache_watch = threading.local()
+
+
+def start_cache_watch():
+    _cache_watch.values = []
+
+
+def stop_cache_watch():
+    """ Returns the (key, creation time) of every cached value read or
+    written since start_cache_watch
+    """
+    values = getattr(_cache_watch, 'values', None) or []
+    _cache_watch.values = None
+    return values
+
+
+def cache_max_age(values):
+    """ Returns how many seconds are left before the first of the cached
+    values expires, None if cached values never expire
+    """
+    # the expiration the connector regions are configured with
+    expiration_time = int(config.get('cache.connectors.expiration_time', -1))
+    if expiration_time < 0:
+        return None
+
+    now = time.time()
+    return max(0, int(min([created + expiration_time - now
+                           for key, created in values])))
+
+
+class WatchedBackend(ProxyBackend):
+    """ Proxies the dogpile backend of a region, noting the key and
+    creation time of the values it gets and sets for stop_cache_watch
+    """
+
+    def _watch(self, key, value):
+        values = getattr(_cache_watch, 'values', None)
+        if values is not None and value is not NO_VALUE:
+            values.append((key, value.metadata['ct']))
+
+    def get(self, key):
+        value = self.proxied.get(key)
+        self._watch(key, value)
+        return value
+
+    def get_multi(self, keys):
+        values = self.proxied.get_multi(keys)
+        for key, value in zip(keys, values):
+            self._watch(key, value)
+        return values
+
+    def set(self, key, value):
+        self.proxied.set(key, value)
+        self._watch(key, value)
+
+    def set_multi(self, mapping):
+        self.proxied.set_multi(mapping)
+        for key, value in mapping.items():
+            self._watch(key, value)
+
+
 class IConnector(object):
     """ Data connector interface
 
@@ -139,6 +325,7 @@ class IConnector(object):
                 async_creation_runner=async_creation_runner,
             )
             cls.__cache.configure_from_config(config, 'cache.connectors.')
+            cls.__cache.wrap(WatchedBackend)
 
         return cls.__cache
 
@@ -147,6 +334,19 @@ class IConnector(object):
         self._environ = environ
         self._request = request
 
+    def _get_pooled_client(self, key, factory, max_idle=None):
+        """ Check a client out of the process wide pool, creating it with
+        factory if there is no idle one under key.  Within a request it
+        goes back to the pool when the request is over, outside of one it
+        is simply dropped.
+        """
+        client, created = get_client_pool().acquire(key, factory)
+        if self._environ is not None:
+            self._environ.setdefault(POOLED_CLIENTS_KEY, []).append(
+                (key, client, created, max_idle))
+
+        return client
+
     @classmethod
     def register(self):
         """ This method is called when the connector middleware loads the
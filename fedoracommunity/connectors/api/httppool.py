@@ -0,0 +1,357 @@
+# This file is part of Fedora Community.
+# Copyright (C) 2008-2010  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+A process wide pool of keep-alive HTTP(S) connections shared by every
+connector which talks to an upstream web service, so that a call only
+pays for a TCP and TLS handshake when there is no idle connection to the
+host already.
+"""
+
+import ssl
+import time
+import select
+import socket
+import urllib2
+import httplib
+import urlparse
+import threading
+
+from StringIO import StringIO
+from tg import config
+
+# how many connections to a single host may be open at once, requests
+# beyond that wait for one to come free
+MAX_CONNECTIONS = 10
+
+# seconds to wait on a host which has no timeout of its own configured
+DEFAULT_TIMEOUT = 30
+
+# idle connections are closed rather than reused after this many seconds,
+# upstream servers drop them on their end anyway
+MAX_IDLE_TIME = 60
+
+# seconds a request waits for one of its host's connections to come free
+# before giving up with PoolTimeout
+SLOT_TIMEOUT = 60
+
+MAX_REDIRECTS = 5
+
+# only these are sent again when a reused connection turns out to be dead,
+# a POST may already have been acted on
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE')
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class PoolTimeout(socket.timeout):
+    """ No connection to a host came free within the slot timeout """
+    pass
+
+
+class _Slots(object):
+    """ A BoundedSemaphore which can be waited on for a limited time """
+
+    def __init__(self, value):
+        self._cond = threading.Condition(threading.Lock())
+        self._initial = value
+        self._value = value
+
+    def acquire(self, timeout=None):
+        """ Returns False if no slot came free within timeout seconds,
+        0 just tries once
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        self._cond.acquire()
+        try:
+            while self._value == 0:
+                if timeout is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            self._value -= 1
+            return True
+        finally:
+            self._cond.release()
+
+    def release(self):
+        self._cond.acquire()
+        try:
+            if self._value >= self._initial:
+                raise ValueError('Slot released too many times')
+            self._value += 1
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+
+def _is_dropped(conn):
+    """ An idle keep-alive connection with something to read has been
+    closed by the server
+    """
+    if conn.sock is None:
+        return True
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+
+class PooledResponse(object):
+    """ The response to a pooled request.  Its connection goes back to the
+    pool once the body has been read, or is closed if the response is
+    closed or garbage collected before that.
+    """
+
+    def __init__(self, pool, key, conn, response, slot):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self._slot = slot
+        self.status = response.status
+        self.reason = response.reason
+        self.msg = response.msg
+
+    def getcode(self):
+        return self.status
+
+    def info(self):
+        return self.msg
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, amt=None):
+        if self._conn is None:
+            return ''
+
+        if amt is None:
+            data = self._response.read()
+        else:
+            data = self._response.read(amt)
+
+        if amt is None or not data:
+            self._release(reuse=True)
+
+        return data
+
+    def close(self):
+        # a connection with an unread body left on it can't be reused
+        self._release(reuse=self._response.isclosed())
+
+    def __del__(self):
+        # a caller which gave up on the response still frees its slot
+        if getattr(self, '_conn', None) is not None:
+            self._release(reuse=False)
+
+    def _release(self, reuse):
+        if self._conn is None:
+            return
+
+        if reuse and not self._response.will_close:
+            self._pool._put_connection(self._key, self._conn)
+        else:
+            self._conn.close()
+
+        self._conn = None
+        self._slot.release()
+
+
+class HTTPConnectionPool(object):
+    """ Keeps idle keep-alive connections per (scheme, host, port) and caps
+    how many connections to each host are in use at once, waiting at most
+    slot_timeout seconds for one to come free.
+
+    timeouts maps host names to their own timeout in seconds.  hits and
+    misses count the requests which did and did not find an idle
+    connection to reuse.
+    """
+
+    def __init__(self, max_connections=MAX_CONNECTIONS,
+                 timeout=DEFAULT_TIMEOUT, timeouts=None,
+                 max_idle_time=MAX_IDLE_TIME, slot_timeout=SLOT_TIMEOUT):
+        self.max_connections = max_connections
+        self.slot_timeout = slot_timeout
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.max_idle_time = max_idle_time
+        self.hits = 0
+        self.misses = 0
+        self._idle = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def _slot(self, key):
+        self._lock.acquire()
+        try:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = _Slots(self.max_connections)
+            return slot
+        finally:
+            self._lock.release()
+
+    def _get_connection(self, key):
+        """ Returns (connection, reused) """
+        now = time.time()
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key)
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used < self.max_idle_time and \
+                        not _is_dropped(conn):
+                    self.hits += 1
+                    return conn, True
+                conn.close()
+            self.misses += 1
+        finally:
+            self._lock.release()
+
+        scheme, host, port, insecure = key
+        timeout = self.timeouts.get(host, self.timeout)
+        if scheme == 'https':
+            kwargs = {}
+            if insecure and hasattr(ssl, '_create_unverified_context'):
+                kwargs['context'] = ssl._create_unverified_context()
+            conn = httplib.HTTPSConnection(host, port, timeout=timeout,
+                                           **kwargs)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=timeout)
+
+        return conn, False
+
+    def _put_connection(self, key, conn):
+        self._lock.acquire()
+        try:
+            self._idle.setdefault(key, []).append((conn, time.time()))
+        finally:
+            self._lock.release()
+
+    def request(self, method, url, body=None, headers=None, insecure=False):
+        """ Send a request and return its PooledResponse """
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in DEFAULT_PORTS:
+            raise ValueError('Unsupported url %s' % url)
+
+        key = (scheme, parts.hostname, parts.port or DEFAULT_PORTS[scheme],
+               insecure)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        slot = self._slot(key)
+        if not slot.acquire(self.slot_timeout):
+            raise PoolTimeout('No connection to %s:%s came free in %s seconds'
+                              % (key[1], key[2], self.slot_timeout))
+        # from here on the slot belongs to the response, unless there
+        # isn't one
+        response = None
+        try:
+            while True:
+                conn, reused = self._get_connection(key)
+                try:
+                    conn.request(method, path, body, headers or {})
+                    response = PooledResponse(self, key, conn,
+                                              conn.getresponse(), slot)
+                except (httplib.HTTPException, socket.error):
+                    conn.close()
+                    if reused and method in IDEMPOTENT_METHODS:
+                        # the server closed the idle connection on us,
+                        # try the next one
+                        continue
+                    raise
+                break
+        finally:
+            if response is None:
+                slot.release()
+
+        return response
+
+    def urlopen(self, url, data=None, headers=None, insecure=False):
+        """ Like urllib2.urlopen, GETs url (POSTs data if given) following
+        redirects and raises urllib2.HTTPError for error statuses
+        """
+        headers = dict(headers or {})
+        method = 'GET'
+        if data is not None:
+            method = 'POST'
+            headers.setdefault('Content-Type',
+                               'application/x-www-form-urlencoded')
+
+        for i in range(MAX_REDIRECTS + 1):
+            response = self.request(method, url, data, headers, insecure)
+            location = response.getheader('location')
+            if response.status in (301, 302, 303, 307) and location:
+                response.read()
+                url = urlparse.urljoin(url, location)
+                if response.status != 307:
+                    method = 'GET'
+                    data = None
+                    headers.pop('Content-Type', None)
+                continue
+
+            if response.status >= 400:
+                # reading the body hands the connection back to the pool
+                raise urllib2.HTTPError(url, response.status,
+                                        response.reason, response.msg,
+                                        StringIO(response.read()))
+            return response
+
+        raise urllib2.HTTPError(url, response.status, 'Too many redirects',
+                                response.msg, StringIO(''))
+
+
+_http_pool = None
+_http_pool_lock = threading.Lock()
+
+# per host timeouts are configured as
+# fedoracommunity.connector.http.timeout.<host> = seconds
+HOST_TIMEOUT_PREFIX = 'fedoracommunity.connector.http.timeout.'
+
+
+def get_http_pool():
+    global _http_pool
+    _http_pool_lock.acquire()
+    try:
+        if _http_pool is None:
+            timeouts = {}
+            for key in config:
+                if key.startswith(HOST_TIMEOUT_PREFIX):
+                    timeouts[key[len(HOST_TIMEOUT_PREFIX):]] = \
+                        float(config[key])
+
+            _http_pool = HTTPConnectionPool(
+                int(config.get('fedoracommunity.connector.http.max-connections',
+                               MAX_CONNECTIONS)),
+                float(config.get('fedoracommunity.connector.http.timeout',
+                                 DEFAULT_TIMEOUT)),
+                timeouts)
+
+        return _http_pool
+    finally:
+        _http_pool_lock.release()
+
+
+def urlopen(url, data=None, headers=None, insecure=False):
+    """ urlopen through the shared connection pool """
+    return get_http_pool().urlopen(url, data, headers, insecure)
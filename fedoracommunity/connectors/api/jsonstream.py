@@ -0,0 +1,116 @@
+# This file is part of Fedora Community.
+# Copyright (C) 2008-2010  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Encodes connector results as json a piece at a time, so that a large
+result (thousands of bug rows, a whole file tree) goes out as a stream of
+chunks instead of being built up as one string first.
+
+The stdlib's own iterencode does this in pure python, several times
+slower than json.dumps.  Here only the outer levels of containers are
+walked in python and everything below them is handed to json.dumps, so
+each piece is one row or so and still goes through the C encoder.
+"""
+import zlib
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+# container levels walked in python, below this values are encoded whole.
+# 2 covers {"rows": [row, ...]} and the like
+STREAM_DEPTH = 2
+
+# encoded pieces are gathered into chunks of about this many bytes
+CHUNK_SIZE = 64 * 1024
+
+GZIP_LEVEL = 6
+
+# lists below STREAM_DEPTH are encoded this many items at a time
+SLICE_SIZE = 100
+
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+
+def _iterencode(obj, depth):
+    if depth and isinstance(obj, dict):
+        yield '{'
+        first = True
+        for key, value in obj.iteritems():
+            if isinstance(key, basestring):
+                key = json.dumps(key)
+            else:
+                # numbers, booleans and None become strings as keys
+                key = _encode({key: 0})[1:-3]
+            if first:
+                yield key + ':'
+                first = False
+            else:
+                yield ',' + key + ':'
+            for piece in _iterencode(value, depth - 1):
+                yield piece
+        yield '}'
+    elif depth == 1 and isinstance(obj, (list, tuple)):
+        # the items are encoded whole anyway, do it a slice at a time to
+        # save on calls into the encoder
+        yield '['
+        for i in xrange(0, len(obj), SLICE_SIZE):
+            if i:
+                yield ','
+            yield _encode(list(obj[i:i + SLICE_SIZE]))[1:-1]
+        yield ']'
+    elif depth and isinstance(obj, (list, tuple)):
+        yield '['
+        first = True
+        for value in obj:
+            if first:
+                first = False
+            else:
+                yield ','
+            for piece in _iterencode(value, depth - 1):
+                yield piece
+        yield ']'
+    else:
+        yield _encode(obj)
+
+
+def json_chunks(obj, chunk_size=CHUNK_SIZE):
+    """ Yields obj encoded as json, the same as json.dumps with compact
+        separators, in strings of about chunk_size bytes
+    """
+    buf = []
+    size = 0
+    for piece in _iterencode(obj, STREAM_DEPTH):
+        buf.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+
+    if buf:
+        yield ''.join(buf)
+
+
+def gzip_chunks(chunks, level=GZIP_LEVEL):
+    """ Yields the gzip compressed stream of chunks """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+
+    yield compressor.flush()
@@ -20,9 +20,13 @@ import logging
 import pkg_resources
 import urllib
 import time
+import hashlib
 import os.path
+import itertools
 import threading
 
+from multiprocessing.pool import ThreadPool
+
 try:
     import json
 except ImportError:
@@ -33,8 +37,37 @@ from webob import Request, Response
 from pprint import pformat
 from tg import config
 
+from connector import release_pooled_clients, POOLED_CLIENTS_KEY
+from connector import start_cache_watch, stop_cache_watch, cache_max_age
+from jsonstream import json_chunks, gzip_chunks
+
 log = logging.getLogger(__name__)
 
+# how many connector calls of /fcomm_connector/_batch requests run at once,
+# shared between all batch requests of the process
+BATCH_THREADS = 4
+
+# batch requests with more calls than this are turned away
+MAX_BATCH_CALLS = 20
+
+# responses smaller than this are not worth gzipping
+GZIP_MIN_SIZE = 1024
+
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
+
+
+def get_batch_pool():
+    global _batch_pool
+    _batch_pool_lock.acquire()
+    try:
+        if _batch_pool is None:
+            _batch_pool = ThreadPool(int(config.get(
+                'fedoracommunity.connector.batch.threads', BATCH_THREADS)))
+        return _batch_pool
+    finally:
+        _batch_pool_lock.release()
+
 
 class FCommConnectorMiddleware(object):
     """
@@ -92,6 +125,13 @@ class FCommConnectorMiddleware(object):
         return Response(status='404 Not Found')(environ, start_response)
 
     def __call__(self, environ, start_response):
+        try:
+            return self._handle_request(environ, start_response)
+        finally:
+            # the request is over, let other requests use its clients
+            release_pooled_clients(environ)
+
+    def _handle_request(self, environ, start_response):
 
         request = Request(environ)
 
@@ -99,6 +139,9 @@ class FCommConnectorMiddleware(object):
         if path.startswith('/fcomm_connector'):
             s = path.split('/')[2:]
 
+            if s and s[0] == '_batch':
+                return self.run_batch(environ, request, start_response)
+
             if len(s) < 2:
                 log.info('Invalid connector path: %s' % path)
                 return Response(status='404 Not Found')(
@@ -136,10 +179,179 @@ class FCommConnectorMiddleware(object):
 
         return response(environ, start_response)
 
+    def run_batch(self, environ, request, start_response):
+        """ Runs the connector calls of a /fcomm_connector/_batch request on
+        the batch thread pool and returns all of their results at once.
+
+        The calls come as a json list, either the request body or its calls
+        parameter, of {"resource": name, "method": path, "params": {...}}
+        where resource and method are what would follow /fcomm_connector/
+        in the url of the call on its own.  The response is
+        {"responses": [{"status": 200, "body": result}, ...]} in the same
+        order, failed calls get their http status and an error message.
+        """
+        try:
+            if request.content_type == 'application/json':
+                calls = json.loads(request.body)
+            else:
+                calls = json.loads(request.params.get('calls', '[]'))
+        except ValueError, e:
+            log.info('Invalid batch request: %s' % str(e))
+            return Response(status='400 Bad Request')(environ, start_response)
+
+        if not isinstance(calls, list) or len(calls) > MAX_BATCH_CALLS:
+            log.info('Invalid batch request: %r' % calls)
+            return Response(status='400 Bad Request')(environ, start_response)
+
+        responses = get_batch_pool().map(
+            lambda call: self._run_batch_call(environ, call), calls)
+
+        response = self._stream_response(
+            request, json_chunks({'responses': responses}))
+        response.content_type = 'application/json'
+        return response(environ, start_response)
+
+    def _run_batch_call(self, environ, call):
+        # each call gets its own connectors and pooled clients since it runs
+        # in a thread of its own, the rest of the environ (identity, beaker
+        # cache) is shared with the batch request
+        call_environ = environ.copy()
+        call_environ.pop('fedoracommunity.connectors', None)
+        call_environ.pop(POOLED_CLIENTS_KEY, None)
+        try:
+            try:
+                s = (call['resource'] + '/' +
+                     call['method'].lstrip('/')).split('/')
+                params = dict([(str(k), v) for (k, v) in
+                               call.get('params', {}).iteritems()])
+                params.pop('_pp', None)
+
+                conn_name, op, path = s[0], s[1], s[2:]
+            except (KeyError, IndexError, TypeError, AttributeError), e:
+                log.info('Invalid batch call: %r %s' % (call, str(e)))
+                return {'status': 400, 'error': 'Bad Request'}
+
+            if conn_name not in self._connectors:
+                return {'status': 404, 'error': 'Not Found'}
+
+            try:
+                r = self._call_connector(Request(call_environ), conn_name,
+                                         op, path, params)
+            except Exception, e:
+                log.exception('Batch call %s/%s failed' % (conn_name, op))
+                return {'status': 500, 'error': str(e)}
+
+            return {'status': 200, 'body': r}
+        finally:
+            release_pooled_clients(call_environ)
+
     def _run_connector(self, environ, request,
                        conn_name, op, *path,
                        **remote_params):
-        response = None
+        if conn_name not in self._connectors:
+            return Response(status='404 Not Found')
+
+        # pretty print output
+        pretty_print = False
+
+        if '_pp' in remote_params:
+            del remote_params['_pp']
+            pretty_print = True
+
+        start_cache_watch()
+        try:
+            r = self._call_connector(request, conn_name, op, path,
+                                     remote_params)
+        finally:
+            cached = stop_cache_watch()
+
+        etag = None
+        if cached and not asbool(config.get('profile.connectors')):
+            # the result only changes when one of the cached values it was
+            # made from is replaced, or for someone else
+            identity = request.environ.get('repoze.who.identity') or {}
+            etag = hashlib.sha1('%r|%s' % (
+                identity.get('repoze.who.userid'), request.path_qs) + ''.join(
+                ['|%s:%r' % value for value in cached])).hexdigest()
+
+            matched = _match_etag(request.headers.get('If-None-Match'), etag)
+            if matched:
+                response = Response(status='304 Not Modified')
+                response.vary = ('Accept-Encoding',)
+                self._set_cache_headers(request, response, matched, cached)
+                return response
+
+        if pretty_print:
+            r = '<pre>' + pformat(r) + '</pre>'
+
+        if isinstance(r, unicode):
+            r = r.encode('utf-8', 'replace')
+
+        if isinstance(r, str):
+            chunks = [r]
+        else:
+            chunks = json_chunks(r)
+
+        response = self._stream_response(request, chunks)
+        if etag:
+            if response.content_encoding == 'gzip':
+                # the gzipped body is a different representation
+                etag += '-gzip'
+            self._set_cache_headers(request, response, etag, cached)
+
+        return response
+
+    def _set_cache_headers(self, request, response, etag, cached):
+        response.headers['ETag'] = '"%s"' % etag
+        # who is logged in, and so the etag, comes with the cookies
+        response.vary = tuple(response.vary or ()) + ('Cookie',)
+
+        max_age = cache_max_age(cached)
+        if max_age is not None:
+            # results for a logged in user are only for their browser
+            if request.environ.get('repoze.who.identity'):
+                response.headers['Cache-Control'] = 'private, max-age=%d' % \
+                    max_age
+            else:
+                response.headers['Cache-Control'] = 'max-age=%d' % max_age
+
+    def _stream_response(self, request, chunks):
+        """ Returns a Response sending the body chunks, gzipped if the
+        client takes that.  A body which fits in one chunk is sent whole
+        with its Content-Length, anything longer is streamed out as it is
+        encoded.
+        """
+        chunks = iter(chunks)
+        body = next(chunks, '')
+        try:
+            chunks = itertools.chain([body, chunks.next()], chunks)
+            streaming = True
+        except StopIteration:
+            streaming = False
+
+        # without an Accept-Encoding header webob takes any encoding to be
+        # acceptable, browsers which can't gunzip don't send one
+        gzip = bool(request.headers.get('Accept-Encoding')) and \
+            'gzip' in request.accept_encoding and \
+            (streaming or len(body) >= GZIP_MIN_SIZE)
+
+        if streaming:
+            if gzip:
+                chunks = gzip_chunks(chunks)
+            response = Response(app_iter=chunks)
+        else:
+            if gzip:
+                body = ''.join(gzip_chunks([body]))
+            response = Response(body)
+
+        if gzip:
+            response.content_encoding = 'gzip'
+        response.vary = ('Accept-Encoding',)
+
+        return response
+
+    def _call_connector(self, request, conn_name, op, path, remote_params):
+        """ Dispatches op on the connector and returns its result """
         # check last part of path to see if it is json data
         dispatch_params = dict()
 
@@ -166,90 +378,67 @@ class FCommConnectorMiddleware(object):
         else:
             path = ''
 
-        conn = self._connectors.get(conn_name)
-
-        # pretty print output
-        pretty_print = False
-
-        if '_pp' in remote_params:
-            del remote_params['_pp']
-            pretty_print = True
-
-        if conn:
-            conn_obj = conn['connector_class'](environ, request)
-
-            r = None
-            if asbool(config.get('profile.connectors')):
-                try:
-                    import cProfile as profile
-                except ImportError:
-                    import profile
-                directory = config.get('profile.dir', '')
-
-                # Make sure the id is unique for each thread
-                self.profile_id_counter_lock.acquire()
-                prof_id_counter = self.profile_id_counter
-                self.profile_id_counter += 1
-                self.profile_id_counter_lock.release()
-
-                ip = request.remote_addr
-                timestamp = time.time()
-
-                profile_id = "%s_%f_%s_%i" % (
-                    conn_name, timestamp, ip, prof_id_counter)
-                self.outstanding_profile_ids[profile_id] = True
-                prof_file_name = "connector_%s.prof" % profile_id
-                info_file_name = "connector_%s.info" % profile_id
-
-                # output call info
-                file_name = os.path.join(directory, info_file_name)
-                f = open(file_name, 'w')
-                f.write('{"name": "%s", "op": "%s", "path": "%s", '
-                        '"remote_params": %s, "ip": "%s", "timestamp": '
-                        '%f, "id_counter": %i, "id": "%s"}'
-                        % (conn_name, op, path,
-                           json.dumps(remote_params), ip, timestamp,
-                           prof_id_counter, profile_id))
-                f.close()
-
-                # in order to get the results back we need to pass an object
-                # by refrence which will be populated with the actual results
-                result = {'r': None}
-
-                # profile call
-                file_name = os.path.join(directory, prof_file_name)
-                profile.runctx("result['r'] = conn_obj._dispatch(op, path, "
-                               "remote_params, **dispatch_params)",
-                               None,
-                               {'conn_obj': conn_obj,
-                                'op': op,
-                                'path': path,
-                                'remote_params': remote_params,
-                                'dispatch_params': dispatch_params,
-                                'result': result},
-                               file_name)
-
-                r = result['r']
-
-                # add profile id to results
-                r['moksha_profile_id'] = profile_id
-            else:
-                r = conn_obj._dispatch(
-                    op, path, remote_params, **dispatch_params)
+        conn_obj = _get_connector(conn_name, request)
 
-            if pretty_print:
-                r = '<pre>' + pformat(r) + '</pre>'
-            elif not isinstance(r, basestring):
-                r = json.dumps(r, separators=(',', ':'))
+        if asbool(config.get('profile.connectors')):
+            try:
+                import cProfile as profile
+            except ImportError:
+                import profile
+            directory = config.get('profile.dir', '')
+
+            # Make sure the id is unique for each thread
+            self.profile_id_counter_lock.acquire()
+            prof_id_counter = self.profile_id_counter
+            self.profile_id_counter += 1
+            self.profile_id_counter_lock.release()
+
+            ip = request.remote_addr
+            timestamp = time.time()
+
+            profile_id = "%s_%f_%s_%i" % (
+                conn_name, timestamp, ip, prof_id_counter)
+            self.outstanding_profile_ids[profile_id] = True
+            prof_file_name = "connector_%s.prof" % profile_id
+            info_file_name = "connector_%s.info" % profile_id
+
+            # output call info
+            file_name = os.path.join(directory, info_file_name)
+            f = open(file_name, 'w')
+            f.write('{"name": "%s", "op": "%s", "path": "%s", '
+                    '"remote_params": %s, "ip": "%s", "timestamp": '
+                    '%f, "id_counter": %i, "id": "%s"}'
+                    % (conn_name, op, path,
+                       json.dumps(remote_params), ip, timestamp,
+                       prof_id_counter, profile_id))
+            f.close()
 
-            if isinstance(r, unicode):
-                r = r.encode('utf-8', 'replace')
+            # in order to get the results back we need to pass an object
+            # by refrence which will be populated with the actual results
+            result = {'r': None}
 
-            response = Response(r)
+            # profile call
+            file_name = os.path.join(directory, prof_file_name)
+            profile.runctx("result['r'] = conn_obj._dispatch(op, path, "
+                           "remote_params, **dispatch_params)",
+                           None,
+                           {'conn_obj': conn_obj,
+                            'op': op,
+                            'path': path,
+                            'remote_params': remote_params,
+                            'dispatch_params': dispatch_params,
+                            'result': result},
+                           file_name)
+
+            r = result['r']
+
+            # add profile id to results
+            r['moksha_profile_id'] = profile_id
         else:
-            response = Response(status='404 Not Found')
+            r = conn_obj._dispatch(
+                op, path, remote_params, **dispatch_params)
 
-        return response
+        return r
 
     def load_connectors(self):
         log.info('Loading fcomm connectors')
@@ -267,8 +456,31 @@ class FCommConnectorMiddleware(object):
             }
 
 
+def _match_etag(if_none_match, etag):
+    """ Returns which of etag and its gzip variant an If-None-Match header
+    matches, None if it matches neither
+    """
+    if not if_none_match:
+        return None
+
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return etag
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        if tag in (etag, etag + '-gzip'):
+            return tag
+
+    return None
+
+
 def _get_connector(name, request=None):
-    # TODO: having a connection pool might be nice
+    """ Returns the connector called name.  Within a request the same
+    instance is handed out every time it is asked for, the clients it
+    talks through come from a pool shared between requests.
+    """
     cls = None
     if name in FCommConnectorMiddleware._connectors:
         cls = FCommConnectorMiddleware._connectors[name]['connector_class']
@@ -285,7 +497,13 @@ def _get_connector(name, request=None):
 
     if cls:
         try:
-            return cls(request.environ, request)
+            environ = request.environ
         except TypeError:
             # Called outside of the WSGI stack
             return cls(None, None)
+
+        connectors = environ.setdefault('fedoracommunity.connectors', {})
+        if name not in connectors:
+            connectors[name] = cls(environ, request)
+
+        return connectors[name]
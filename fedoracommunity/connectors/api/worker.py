@@ -49,6 +49,9 @@ class Thread(threading.Thread):
                 del tg.config[key]
 
         from fedoracommunity.connectors.api.mw import FCommConnectorMiddleware
+        from fedoracommunity.connectors.api.connector import \
+            release_pooled_clients
+        self.release_pooled_clients = release_pooled_clients
         self.mw_obj = FCommConnectorMiddleware(lambda *args, **kw: None)
 
         # Set up one memcached connection when we start.
@@ -63,6 +66,7 @@ class Thread(threading.Thread):
         task = self.queue.dequeue()
         data = json.loads(task.data)
 
+        request = None
         try:
             # Here are those three attribute that we hung
             # on the original cached fn
@@ -73,6 +77,8 @@ class Thread(threading.Thread):
             conn_cls = self.mw_obj._connectors[name]['connector_class']
 
             request = fake_request()
+            # a fresh environ per task so pooled clients can be released
+            request.environ = {}
             conn_obj = conn_cls(request.environ, request)
 
             if typ == 'query':
@@ -95,6 +101,9 @@ class Thread(threading.Thread):
             log.debug("Value Recorded at " + cache_key)
             self.mc.set(cache_key, value)
         finally:
+            if request is not None:
+                self.release_pooled_clients(request.environ)
+
             # Release the kraken!
             log.info("Mutex released.")
             self.mc.delete(str(data['mutex_key']))
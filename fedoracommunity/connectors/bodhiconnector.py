@@ -18,7 +18,7 @@ import logging
 
 from paste.deploy.converters import asbool
 from tg import config
-from fedora.client import ProxyClient
+from fedoracommunity.connectors.pooledclient import PooledProxyClient
 from datetime import datetime, timedelta
 from webhelpers.html import HTML
 
@@ -41,9 +41,8 @@ class BodhiConnector(IConnector, ICall, IQuery):
         self._prod_url = config.get(
             'fedoracommunity.connector.bodhi.produrl',
             'https://admin.fedoraproject.org/updates')
-        self._bodhi_client = ProxyClient(self._base_url,
-                                         session_as_cookie=False,
-                                         insecure=self._insecure)
+        self._bodhi_client = PooledProxyClient(self._base_url,
+                                               insecure=self._insecure)
 
     # IConnector
     @classmethod
@@ -586,8 +585,8 @@ class BodhiConnector(IConnector, ICall, IQuery):
             filters = dict()
         filters = self._query_updates_filter.filter(filters, conn=self)
         package = filters.get('package')
-        pkgdb = get_connector('pkgdb')
-        koji = get_connector('koji')._koji_client
+        pkgdb = get_connector('pkgdb', self._request)
+        koji = get_connector('koji', self._request)._koji_client
         koji.multicall = True
 
         for release in pkgdb.get_fedora_releases():
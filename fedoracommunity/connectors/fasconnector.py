@@ -17,7 +17,8 @@
 from fedoracommunity.connectors.api import \
     IConnector, ICall, IQuery, ISearch, ParamFilter
 from tg import config
-from fedora.client import ProxyClient, ServerError
+from fedora.client import ServerError
+from fedoracommunity.connectors.pooledclient import PooledProxyClient
 from fedora.client.fas2 import AccountSystem
 from moksha.common.lib.dates import DateTimeDisplay
 import time
@@ -40,9 +41,8 @@ class FasConnector(IConnector, ICall, ISearch, IQuery):
 
     def __init__(self, environ=None, request=None):
         super(FasConnector, self).__init__(environ, request)
-        self._fas_client = ProxyClient(self._base_url,
-                                       session_as_cookie=False,
-                                       insecure=self._insecure)
+        self._fas_client = PooledProxyClient(self._base_url,
+                                             insecure=self._insecure)
 
     # IConnector
     @classmethod
@@ -25,7 +25,8 @@ This Connector works with any url which returns valid simplejson data
 import logging
 log = logging.getLogger(__name__)
 
-from urllib import urlopen
+from fedoracommunity.connectors.api.httppool import urlopen
+import urllib2
 import simplejson
 from fedoracommunity.connectors.api import IConnector, ICall, IQuery
 
@@ -49,7 +50,12 @@ class SimpleJsonConnector(IConnector, ICall, IQuery):
     def _get_json_url(self):
         # FIXME - LOTS OF ERROR CHECKING PLEASE
         # grab the json_url
-        json_fp = urlopen(self._url)
+        try:
+            json_fp = urlopen(self._url)
+        except urllib2.HTTPError, e:
+            # the pooled urlopen raises for error statuses where
+            # urllib.urlopen handed back the error body, keep decoding it
+            json_fp = e
         # decode it into python using simplejson
         json_data = simplejson.load(json_fp)
         json_fp.close()
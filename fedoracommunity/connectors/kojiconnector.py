@@ -40,7 +40,14 @@ class KojiConnector(IConnector, ICall, IQuery):
 
     def __init__(self, environ=None, request=None):
         super(KojiConnector, self).__init__(environ, request)
-        self._koji_client = koji.ClientSession(self._base_url)
+        self._koji_client = self._get_pooled_client(
+            ('koji', self._base_url),
+            lambda: koji.ClientSession(self._base_url))
+
+        # drop anything a multicall interrupted by an exception on an
+        # earlier request left queued up
+        self._koji_client.multicall = False
+        self._koji_client._calls = []
 
     # IConnector
     @classmethod
@@ -737,7 +744,7 @@ class KojiConnector(IConnector, ICall, IQuery):
 
         # Query the bodhi update status for each build
         if filters.get('query_updates'):
-            bodhi = get_connector('bodhi')
+            bodhi = get_connector('bodhi', self._request)
             bodhi.add_updates_to_builds(builds_list)
 
         self._koji_client.multicall = False
@@ -16,7 +16,8 @@
 
 from fedoracommunity.connectors.api import IConnector, ICall, IQuery, ParamFilter, ISearch
 from tg import config
-from fedora.client import ProxyClient, PackageDB
+from fedora.client import PackageDB
+from fedoracommunity.connectors.pooledclient import PooledProxyClient
 from beaker.cache import Cache
 
 COLLECTION_TABLE_CACHE_TIMEOUT= 60 * 60 * 6 # s * m * h = 6 hours
@@ -40,9 +41,8 @@ class PkgdbConnector(IConnector, ICall, ISearch, IQuery):
 
     def __init__(self, environ=None, request=None):
         super(PkgdbConnector, self).__init__(environ, request)
-        self._pkgdb_client = ProxyClient(self._base_url,
-                                         session_as_cookie=False,
-                                         insecure = self._insecure)
+        self._pkgdb_client = PooledProxyClient(self._base_url,
+                                               insecure = self._insecure)
 
     # IConnector
     @classmethod
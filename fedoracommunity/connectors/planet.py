@@ -26,7 +26,6 @@ and hackergochis.
 """
 
 import re
-import urllib2
 import socket
 socket.setdefaulttimeout(10) # Prevent socket buildups when a service goes down
 
@@ -34,6 +33,7 @@ from StringIO import StringIO
 from ConfigParser import RawConfigParser
 from beaker.cache import Cache
 from fedoracommunity.connectors.api import IConnector, ICall, IQuery, ParamFilter
+from fedoracommunity.connectors.api.httppool import urlopen
 
 planet_cache = Cache('planet')
 
@@ -51,7 +51,7 @@ class PlanetConnector(IConnector):
 
     def _get_user_details(self, username):
         users = {}
-        ini = urllib2.urlopen('http://fedorapeople.org/people_planet.ini')
+        ini = urlopen('http://fedorapeople.org/people_planet.ini')
 
         for section in ini.read().split('\n\n'):
             match = re.findall('^# Origin: /home/fedora/(.*)/\.planet\n',
@@ -0,0 +1,122 @@
+# This file is part of Fedora Community.
+# Copyright (C) 2008-2010  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import urllib
+import hashlib
+import logging
+import urlparse
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from fedora.client import AuthError, AppError, ServerError
+
+from fedoracommunity.connectors.api.httppool import get_http_pool
+
+log = logging.getLogger(__name__)
+
+
+class PooledProxyClient(object):
+    """ Stands in for fedora.client.ProxyClient in the connectors, sending
+    the same TurboGears json requests but over the shared keep-alive
+    connection pool instead of a new connection per call.
+
+    Only what the connectors use is supported: send_request with
+    req_params and a session_id or username/password in auth_params,
+    returning (session_id, data).
+    """
+
+    def __init__(self, base_url, session_name='tg-visit', insecure=False,
+                 useragent='Fedora Community'):
+        if not base_url.endswith('/'):
+            base_url += '/'
+        self.base_url = base_url
+        self.session_name = session_name
+        self.insecure = insecure
+        self.useragent = useragent
+
+    def send_request(self, method, req_params=None, auth_params=None):
+        # Unlike fedora.client.ProxyClient, redirects are not followed.  A
+        # 3xx response fails to parse as json and raises ServerError.
+        url = urlparse.urljoin(self.base_url, urllib.quote(method.lstrip('/')))
+
+        params = dict(req_params or {})
+        headers = {'User-Agent': self.useragent,
+                   'Accept': 'application/json',
+                   'Content-Type': 'application/x-www-form-urlencoded'}
+
+        auth_params = auth_params or {}
+        session_id = auth_params.get('session_id')
+        if session_id:
+            headers['Cookie'] = '%s=%s' % (self.session_name, session_id)
+            # csrf protection token
+            params['_csrf_token'] = hashlib.sha1(session_id).hexdigest()
+        elif 'username' in auth_params and 'password' in auth_params:
+            params.update({'user_name': auth_params['username'],
+                           'password': auth_params['password'],
+                           'login': 'Login'})
+
+        body = urllib.urlencode(_encode_params(params), True)
+        response = get_http_pool().request('POST', url, body, headers,
+                                           self.insecure)
+        data = response.read()
+
+        if response.status == 403:
+            raise AuthError('Unable to log into server.  Invalid'
+                            ' authentication tokens.')
+        elif response.status >= 400:
+            raise ServerError(url, response.status, response.reason)
+
+        try:
+            data = json.loads(data)
+        except ValueError, e:
+            log.debug('Error decoding json from %s: %s' % (url, data))
+            raise ServerError(url, response.status,
+                              'Error returned from json module while'
+                              ' processing %(url)s: %(err)s' %
+                              {'url': url, 'err': str(e)})
+
+        if 'exc' in data:
+            name = data.pop('exc')
+            message = data.pop('tg_flash', '')
+            raise AppError(name=name, message=message, extras=data)
+
+        return _session_cookie(response, self.session_name), data
+
+
+def _encode_params(params):
+    encoded = {}
+    for key, value in params.items():
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif isinstance(value, (list, tuple)):
+            value = [isinstance(v, unicode) and v.encode('utf-8') or v
+                     for v in value]
+        encoded[key] = value
+
+    return encoded
+
+
+def _session_cookie(response, session_name):
+    """ Returns the session id the server handed back, if any """
+    for header in response.msg.getheaders('set-cookie'):
+        name, sep, value = header.split(';', 1)[0].partition('=')
+        if name.strip() == session_name:
+            return value.strip()
+
+    return ''
@@ -30,4 +30,97 @@ fcomm = {
             return moksha.json_load(path, params, callback, $overlay_div, loading_icon);
         }
     },
+
+    // connector calls waiting to go out together in one _batch request
+    _batch_queue: [],
+
+    batch_load: function(resource, method, params, callback, $overlay_div) {
+        // Queues up a connector call.  Every call queued before the
+        // browser gets back to its event loop is sent to the server in a
+        // single /fcomm_connector/_batch request.
+        var self = this;
+        self._batch_queue.push({
+            resource: resource,
+            method: method,
+            params: params,
+            callback: callback,
+            $overlay_div: $overlay_div
+        });
+
+        if (self._batch_queue.length == 1)
+            setTimeout(function() { self._send_batch(); }, 0);
+    },
+
+    // the most calls the server runs in one _batch request, see
+    // MAX_BATCH_CALLS in fedoracommunity/connectors/api/mw.py
+    _batch_max_calls: 20,
+
+    _send_batch: function() {
+        var queue = this._batch_queue;
+        this._batch_queue = [];
+
+        for (var i = 0; i < queue.length; i += this._batch_max_calls)
+            this._send_batch_chunk(queue.slice(i, i + this._batch_max_calls));
+    },
+
+    _send_batch_chunk: function(queue) {
+        if (queue.length == 1) {
+            var c = queue[0];
+            return this.connector_load(c.resource, c.method, c.params, c.callback, c.$overlay_div);
+        }
+
+        var self = this;
+        var calls = [];
+        for (var i = 0; i < queue.length; i++) {
+            calls.push({
+                resource: queue[i].resource,
+                method: queue[i].method,
+                params: queue[i].params
+            });
+            self._overlay_message(queue[i].$overlay_div, 'Loading...');
+        }
+
+        var success = function(data) {
+            $.each(data.responses, function(i, response) {
+                // like a failed request on its own, a failed call
+                // never gets to its callback
+                if (response.status == 200) {
+                    self._overlay_message(queue[i].$overlay_div, null);
+                    queue[i].callback(response.body);
+                } else {
+                    self._overlay_message(queue[i].$overlay_div,
+                                          'Error: ' + response.error);
+                }
+            });
+        }
+
+        var error = function(xhr, status, error) {
+            $.each(queue, function(i, c) {
+                self._overlay_message(c.$overlay_div,
+                                      'Error: ' + (error || status));
+            });
+        }
+
+        return $.ajax({
+            url: moksha.url('/fcomm_connector/_batch'),
+            type: 'POST',
+            dataType: 'json',
+            data: {calls: JSON.stringify(calls)},
+            success: success,
+            error: error
+        });
+    },
+
+    _overlay_message: function($overlay_div, message) {
+        // shows message over a batched call's widget, hides it for null
+        if (!$overlay_div)
+            return;
+
+        if (message) {
+            $('.message', $overlay_div).text(message);
+            $overlay_div.show();
+        } else {
+            $overlay_div.hide();
+        }
+    },
 }
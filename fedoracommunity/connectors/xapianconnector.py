@@ -18,31 +18,200 @@ from fedoracommunity.connectors.api import IConnector, ICall, IQuery, ParamFilte
 from tg import config
 from urllib import quote
 from fedoracommunity.search import utils, distmappings
+from fedoracommunity.search.payload import load_payload
+from fedoracommunity.search.completions import Completions
+from fedoracommunity.search.suggestions import Suggestions
 from fedoracommunity.lib.utils import OrderedDict
 import os
 import re
 import sys
 import xapian
 import cgi
+import time
+import threading
 
 try:
     import json
 except ImportError:
     import simplejson as json
 
+class _PooledDatabase(object):
+    """ A read only database along with the query parsers set up for it """
+    def __init__(self, generation):
+        self.generation = generation
+        self.db = xapian.Database(generation)
+        self._query_parsers = {}
+
+    def query_parser(self, name, setup=None):
+        """ Returns the parser cached under name, creating it and handing
+            it to setup to add its prefixes the first time round
+        """
+        qp = self._query_parsers.get(name)
+        if qp is None:
+            qp = xapian.QueryParser()
+            qp.set_database(self.db)
+            if setup:
+                setup(qp)
+            self._query_parsers[name] = qp
+
+        return qp
+
+
+class XapianDatabasePool(object):
+    """ Process wide pool of read only databases.  Xapian handles must not
+        be shared between threads so each thread gets its own, which it
+        keeps until the indexer publishes a new generation.
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    def get(self, path, reopen=False):
+        """ Returns the _PooledDatabase for path.  With reopen the handle
+            is brought up to date with changes made to the database in place.
+        """
+        handles = getattr(self._local, 'handles', None)
+        if handles is None:
+            handles = self._local.handles = {}
+
+        # the indexer publishes each new database as a directory and flips
+        # a symlink over to it, so open what the link currently points to
+        generation = os.path.realpath(path)
+        handle = handles.get(path)
+        if handle is None or handle.generation != generation:
+            handle = handles[path] = _PooledDatabase(generation)
+        elif reopen:
+            handle.db.reopen()
+
+        return handle
+
+database_pool = XapianDatabasePool()
+
+
+class SearchResultCache(object):
+    """ LRU cache of search results which also expires entries after ttl
+        seconds.  Everything is dropped when a new index generation shows
+        up, since none of it can be valid any more.
+    """
+    def __init__(self, size=500, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self.generation = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, generation, key):
+        self._lock.acquire()
+        try:
+            if generation != self.generation:
+                self._entries.clear()
+                self.generation = generation
+                return None
+
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+
+            expires, value = entry
+            if expires < time.time():
+                return None
+
+            # move it back to the most recently used end
+            self._entries[key] = entry
+            return value
+        finally:
+            self._lock.release()
+
+    def put(self, generation, key, value):
+        self._lock.acquire()
+        try:
+            if generation != self.generation:
+                # results from a generation which has since been replaced
+                return
+
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        finally:
+            self._lock.release()
+
+_search_cache = None
+
+def get_search_cache():
+    global _search_cache
+    if _search_cache is None:
+        _search_cache = SearchResultCache(
+            int(config.get('fedoracommunity.connector.xapian.search-cache.size', 500)),
+            int(config.get('fedoracommunity.connector.xapian.search-cache.ttl', 300)))
+
+    return _search_cache
+
+_index_tables = {}
+_index_tables_lock = threading.Lock()
+
+def get_index_table(table_class, generation):
+    """ Returns the table_class (Completions, Suggestions) written next to
+        an index generation, loaded once and shared by every thread since
+        it never changes
+    """
+    _index_tables_lock.acquire()
+    try:
+        table = _index_tables.get(table_class)
+        if table is None or table[0] != generation:
+            table = _index_tables[table_class] = \
+                (generation, table_class(generation))
+        return table[1]
+    finally:
+        _index_tables_lock.release()
+
+# below this many hits a search is retried with spelling corrections and
+# synonyms added
+SUGGEST_BELOW_HITS = 3
+
+
+# the fields of a result row and its sub packages which the search
+# results template shows
+HIGHLIGHT_FIELDS = ('name', 'summary')
+
+# sub packages past this many in a row are left unhighlighted, packages
+# like texlive have hundreds of them
+MAX_HIGHLIGHTED_SUB_PKGS = 50
+
+
+class Highlighter(object):
+    """ Marks the search terms in <span class="match"> using one regex
+        compiled for the whole query
+    """
+    def __init__(self, terms, fields=HIGHLIGHT_FIELDS,
+                 max_sub_pkgs=MAX_HIGHLIGHTED_SUB_PKGS):
+        terms = "|".join([re.escape(t) for t in terms])
+        self.regex = re.compile(r'(\b(%s)\b(\s*(%s)\b)*)' % (terms, terms), re.I)
+        self.fields = fields
+        self.max_sub_pkgs = max_sub_pkgs
+
+    def highlight(self, string):
+        return self.regex.sub(r'<span class="match">\1</span>', string)
+
+    def highlight_fields(self, data):
+        for field in self.fields:
+            if data.get(field):
+                data[field] = self.highlight(data[field])
+
+
 class XapianConnector(IConnector, ICall, IQuery):
     _method_paths = {}
     _query_paths = {}
 
     def __init__(self, environ=None, request=None):
         super(XapianConnector, self).__init__(environ, request)
-        self._search_db = xapian.Database(config.get('fedoracommunity.connector.xapian.package-search.db', 'xapian/search'))
-        self._versionmap_db = xapian.Database(config.get('fedoracommunity.connector.xapian.versionmap.db', 'xapian/versionmap'))
+        self._search_db_path = config.get('fedoracommunity.connector.xapian.package-search.db', 'xapian/search')
+        self._versionmap_db_path = config.get('fedoracommunity.connector.xapian.versionmap.db', 'xapian/versionmap')
 
     # IConnector
     @classmethod
     def register(cls):
         cls.register_search_packages()
+        cls.register_complete_packages()
 
     def introspect(self):
         # FIXME: return introspection data
@@ -68,29 +237,59 @@ class XapianConnector(IConnector, ICall, IQuery):
                         can_sort = False,
                         can_filter_wildcards = False)
 
-    def _highlight_str(self, string, term):
-        terms = "|".join(term)
-        regex = re.compile(r'(\b(%s)\b(\s*(%s)\b)*)' % (terms, terms), re.I)
-        return regex.sub(r'<span class="match">\1</span>', string)
+    @classmethod
+    def register_complete_packages(cls):
+        path = cls.register_query(
+                      'complete_packages',
+                      cls.complete_packages,
+                      primary_key_col = 'name',
+                      default_sort_col = 'name',
+                      default_sort_order = -1,
+                      can_paginate = False)
+
+        path.register_column('name',
+                        default_visible = True,
+                        can_sort = False,
+                        can_filter_wildcards = False)
+
+    def complete_packages(self, start_row=None,
+                                rows_per_page=None,
+                                order=-1,
+                                sort_col=None,
+                                filters = {},
+                                **params):
+        """ Names of base and sub packages starting with filters['search'],
+            served from the completions table built with the index
+        """
+        prefix = filters.get('search')
+        if not prefix:
+            return (0, [])
+
+        generation = database_pool.get(self._search_db_path).generation
+        completions = get_index_table(Completions, generation)
+        rows = []
+        for name, base in completions.complete(prefix, rows_per_page or 10):
+            rows.append({'name': name,
+                         'link': name,
+                         'subpackage_of': base})
+
+        return (len(rows), rows)
 
-    def _highlight_matches(self, row_data, term):
+    def _highlight_matches(self, row_data, highlighter):
         # make link from name before we potentially rewrite it
         # if we haven't already
         if 'link' not in row_data:
             row_data['link'] = row_data['name']
 
-        row_data['name'] = self._highlight_str(row_data['name'], term);
-        row_data['summary'] = self._highlight_str(row_data['summary'], term);
-        row_data['description'] = self._highlight_str(row_data['description'], term);
+        highlighter.highlight_fields(row_data)
 
-        for pkg in row_data['sub_pkgs']:
+        for i, pkg in enumerate(row_data['sub_pkgs']):
 
             if 'link' not in pkg:
                 pkg['link'] = pkg['name']
 
-            pkg['name'] = self._highlight_str(pkg['name'], term);
-            pkg['summary'] = self._highlight_str(pkg['summary'], term);
-            pkg['description'] = self._highlight_str(pkg['description'], term);
+            if i < highlighter.max_sub_pkgs:
+                highlighter.highlight_fields(pkg)
 
     def search_packages(self, start_row=None,
                               rows_per_page=None,
@@ -109,6 +308,57 @@ class XapianConnector(IConnector, ICall, IQuery):
         ]
 
         search_string = utils.filter_search_string(search_string)
+
+        # the same query typed with different case or spacing gives the
+        # same rows, highlighting included
+        cache = get_search_cache()
+        generation = database_pool.get(self._search_db_path).generation
+        cache_key = (' '.join(search_string.split()),
+                     tuple([t.lower() for t in unfiltered_search_terms]),
+                     start_row, rows_per_page)
+        cached = cache.get(generation, cache_key)
+        if cached is not None:
+            return cached
+
+        matches = self.do_search(self._build_query_string(search_string),
+                                 start_row,
+                                 rows_per_page,
+                                 order,
+                                 sort_col)
+
+        if matches.get_matches_estimated() < SUGGEST_BELOW_HITS:
+            suggested_terms = self._suggest_terms(search_string, generation)
+            if suggested_terms:
+                unfiltered_search_terms.extend(suggested_terms)
+                suggested_string = "%s OR (%s)" % (
+                    self._build_query_string(search_string),
+                    self._build_query_string(' '.join(suggested_terms)))
+                matches = self.do_search(suggested_string,
+                                         start_row,
+                                         rows_per_page,
+                                         order,
+                                         sort_col)
+
+        count = matches.get_matches_estimated()
+        highlighter = Highlighter(unfiltered_search_terms)
+        rows = []
+        for m in matches:
+            # result rows only show names and summaries so leave the
+            # descriptions packed up
+            result = load_payload(m.document.get_data(), descriptions=False)
+
+            # mark matches in <span class="match">
+            self._highlight_matches(result, highlighter)
+
+            rows.append(result)
+
+        cache.put(generation, cache_key, (count, rows))
+        return (count, rows)
+
+    def _build_query_string(self, search_string):
+        """ Turn a filtered search string into the query we run, which
+            also matches exact names, phrases and partial words
+        """
         phrase = '"%s"' % search_string
 
         # add exact matchs
@@ -128,25 +378,70 @@ class XapianConnector(IConnector, ICall, IQuery):
         search_string += " OR (%s)" % ' OR '.join([
             "*%s*" % term for term in search_terms])
 
-        matches = self.do_search(search_string,
-                                 start_row,
-                                 rows_per_page,
-                                 order,
-                                 sort_col)
-
-        count = matches.get_matches_estimated()
-        rows = []
-        for m in matches:
-            result = json.loads(m.document.get_data())
+        return search_string
 
-            # mark matches in <span class="match">
-            self._highlight_matches(result, unfiltered_search_terms)
+    def _suggest_terms(self, search_string, generation):
+        """ Returns spelling corrections for the words of a filtered search
+            string along with the packages it is another name for
+        """
+        db = database_pool.get(self._search_db_path).db
+        suggested_terms = []
+        for term in search_string.split():
+            corrected = db.get_spelling_suggestion(term)
+            if corrected and corrected != term:
+                suggested_terms.append(corrected)
 
-            rows.append(result)
+        suggestions = get_index_table(Suggestions, generation)
+        for name in suggestions.synonyms_for(search_string):
+            filtered_name = utils.filter_search_string(name)
+            if filtered_name not in suggested_terms:
+                suggested_terms.append(filtered_name)
 
-        return (count, rows)
+        return suggested_terms
 
     def get_package_info(self, package_name):
+        # the package page and its widgets all ask for the same package,
+        # so remember the answer for the rest of the request
+        memo = None
+        if self._environ is not None:
+            memo = self._environ.setdefault(
+                'fedoracommunity.xapian.package_info', {})
+            if package_name in memo:
+                return memo[package_name]
+
+        result = self._lookup_package_info(package_name)
+        if memo is not None:
+            memo[package_name] = result
+
+        return result
+
+    def _lookup_package_info(self, package_name):
+        db = database_pool.get(self._search_db_path).db
+        term = utils.package_name_term(package_name)
+        docids = [posting.docid for posting in db.postlist(term)]
+        if len(docids) == 1:
+            return load_payload(db.get_document(docids[0]).get_data())
+
+        if docids:
+            # a sub package may share its name with another base package,
+            # in which case the base package wins
+            for docid in docids:
+                data = db.get_document(docid).get_data()
+                if load_payload(data, descriptions=False)['name'] == package_name:
+                    return load_payload(data)
+            return load_payload(db.get_document(docids[0]).get_data())
+
+        # only indexes built before package name terms were added need
+        # the old free text search
+        for name_term in db.allterms(utils.PACKAGE_NAME_PREFIX):
+            return None
+
+        return self._search_package_info(package_name)
+
+    def _search_package_info(self, package_name):
+        """ Find the package with a free text query, for indexes built
+            before package name terms were added
+        """
         search_name = utils.filter_search_string(package_name)
         search_string = "%s EX__%s__EX" % (search_name, search_name)
 
@@ -156,11 +451,11 @@ class XapianConnector(IConnector, ICall, IQuery):
 
         # Sometimes (rarely), the first match is not the one we actually want.
         for match in matches:
-            result = json.loads(match.document.get_data())
-            if result['name'] == package_name:
-                return result
-            if any([sp['name'] == package_name for sp in result['sub_pkgs']]):
-                return result
+            data = match.document.get_data()
+            result = load_payload(data, descriptions=False)
+            if result['name'] == package_name or \
+                    any([sp['name'] == package_name for sp in result['sub_pkgs']]):
+                return load_payload(data)
 
         return None
 
@@ -170,9 +465,9 @@ class XapianConnector(IConnector, ICall, IQuery):
                   rows_per_page=None,
                   order=-1,
                   sort_col=None):
-        enquire = xapian.Enquire(self._search_db)
-        qp = xapian.QueryParser()
-        qp.set_database(self._search_db)
+        search_db = database_pool.get(self._search_db_path)
+        enquire = xapian.Enquire(search_db.db)
+        qp = search_db.query_parser('search')
         flags = xapian.QueryParser.FLAG_DEFAULT | \
                 xapian.QueryParser.FLAG_PARTIAL | \
                 xapian.QueryParser.FLAG_WILDCARD
@@ -184,10 +479,12 @@ class XapianConnector(IConnector, ICall, IQuery):
         return matches
 
     def get_latest_builds(self, package_name):
-        enquire = xapian.Enquire(self._versionmap_db)
-        qp = xapian.QueryParser()
-        qp.set_database(self._versionmap_db)
-        qp.add_boolean_prefix('key', 'XA')
+        # the version mapper updates its database in place
+        versionmap_db = database_pool.get(self._versionmap_db_path,
+                                          reopen=True)
+        enquire = xapian.Enquire(versionmap_db.db)
+        qp = versionmap_db.query_parser(
+            'key', lambda qp: qp.add_boolean_prefix('key', 'XA'))
         query = qp.parse_query('key:%s' % utils.filter_search_string(package_name))
 
         enquire.set_query(query)
@@ -30,9 +30,32 @@ class YumConnector(IConnector, ICall, ISearch, IQuery):
 
     def __init__(self, environ=None, request=None):
         super(YumConnector, self).__init__(environ, request)
-        self._yum_client = yum.YumBase()
-
-        self._yum_client.doConfigSetup(fn = self._conf_file, root=os.getcwd())
+        self._yum_client = None
+        # clients this connector has checked out, by their pool key, so
+        # repeated calls within a request reuse them
+        self._yum_clients = {}
+
+    def _get_yum_client(self, enable_repos=None):
+        """ A YumBase builds its package sack from whichever repos are
+            enabled when it is first used, so pooled ones are kept per set
+            of enabled repos (None for the repos enabled in the config)
+        """
+        def create():
+            yum_client = yum.YumBase()
+            yum_client.doConfigSetup(fn = self._conf_file, root=os.getcwd())
+            return yum_client
+
+        if enable_repos is not None:
+            enable_repos = tuple(sorted(enable_repos))
+
+        key = ('yum', self._conf_file, enable_repos)
+        yum_client = self._yum_clients.get(key)
+        if yum_client is None:
+            # each one holds a loaded sack, so keep few of them idle
+            yum_client = self._get_pooled_client(key, create, max_idle=1)
+            self._yum_clients[key] = yum_client
+
+        return yum_client
 
     # IConnector
     @classmethod
@@ -95,6 +118,7 @@ class YumConnector(IConnector, ICall, ISearch, IQuery):
 
         search_term = search_term.split()
 
+        self._yum_client = self._get_yum_client()
         search = self._yum_client.searchGenerator(searchlist, search_term, showdups = False)
         results = []
         seen = set()
@@ -114,7 +138,6 @@ class YumConnector(IConnector, ICall, ISearch, IQuery):
                 results.append(row)
                 seen.add(pkg.name)
 
-        self._yum_client.close()
         return results
 
     def _setup_repo(self, repo, arch):
@@ -137,6 +160,7 @@ class YumConnector(IConnector, ICall, ISearch, IQuery):
             enable_repos.append('%s-updates-%s' % (repo_id, arch_id))
 
         # enable repos we care about
+        self._yum_client = self._get_yum_client(enable_repos)
         for r in self._yum_client.repos.findRepos('*'):
             if r.id in enable_repos:
                 r.enable()
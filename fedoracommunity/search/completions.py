@@ -0,0 +1,81 @@
+"""
+A sorted table of package names, written next to the search index, for
+completing names as they are typed without running a xapian query.
+
+Each line of the file is "filtered name<TAB>name<TAB>base package" with
+an empty base package for base packages, sorted on the first column.  Names
+and prefixes are both run through filter_search_string, like searches are.
+"""
+import os
+import bisect
+import tempfile
+
+from utils import filter_search_string
+
+COMPLETIONS_FILE = 'completions'
+
+# how far past the top K matches to look for better ranked names
+COMPLETION_WINDOW = 20
+
+
+def write_completions(dbpath, pkgs):
+    """ Write the completions table for the base packages in pkgs and
+        their sub packages into dbpath
+    """
+    lines = []
+    for pkg in pkgs:
+        lines.append('%s\t%s\t\n' % (filter_search_string(pkg['name']),
+                                      pkg['name']))
+        for sub_pkg in pkg['sub_pkgs']:
+            lines.append('%s\t%s\t%s\n' % (filter_search_string(sub_pkg['name']),
+                                           sub_pkg['name'], pkg['name']))
+    lines.sort()
+
+    # write then rename so a reader never sees a partial table
+    fd, tmp_path = tempfile.mkstemp(dir=dbpath)
+    f = os.fdopen(fd, 'w')
+    f.writelines(lines)
+    f.close()
+    os.chmod(tmp_path, 0644)
+    os.rename(tmp_path, os.path.join(dbpath, COMPLETIONS_FILE))
+
+
+class Completions(object):
+    """ The completions table of an index, loaded into memory """
+    def __init__(self, dbpath):
+        self.keys = []
+        self.entries = []
+
+        path = os.path.join(dbpath, COMPLETIONS_FILE)
+        if not os.path.exists(path):
+            # indexes built before completions were added
+            return
+
+        f = open(path)
+        try:
+            for line in f:
+                key, name, base = line.rstrip('\n').split('\t')
+                self.keys.append(key)
+                self.entries.append((name, base))
+        finally:
+            f.close()
+
+    def complete(self, prefix, limit=10):
+        """ Returns up to limit (name, base_package) pairs for the names
+            starting with prefix, base packages and shorter names first
+        """
+        prefix = filter_search_string(prefix.strip())
+        if not prefix:
+            return []
+
+        start = bisect.bisect_left(self.keys, prefix)
+        end = start
+        window = start + limit * COMPLETION_WINDOW
+        while end < len(self.keys) and end < window and \
+                self.keys[end].startswith(prefix):
+            end += 1
+
+        matches = self.entries[start:end]
+        matches.sort(key=lambda entry: (entry[1] != '', len(entry[0]), entry[0]))
+
+        return matches[:limit]
@@ -0,0 +1,97 @@
+"""
+Sources of koji build tag events for the version mapper's consume mode.
+
+A source is an iterable of fedmsg style messages
+({'topic': topic, 'msg': {'build_id': ..., 'name': ..., 'tag': ...}} or
+just the msg body).  Sources which wait on the network also yield None
+every poll_timeout seconds while nothing arrives, so the consumer gets a
+chance to write out anything it is holding on to.
+"""
+import sys
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+TAG_TOPIC = 'org.fedoraproject.prod.buildsys.tag'
+
+
+class FileEventSource(object):
+    """ Replays messages, one json document per line, from a file or from
+        stdin when path is '-'
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        if self.path == '-':
+            f = sys.stdin
+        else:
+            f = open(self.path)
+
+        try:
+            for line in iter(f.readline, ''):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    print "Skipping malformed event: %s" % line
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+class ZMQEventSource(object):
+    """ Subscribes to tag messages from one or more fedmsg style ZeroMQ
+        publishers, which send [topic, json_body] multipart messages
+    """
+    def __init__(self, endpoints, topic=TAG_TOPIC, poll_timeout=1.0):
+        import zmq
+
+        self.zmq = zmq
+        self.endpoints = endpoints
+        self.topic = topic
+        self.poll_timeout = poll_timeout
+
+    def __iter__(self):
+        zmq = self.zmq
+        context = zmq.Context()
+        socket = context.socket(zmq.SUB)
+        socket.setsockopt(zmq.SUBSCRIBE, self.topic)
+        for endpoint in self.endpoints:
+            socket.connect(endpoint)
+
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+        try:
+            while True:
+                if not poller.poll(self.poll_timeout * 1000):
+                    yield None
+                    continue
+
+                parts = socket.recv_multipart()
+                try:
+                    message = json.loads(parts[-1])
+                except ValueError:
+                    print "Skipping malformed event on %s" % parts[0]
+                    continue
+
+                message.setdefault('topic', parts[0])
+                yield message
+        finally:
+            socket.close()
+            context.term()
+
+
+def make_event_source(spec, topic=TAG_TOPIC):
+    """ Comma separated tcp:// or ipc:// endpoints subscribe to ZeroMQ
+        publishers, anything else is a file to replay ('-' for stdin)
+    """
+    endpoints = [e.strip() for e in spec.split(',') if e.strip()]
+    if endpoints and endpoints[0].split('://')[0] in ('tcp', 'ipc', 'pgm', 'epgm'):
+        return ZMQEventSource(endpoints, topic)
+
+    return FileEventSource(spec)
@@ -0,0 +1,95 @@
+"""
+A persistent, size bounded cache of files extracted from rpms so that
+unchanged packages never need their payload decompressed again
+"""
+import os
+import shutil
+import hashlib
+import tempfile
+
+
+class ExtractedFileCache(object):
+    """ Stores extracted files on disk keyed by the checksum of the rpm
+        they came from and their path inside it.  Entries are touched on
+        every hit and the least recently used ones are evicted by prune
+        once the cache grows past max_size bytes.
+    """
+    def __init__(self, cache_dir, max_size=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def _entry_path(self, rpm_checksum, file_path):
+        key = hashlib.sha1('%s:%s' % (rpm_checksum, file_path)).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, rpm_checksum, file_path):
+        """ Returns the path to the cached copy of file_path or None """
+        entry_path = self._entry_path(rpm_checksum, file_path)
+        try:
+            # bump the entry for LRU eviction
+            os.utime(entry_path, None)
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry_path
+
+    def put(self, rpm_checksum, file_path, extracted_path):
+        """ Copies an extracted file into the cache and returns the path
+            to the cached copy
+        """
+        entry_path = self._entry_path(rpm_checksum, file_path)
+        entry_dir = os.path.dirname(entry_path)
+        if not os.path.exists(entry_dir):
+            try:
+                os.makedirs(entry_dir)
+            except OSError:
+                # another indexer process beat us to it
+                pass
+
+        # copy then rename so concurrent readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir)
+        os.close(fd)
+        shutil.copyfile(extracted_path, tmp_path)
+        os.rename(tmp_path, entry_path)
+
+        return entry_path
+
+    def prune(self):
+        """ Evict the least recently used entries until the cache fits in
+            max_size
+        """
+        entries = []
+        total_size = 0
+        for dir_path, dir_names, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                entry_path = os.path.join(dir_path, file_name)
+                try:
+                    st = os.stat(entry_path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry_path))
+                total_size += st.st_size
+
+        if total_size <= self.max_size:
+            return 0
+
+        entries.sort()
+        removed = 0
+        for mtime, size, entry_path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                continue
+            total_size -= size
+            removed += 1
+
+        return removed
@@ -1,91 +1,197 @@
 import os
+import tempfile
 
 from rpmcache import RPMCache
 import Image
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+# sizes generated for every icon
+ICON_SIZES = (128, 64, 32, 16)
+
+# icon size and width in icons of the sprite sheet
+SPRITE_SIZE = 32
+SPRITE_COLUMNS = 32
+
 class IconCache(object):
-    def __init__(self, yum_base, icon_rpm_names, icon_dir, cache_dir):
+    def __init__(self, yum_base, icon_rpm_names, icon_dir, cache_dir,
+                 file_cache=None, stream=False):
         self.found_icons = {} # {'icon-name': True}
         self._rpm_caches = []
         self._rpm_caches.extend(icon_rpm_names)
         self.yum_base = yum_base
         self.cache_dir = cache_dir
         self.icon_dir = icon_dir
+        self.file_cache = file_cache
+        self.stream = stream
 
     def check_pkg(self, pkg):
         try:
             i = self._rpm_caches.index(pkg['name'])
-            self._rpm_caches[i] = RPMCache(pkg, self.yum_base, self.cache_dir)
+            self._rpm_caches[i] = RPMCache(pkg, self.yum_base, self.cache_dir,
+                                           file_cache=self.file_cache,
+                                           stream=self.stream)
             self._rpm_caches[i].open()
         except ValueError:
             pass
 
-    def _find_best_icon(self, icon, cache):
+    def themes(self):
+        """ Returns the envra of every theme package found in the repos
+            and the name of the ones which were not
+        """
+        return [getattr(cache, 'rpm_envra', cache)
+                for cache in self._rpm_caches]
+
+    def prefetch(self):
+        """ Extract the icons of the theme packages up front, see
+            RPMCache.prefetch.  Themes which fail to extract are dropped.
+        """
+        for i, cache in enumerate(self._rpm_caches):
+            if isinstance(cache, RPMCache) and not cache.prefetch('*.png'):
+                print "Not using icons from %s" % cache.rpm_envra
+                cache.close()
+                self._rpm_caches[i] = cache.pkg['name']
+
+    def _find_candidates(self, icon, cache):
+        """ Returns [(width, icon_path)] for every icon of that name in
+            the cache, only reading the image headers
+        """
         if icon.endswith('.png'):
             icon = icon[:-4]
 
-        icon_path_list = cache.find_files(icon + '.png', '*.png')
-        best_match = None
-
-        for icon_path in icon_path_list:
+        candidates = []
+        for icon_path in cache.find_files(icon + '.png', '*.png'):
             try:
-                pixbuf = Image.open(icon_path)
-                pixbuf.load()
+                # Image.open only parses the header, decoding is deferred
+                width = Image.open(icon_path).size[0]
             except Exception:
                 continue
-
-            width = pixbuf.size[0]
-
-            # try to find the best match to 128x128
-            if width == 128:
-                best_match = pixbuf
+            candidates.append((width, icon_path))
+
+        return candidates
+
+    def _find_best_icon(self, icon, caches):
+        """ Picks the closest match to 128x128 from the caches, earlier
+            caches winning ties, and decodes only that one.  Later caches
+            (the icon themes) are only searched while nothing at least
+            128 wide has been found, so a package shipping its own icon
+            never makes us extract the themes.
+        """
+        best_rank = None
+        best_path = None
+        for i, cache in enumerate(caches):
+            if best_rank is not None and best_rank[0] < 2:
                 break
-            elif best_match == None:
-                best_match = pixbuf
-            elif width > 128:
-                best_match_width = best_match.size[0]
-                if best_match_width < 128:
-                    best_match = pixbuf
-                elif width < best_match_width:
-                    best_match = pixbuf
-            elif width < 128:
-                best_match_width = best_match.size[0]
-                if best_match_width > 128:
-                    continue
-                elif width > best_match_width:
-                    best_match = pixbuf
-
-        if not best_match:
+
+            for width, icon_path in self._find_candidates(icon, cache):
+                if width == 128:
+                    rank = (0, 0, i)
+                elif width > 128:
+                    # the smallest icon we can scale down from
+                    rank = (1, width, i)
+                else:
+                    # smaller icons should be pasted onto a generic icon in
+                    # the future but for now just scale the largest up
+                    rank = (2, -width, i)
+
+                if best_rank is None or rank < best_rank:
+                    best_rank = rank
+                    best_path = icon_path
+
+        if best_path is None:
             return None
 
-        if best_match.size[0] > 128:
-            # resize to 128
-            best_match = best_match.resize((128, 128))
-        elif best_match.size[0] < 128:
-            # smaller icons should be pasted onto a generic icon in
-            # the future but for now just resize
-            best_match = best_match.resize((128, 128))
+        try:
+            best_match = Image.open(best_path)
+            best_match.load()
+        except Exception:
+            return None
 
-        return best_match
+        return best_match.convert('RGBA')
 
     def generate_icon(self, icon_name, extra_cache):
         if self.found_icons.get(icon_name, None):
             return icon_name
-        else:
-            search_packages = [extra_cache]
-            search_packages.extend(self._rpm_caches)
 
-            for icon_rpm_cache in search_packages:
-                icon = self._find_best_icon(icon_name, icon_rpm_cache)
+        search_packages = [extra_cache]
+        search_packages.extend([c for c in self._rpm_caches
+                                if isinstance(c, RPMCache)])
+
+        icon = self._find_best_icon(icon_name, search_packages)
+        if not icon:
+            return None
 
-                if icon:
-                    self.found_icons[icon_name] = True
-                    icon.save(os.path.join(self.icon_dir, icon_name + '.png'),
-                              'PNG')
+        self.found_icons[icon_name] = True
+        for size in ICON_SIZES:
+            if icon.size != (size, size):
+                variant = icon.resize((size, size), Image.ANTIALIAS)
+            else:
+                variant = icon
+
+            # write then rename so pages, and other indexer processes
+            # writing the same icon, never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.icon_dir)
+            f = os.fdopen(fd, 'wb')
+            try:
+                variant.save(f, 'PNG')
+            finally:
+                f.close()
+            os.chmod(tmp_path, 0644)
+            os.rename(tmp_path, os.path.join(self.icon_dir,
+                                             icon_file_name(icon_name, size)))
 
-                    return icon_name
+        return icon_name
 
     def close(self):
         for cache in self._rpm_caches:
             if isinstance(cache, RPMCache):
                 cache.close()
+
+
+def icon_file_name(icon_name, size=128):
+    """ 128x128 icons keep the plain name pages have always linked to """
+    if size == 128:
+        return icon_name + '.png'
+    return '%s_%dx%d.png' % (icon_name, size, size)
+
+
+def write_icon_sprite(icon_dir, size=SPRITE_SIZE, columns=SPRITE_COLUMNS):
+    """ Packs every size x size icon in icon_dir into one sprite sheet,
+        icons-<size>.png, next to an icons-<size>.json index of
+        {icon_name: [x, y]} offsets so a page can load a single image
+    """
+    suffix = '_%dx%d.png' % (size, size)
+    icon_names = sorted([f[:-len(suffix)] for f in os.listdir(icon_dir)
+                         if f.endswith(suffix)])
+    if not icon_names:
+        return 0
+
+    rows = (len(icon_names) + columns - 1) / columns
+    sprite = Image.new('RGBA', (columns * size, rows * size), (0, 0, 0, 0))
+    index = {}
+    for i, icon_name in enumerate(icon_names):
+        x = (i % columns) * size
+        y = (i / columns) * size
+        try:
+            icon = Image.open(os.path.join(icon_dir, icon_name + suffix))
+            sprite.paste(icon.convert('RGBA'), (x, y))
+        except Exception:
+            continue
+        index[icon_name] = [x, y]
+
+    sprite_name = 'icons-%d' % size
+    sprite.save(os.path.join(icon_dir, sprite_name + '.png.tmp'), 'PNG')
+    f = open(os.path.join(icon_dir, sprite_name + '.json.tmp'), 'w')
+    json.dump({'size': size, 'icons': index}, f)
+    f.close()
+
+    # swap both in together so the index always matches the sheet
+    os.rename(os.path.join(icon_dir, sprite_name + '.png.tmp'),
+              os.path.join(icon_dir, sprite_name + '.png'))
+    os.rename(os.path.join(icon_dir, sprite_name + '.json.tmp'),
+              os.path.join(icon_dir, sprite_name + '.json'))
+
+    return len(index)
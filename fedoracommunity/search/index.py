@@ -4,37 +4,69 @@ and then populates it with packages from yum repositories
 """
 import os
 import sys
+import time
 import shutil
 import urllib2
+import hashlib
 import tempfile
+import multiprocessing
 import xappy
 
 from os.path import join, dirname
 
-from utils import filter_search_string
+from utils import filter_search_string, package_name_term
 from fedora.client import PackageDB, ServerError
 from rpmcache import RPMCache
 from parsers import DesktopParser, SimpleSpecfileParser
-from iconcache import IconCache
+from iconcache import IconCache, ICON_SIZES
+from filecache import ExtractedFileCache
+from payload import dump_payload, load_payload
+from completions import write_completions
+from suggestions import write_suggestions, is_plain_provide
 
 
 # how many time to retry a downed server
 MAX_RETRY = 10
 
+# Goes into every package checksum, so bump it whenever what we store in a
+# document changes and incremental runs rebuild the documents they would
+# otherwise keep in the old format.
+#   2: compact binary payloads
+#   3: XPKG: package name terms
+#   4: rebuild documents indexed with the withdrawn field weights
+INDEX_FORMAT_VERSION = 4
+
+# theme packages icons named in desktop files are looked up in
+ICON_THEMES = ['gnome-icon-theme', 'oxygen-icon-theme']
+
+# how many seconds a saved owners list is used before asking PackageDB
+OWNERS_MAX_AGE = 6 * 60 * 60
+
+# how many bytes of extracted desktop files and icons to keep between runs
+EXTRACT_CACHE_SIZE = 1024 * 1024 * 1024
+
 try:
     import json
 except ImportError:
     import simplejson as json
 
 class Indexer(object):
-    def __init__(self, cache_path, yum_conf, tagger_url=None, pkgdb_url=None):
+    def __init__(self, cache_path, yum_conf, tagger_url=None, pkgdb_url=None,
+                 incremental=False, extract_cache_size=EXTRACT_CACHE_SIZE,
+                 stream_rpms=True, owners_max_age=OWNERS_MAX_AGE):
         self.cache_path = cache_path
         self.dbpath = join(cache_path, 'search')
         self.yum_cache_path = join(cache_path, 'yum-cache')
         self.icons_path = join(cache_path, 'icons')
+        self.file_cache = ExtractedFileCache(join(cache_path, 'extracted'),
+                                             extract_cache_size)
         self.yum_conf = yum_conf
+        self.incremental = incremental
+        self.stream_rpms = stream_rpms
         self.create_index()
         self._owners_cache = None
+        self.owners_path = join(cache_path, 'owners.json')
+        self.owners_max_age = owners_max_age
         self.default_icon = 'package_128x128'
         self.tagger_url = tagger_url
         if pkgdb_url:
@@ -43,8 +75,18 @@ class Indexer(object):
             self.pkgdb_client = PackageDB()
 
     def create_index(self):
-        """ Create a new index, and set up its field structure """
+        """ Create a new index, and set up its field structure
+
+            In incremental mode an existing index is opened as is
+        """
+        if not self.incremental and os.path.exists(self.dbpath):
+            shutil.rmtree(self.dbpath)
+
         iconn = xappy.IndexerConnection(self.dbpath)
+        self.iconn = iconn
+        if iconn.get_fields_with_actions():
+            # existing index already has its field structure
+            return
 
         iconn.add_field_action('exact_name', xappy.FieldActions.INDEX_FREETEXT)
         iconn.add_field_action('name', xappy.FieldActions.INDEX_FREETEXT,
@@ -70,21 +112,59 @@ class Indexer(object):
         #iconn.add_field_action('requires', xappy.FieldActions.INDEX_EXACT)
         #iconn.add_field_action('provides', xappy.FieldActions.INDEX_EXACT)
 
-        self.iconn = iconn
+    def load_owners(self):
+        """ Returns a {package_name: owner} mapping, reusing the copy saved
+            by an earlier run while it is younger than owners_max_age
+            instead of pulling all the acls from PackageDB again
+        """
+        saved = None
+        if os.path.exists(self.owners_path):
+            try:
+                f = open(self.owners_path)
+                saved = json.load(f)
+                f.close()
+            except (IOError, ValueError) as e:
+                print "Ignoring unreadable owners list %s: %s" % (
+                    self.owners_path, e)
+                saved = None
+
+        if saved is not None and not (
+                isinstance(saved, dict) and
+                isinstance(saved.get('timestamp'), (int, long, float)) and
+                isinstance(saved.get('owners'), dict)):
+            print "Ignoring malformed owners list %s" % self.owners_path
+            saved = None
+
+        if saved and time.time() - saved['timestamp'] < self.owners_max_age:
+            print "Using owners list cached at %s" % time.ctime(saved['timestamp'])
+            return saved['owners']
+
+        print "Caching the owners list from PackageDB"
+        try:
+            acls = self.pkgdb_client.get_bugzilla_acls()
+        except ServerError as e:
+            if not saved:
+                raise
+            print "Could not refresh owners list (%s), using the old one" % e
+            return saved['owners']
+
+        owners = {}
+        for pkg_name, pkg_acls in acls['Fedora'].items():
+            owners[pkg_name] = pkg_acls['owner']
+
+        tmp_path = self.owners_path + '.tmp'
+        f = open(tmp_path, 'w')
+        json.dump({'timestamp': time.time(), 'owners': owners}, f)
+        f.close()
+        os.rename(tmp_path, self.owners_path)
+
+        return owners
 
     def find_devel_owner(self, pkg_name, retry=0):
         if self._owners_cache == None:
-            print "Caching the owners list from PackageDB"
+            self._owners_cache = self.load_owners()
 
-            self._owners_cache = self.pkgdb_client.get_bugzilla_acls()
-
-        try:
-            mainowner = self._owners_cache['Fedora'][pkg_name]['owner']
-            print 'Owner: %s' % mainowner
-            return mainowner
-        except KeyError:
-            print 'Owner: None'
-            return ''
+        return self._owners_cache.get(pkg_name, '')
 
     def index_yum_pkgs(self):
         """
@@ -109,38 +189,21 @@ class Indexer(object):
             ...
            }
         """
-        import yum
-        yb = yum.YumBase()
-        self.yum_base = yb
-
         if not os.path.exists(self.yum_cache_path):
             os.mkdir(self.yum_cache_path)
 
         if not os.path.exists(self.icons_path):
             os.mkdir(self.icons_path)
 
-        yb.doConfigSetup(self.yum_conf, root=os.getcwd(), init_plugins=False)
-        for r in yb.repos.findRepos('*'):
-            if r.id in ['rawhide-x86_64', 'rawhide-source']:
-                r.enable()
-            else:
-                r.disable()
-
-        yb._getRepos(doSetup = True)
-        yb._getSacks(['x86_64', 'noarch', 'src'])
-        yb.doRepoSetup()
-        yb.doSackFilelistPopulate()
-
-        # Doesn't work right now due to a bug in yum.
-        # https://bugzilla.redhat.com/show_bug.cgi?id=750593
-        #yb.disablePlugins()
-
-        yb.conf.cache = 1
+        yb = self.setup_yum()
+        self.yum_base = yb
 
-        self.icon_cache = IconCache(yb, ['gnome-icon-theme', 'oxygen-icon-theme'], self.icons_path, self.cache_path)
+        self.icon_cache = IconCache(yb, ICON_THEMES, self.icons_path, self.cache_path, self.file_cache, self.stream_rpms)
 
         pkgs = yb.pkgSack.returnPackages()
         base_pkgs = {}
+        # {provide: set(package names)} for the suggestions table
+        self.provides = {}
         seen_pkg_names = []
 
         # get the tagger data
@@ -196,6 +259,10 @@ class Indexer(object):
 
             seen_pkg_names.append(pkg.name)
 
+            for provide in pkg.provides_names:
+                if provide != pkg.name and is_plain_provide(provide):
+                    self.provides.setdefault(provide, set()).add(pkg.name)
+
             if pkg.base_package_name == pkg.name:
                 # this is the main package
                 if not base_pkg['src_pkg']:
@@ -220,10 +287,47 @@ class Indexer(object):
 
         return base_pkgs
 
+    def setup_yum(self, cache_only=False):
+        """ Returns a YumBase set up with the rawhide repos
+
+            With cache_only the metadata an earlier setup downloaded is
+            used as is
+        """
+        import yum
+        yb = yum.YumBase()
+
+        yb.doConfigSetup(self.yum_conf, root=os.getcwd(), init_plugins=False)
+        if cache_only:
+            yb.conf.cache = 1
+
+        for r in yb.repos.findRepos('*'):
+            if r.id in ['rawhide-x86_64', 'rawhide-source']:
+                r.enable()
+            else:
+                r.disable()
+
+        yb._getRepos(doSetup = True)
+        yb._getSacks(['x86_64', 'noarch', 'src'])
+        yb.doRepoSetup()
+        yb.doSackFilelistPopulate()
+
+        # Doesn't work right now due to a bug in yum.
+        # https://bugzilla.redhat.com/show_bug.cgi?id=750593
+        #yb.disablePlugins()
+
+        yb.conf.cache = 1
+
+        return yb
+
     def index_desktop_file(self, doc, desktop_file, pkg_dict, desktop_file_cache):
         doc.fields.append(xappy.Field('tag', 'desktop'))
 
         dp = DesktopParser(desktop_file)
+        desktop_name = dp.get('Name', '')
+        if desktop_name:
+            # offered as a synonym for the package by the suggestions table
+            pkg_dict.setdefault('desktop_names', []).append(desktop_name)
+
         category = dp.get('Categories', '')
 
         for c in category.split(';'):
@@ -243,10 +347,17 @@ class Indexer(object):
     def index_files(self, doc, pkg_dict):
         yum_pkg = pkg_dict['pkg']
         if yum_pkg != None:
-            desktop_file_cache = RPMCache(yum_pkg, self.yum_base, self.cache_path)
-            desktop_file_cache.open()
+            # file names come from the repodata filelists, the rpm itself
+            # is only fetched if we need to look inside a desktop file
+            desktop_file_cache = None
             for filename in yum_pkg.filelist:
                 if filename.endswith('.desktop'):
+                    if desktop_file_cache is None:
+                        desktop_file_cache = RPMCache(yum_pkg, self.yum_base,
+                                                      self.cache_path,
+                                                      file_cache=self.file_cache,
+                                                      stream=self.stream_rpms)
+                        desktop_file_cache.open()
                     # index apps
                     print "        indexing desktop file %s" % os.path.basename(filename)
                     f = desktop_file_cache.open_file(filename, decompress_filter='*.desktop')
@@ -262,7 +373,8 @@ class Indexer(object):
                     exe_name = filter_search_string(os.path.basename(filename))
                     doc.fields.append(xappy.Field('cmd', "EX__%s__EX" % exe_name))
 
-            desktop_file_cache.close()
+            if desktop_file_cache is not None:
+                desktop_file_cache.close()
 
     def index_spec(self, doc, pkg, src_rpm_cache):
         # don't use this but keep it here if we need to index spec files
@@ -296,87 +408,318 @@ class Indexer(object):
             for i in range(total):
                 doc.fields.append(xappy.Field('tag', tag_name))
 
-    def index_pkgs(self):
-        yum_pkgs = self.index_yum_pkgs()
-        pkg_count = 0
+    def build_pkg_doc(self, pkg, pkg_count):
+        """ Build the unprocessed document for a base package and its
+            sub packages.
 
-        for pkg in yum_pkgs.values():
-            pkg_count += 1
+            Returns the document and the number of packages it covers
+        """
+        start_count = pkg_count
+        pkg_count += 1
+
+        doc = xappy.UnprocessedDocument()
+        filtered_name = filter_search_string(pkg['name'])
+        filtered_summary = filter_search_string(pkg['summary'])
+        filtered_description = filter_search_string(pkg['description'])
+
+        if pkg['name'] != filtered_name:
+            print("%d: indexing %s as %s" % (pkg_count, pkg['name'], filtered_name) )
+        else:
+            print("%d: indexing %s" % (pkg_count, pkg['name']))
+
+        doc.fields.append(xappy.Field('exact_name', 'EX__' + filtered_name + '__EX', weight=10.0))
 
-            doc = xappy.UnprocessedDocument()
-            filtered_name = filter_search_string(pkg['name'])
-            filtered_summary = filter_search_string(pkg['summary'])
-            filtered_description = filter_search_string(pkg['description'])
+        name_parts = filtered_name.split('_')
+        for i in range(20):
+            if len(name_parts) > 1:
+                for part in name_parts:
+                    doc.fields.append(xappy.Field('name', part, weight=1.0))
+            doc.fields.append(xappy.Field('name', filtered_name, weight=10.0))
 
-            if pkg['name'] != filtered_name:
-                print("%d: indexing %s as %s" % (pkg_count, pkg['name'], filtered_name) )
+        for i in range(4):
+            doc.fields.append(xappy.Field('summary', filtered_summary, weight=1.0))
+        doc.fields.append(xappy.Field('description', filtered_description, weight=0.2))
+
+        self.index_files(doc, pkg)
+        self.index_tags(doc, pkg)
+
+        for sub_pkg in pkg['sub_pkgs']:
+            pkg_count += 1
+            filtered_sub_pkg_name = filter_search_string(sub_pkg['name'])
+            if filtered_sub_pkg_name != sub_pkg['name']:
+                print("%d:    indexing subpkg %s as %s" % (pkg_count, sub_pkg['name'], filtered_sub_pkg_name))
             else:
-                print("%d: indexing %s" % (pkg_count, pkg['name']))
+                print("%d:    indexing subpkg %s" % (pkg_count, sub_pkg['name']))
 
-            doc.fields.append(xappy.Field('exact_name', 'EX__' + filtered_name + '__EX', weight=10.0))
+            doc.fields.append(xappy.Field('subpackages', filtered_sub_pkg_name, weight=1.0))
+            doc.fields.append(xappy.Field('exact_name', 'EX__' + filtered_sub_pkg_name + '__EX', weight=10.0))
 
-            name_parts = filtered_name.split('_')
-            for i in range(20):
-                if len(name_parts) > 1:
-                    for part in name_parts:
-                        doc.fields.append(xappy.Field('name', part, weight=1.0))
-                doc.fields.append(xappy.Field('name', filtered_name, weight=10.0))
+            self.index_files(doc, sub_pkg)
+            self.index_tags(doc, sub_pkg)
+            if sub_pkg['icon'] != self.default_icon and pkg['icon'] == self.default_icon:
+                pkg['icon'] = sub_pkg['icon']
 
-            for i in range(4):
-                doc.fields.append(xappy.Field('summary', filtered_summary, weight=1.0))
-            doc.fields.append(xappy.Field('description', filtered_description, weight=0.2))
+            # remove anything we don't want to store
+            del sub_pkg['pkg']
 
-            self.index_files(doc, pkg)
-            self.index_tags(doc, pkg)
+        # @@: Right now we're only indexing the first part of the
+        # provides/requires, and not boolean comparison or version
+        #for requires in pkg.requires:
+        #    print requires[0]
+        #    doc.fields.append(xappy.Field('requires', requires[0]))
+        #for provides in pkg.provides:
+        #    doc.fields.append(xappy.Field('provides', provides[0]))
 
-            for sub_pkg in pkg['sub_pkgs']:
-                pkg_count += 1
-                filtered_sub_pkg_name = filter_search_string(sub_pkg['name'])
-                if filtered_sub_pkg_name != sub_pkg['name']:
-                    print("%d:    indexing subpkg %s as %s" % (pkg_count, sub_pkg['name'], filtered_sub_pkg_name))
-                else:
-                    print("%d:    indexing subpkg %s" % (pkg_count, sub_pkg['name']))
-
-                doc.fields.append(xappy.Field('subpackages', filtered_sub_pkg_name, weight=1.0))
-                doc.fields.append(xappy.Field('exact_name', 'EX__' + filtered_sub_pkg_name + '__EX', weight=10.0))
-
-                self.index_files(doc, sub_pkg)
-                self.index_tags(doc, sub_pkg)
-                if sub_pkg['icon'] != self.default_icon and pkg['icon'] == self.default_icon:
-                    pkg['icon'] = sub_pkg['icon']
-
-                # remove anything we don't want to store
-                del sub_pkg['pkg']
-
-            # @@: Right now we're only indexing the first part of the
-            # provides/requires, and not boolean comparison or version
-            #for requires in pkg.requires:
-            #    print requires[0]
-            #    doc.fields.append(xappy.Field('requires', requires[0]))
-            #for provides in pkg.provides:
-            #    doc.fields.append(xappy.Field('provides', provides[0]))
-
-
-            # remove anything we don't want to store and then store data in
-            # json format
-            del pkg['pkg']
-            del pkg['src_pkg']
-
-            processed_doc = self.iconn.process(doc, False)
-            processed_doc._doc.set_data(json.dumps(pkg))
-            # preempt xappy's processing of data
-            processed_doc._data = None
+
+        # remove anything we don't want to store
+        del pkg['pkg']
+        del pkg['src_pkg']
+
+        return doc, pkg_count - start_count
+
+    def pkg_checksum(self, pkg):
+        """ Calculate a checksum over everything that goes into a base
+            package's document so incremental runs can tell if it changed
+        """
+        pkg_ids = []
+        for yum_pkg in [pkg['src_pkg'], pkg['pkg']] + \
+                [sub_pkg['pkg'] for sub_pkg in pkg['sub_pkgs']]:
+            if yum_pkg is not None:
+                pkg_ids.append('%s %s' % (yum_pkg.ui_nevra, yum_pkg.checksum))
+        pkg_ids.sort()
+
+        tags = None
+        if self.tagger_cache:
+            tags = [self.tagger_cache.get(name, []) for name in
+                    [pkg['name']] + [s['name'] for s in pkg['sub_pkgs']]]
+
+        checksum = hashlib.sha1()
+        checksum.update('%d\n' % INDEX_FORMAT_VERSION)
+        checksum.update('\n'.join(pkg_ids))
+        checksum.update(json.dumps([pkg['devel_owner'], tags]))
+        # icons come out of the theme packages, so a new theme or new
+        # icon sizes have to regenerate them
+        checksum.update(json.dumps([self.icon_cache.themes(), ICON_SIZES]))
+
+        return checksum.hexdigest()
+
+    def get_indexed_checksums(self):
+        """ Returns {base_package_name: (doc_id, checksum)} for every
+            document already in the index
+        """
+        indexed = {}
+        for doc in self.iconn.iter_documents():
+            data = load_payload(doc._doc.get_data(), descriptions=False)
+            indexed[data['name']] = (doc.id, data.get('checksum'))
+
+        return indexed
+
+    def store_pkg_doc(self, doc, pkg, replace=False):
+        """ Process a document and add it to the index with the package
+            data stored as a compact payload
+        """
+        doc.id = pkg['name']
+        processed_doc = self.iconn.process(doc, False)
+        processed_doc._doc.set_data(dump_payload(pkg))
+        # lets get_package_info go straight to the document
+        processed_doc._doc.add_boolean_term(package_name_term(pkg['name']))
+        for sub_pkg in pkg['sub_pkgs']:
+            processed_doc._doc.add_boolean_term(package_name_term(sub_pkg['name']))
+        # preempt xappy's processing of data
+        processed_doc._data = None
+        if replace:
+            self.iconn.replace(processed_doc)
+        else:
             self.iconn.add(processed_doc)
 
+    def build_pkg_docs(self, pkgs, jobs=1):
+        """ Generate (doc, pkg) for each of the base packages in pkgs,
+            in order, building them in jobs worker processes
+        """
+        if jobs > 1:
+            for result in self._build_pkg_docs_parallel(pkgs, jobs):
+                yield result
+            return
+
+        pkg_count = 0
+        for pkg in pkgs:
+            doc, count = self.build_pkg_doc(pkg, pkg_count)
+            pkg_count += count
+            yield doc, pkg
+
+    def index_pkgs(self, jobs=1):
+        yum_pkgs = self.index_yum_pkgs()
+        pkg_count = 0
+
+        pkgs = yum_pkgs.values()
+        for pkg in pkgs:
+            pkg['src_nevra'] = pkg['src_pkg'] and pkg['src_pkg'].ui_nevra
+            pkg['checksum'] = self.pkg_checksum(pkg)
+            pkg_count += 1 + len(pkg['sub_pkgs'])
+
+        for doc, pkg in self.build_pkg_docs(pkgs, jobs):
+            self.store_pkg_doc(doc, pkg)
+
+        self.iconn.flush()
+        write_completions(self.dbpath, pkgs)
+        self.build_suggestions()
+        self.icon_cache.close()
+        self.prune_file_cache()
+
+        return pkg_count
+
+    def index_pkgs_incremental(self, jobs=1):
+        """ Only re-index the base packages whose checksum differs from the
+            one recorded in the index and drop the ones which went away
+        """
+        yum_pkgs = self.index_yum_pkgs()
+        indexed = self.get_indexed_checksums()
+        pkg_count = 0
+
+        changed_pkgs = []
+        for pkg in yum_pkgs.values():
+            pkg['src_nevra'] = pkg['src_pkg'] and pkg['src_pkg'].ui_nevra
+            pkg['checksum'] = self.pkg_checksum(pkg)
+            doc_id, checksum = indexed.get(pkg['name'], (None, None))
+            if checksum == pkg['checksum']:
+                continue
+
+            if doc_id is not None and doc_id != pkg['name']:
+                # documents from older runs were given generated ids
+                self.iconn.delete(doc_id)
+
+            changed_pkgs.append(pkg)
+            pkg_count += 1 + len(pkg['sub_pkgs'])
+
+        removed_count = 0
+        for name, (doc_id, checksum) in indexed.items():
+            if name not in yum_pkgs:
+                print "removing %s" % name
+                self.iconn.delete(doc_id)
+                removed_count += 1
+
+        print "%d changed, %d removed, %d unchanged" % (
+            len(changed_pkgs), removed_count,
+            len(yum_pkgs) - len(changed_pkgs))
+
+        for doc, pkg in self.build_pkg_docs(changed_pkgs, jobs):
+            self.store_pkg_doc(doc, pkg, replace=True)
+
+        self.iconn.flush()
+        write_completions(self.dbpath, yum_pkgs.values())
+        self.build_suggestions()
         self.icon_cache.close()
+        self.prune_file_cache()
 
         return pkg_count
 
-def run(cache_path, yum_conf, tagger_url=None, pkgdb_url=None):
-    indexer = Indexer(cache_path, yum_conf, tagger_url, pkgdb_url)
+    def build_suggestions(self):
+        """ Write the synonym table from the provides seen in yum and the
+            .desktop names recorded in the documents, which in incremental
+            mode includes the ones we did not rebuild this time
+        """
+        synonyms = self.provides
+        pkg_names = []
+        for doc in self.iconn.iter_documents():
+            data = load_payload(doc._doc.get_data(), descriptions=False)
+            for pkg in [data] + data['sub_pkgs']:
+                pkg_names.append(pkg['name'])
+                for desktop_name in pkg.get('desktop_names', []):
+                    synonyms.setdefault(desktop_name, set()).add(pkg['name'])
+
+        write_suggestions(self.dbpath, synonyms, pkg_names)
+
+    def prune_file_cache(self):
+        print "Extracted file cache: %d hits, %d misses" % (
+            self.file_cache.hits, self.file_cache.misses)
+        removed = self.file_cache.prune()
+        if removed:
+            print "Evicted %d files from the extracted file cache" % removed
+
+    def _build_pkg_docs_parallel(self, pkgs, jobs):
+        """ Build documents in a pool of forked worker processes and hand
+            them back in the same order as a serial run so our single
+            IndexerConnection writes them out identically
+        """
+        global _worker_indexer
 
-    print "Indexing packages from Yum..."
-    count = indexer.index_pkgs()
+        # work out the running package count up front so worker output
+        # is numbered just like a serial run
+        work = []
+        pkg_count = 0
+        for i, pkg in enumerate(pkgs):
+            work.append((i, pkg_count))
+            pkg_count += 1 + len(pkg['sub_pkgs'])
+
+        # workers are forked and inherit the icon caches and tagger data
+        # from us.  The theme icons are extracted once here rather than by
+        # every worker into the same directory.
+        self.icon_cache.prefetch()
+        self._worker_pkgs = pkgs
+        _worker_indexer = self
+        pool = multiprocessing.Pool(jobs, _init_worker)
+        try:
+            for fields, pkg in pool.imap(_build_pkg_doc_worker, work):
+                doc = xappy.UnprocessedDocument()
+                for (name, value, weight) in fields:
+                    doc.fields.append(xappy.Field(name, value, weight=weight))
+                yield doc, pkg
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _worker_indexer = None
+            self._worker_pkgs = None
+
+# the Indexer inherited by forked worker processes
+_worker_indexer = None
+
+def _init_worker():
+    # the sqlite handles behind the inherited yum sack belong to the
+    # parent, each worker reads the cached metadata through its own
+    _worker_indexer.yum_base = _worker_indexer.setup_yum(cache_only=True)
+
+def _worker_yum_pkg(yum_pkg):
+    """ Returns the worker's own copy of a package from the parent's sack """
+    if yum_pkg is None:
+        return None
+
+    for match in _worker_indexer.yum_base.pkgSack.searchPkgTuple(yum_pkg.pkgtup):
+        if match.repoid == yum_pkg.repoid:
+            return match
+
+    print "%s is missing from the worker's yum sack" % yum_pkg.ui_nevra
+    return None
+
+def _build_pkg_doc_worker(args):
+    i, pkg_count = args
+    pkg = _worker_indexer._worker_pkgs[i]
+    pkg['pkg'] = _worker_yum_pkg(pkg['pkg'])
+    for sub_pkg in pkg['sub_pkgs']:
+        sub_pkg['pkg'] = _worker_yum_pkg(sub_pkg['pkg'])
+    doc, count = _worker_indexer.build_pkg_doc(pkg, pkg_count)
+
+    # send back plain tuples rather than xappy objects
+    fields = [(f.name, f.value, f.weight) for f in doc.fields]
+    return fields, pkg
+
+def run(cache_path, yum_conf, tagger_url=None, pkgdb_url=None, jobs=1,
+        incremental=False, extract_cache_size=EXTRACT_CACHE_SIZE,
+        stream_rpms=True, owners_max_age=OWNERS_MAX_AGE):
+    indexer = Indexer(cache_path, yum_conf, tagger_url, pkgdb_url,
+                      incremental=incremental,
+                      extract_cache_size=extract_cache_size,
+                      stream_rpms=stream_rpms,
+                      owners_max_age=owners_max_age)
+
+    if incremental:
+        print "Incrementally indexing packages from Yum..."
+        count = indexer.index_pkgs_incremental(jobs=jobs)
+    else:
+        print "Indexing packages from Yum..."
+        count = indexer.index_pkgs(jobs=jobs)
     print "Indexed %d packages." % count
 
 if __name__ == '__main__':
@@ -7,8 +7,32 @@ import rpm
 
 from distmappings import tags, tags_to_name_map
 from utils import filter_search_string
+from events import make_event_source
 
 import time
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+# how many koji sessions to fetch tag listings with in parallel
+KOJI_SESSIONS = 4
+
+# how many calls to send in one koji multicall
+MULTICALL_SIZE = 100
+
+# how many changed entries to hold in memory before writing them out
+FLUSH_EVERY = 500
+
+# how many tag events the consumer batches up, and for at most how many
+# seconds, before applying them to the index
+CONSUME_BATCH_SIZE = 50
+CONSUME_MAX_DELAY = 5.0
+
+# how many seconds the consumer waits for the version map lock before
+# keeping a batch for later, and how many events it keeps at most; update
+# runs pick up anything it had to drop
+CONSUME_LOCK_TIMEOUT = 30
+CONSUME_MAX_PENDING = 1000
 
 try:
     import json
@@ -40,62 +64,144 @@ class Mapper(object):
 
     Last run timestamp is indexed by the _last_run_ key.
     """
-    def __init__(self, dbpath, koji_url='http://koji.fedoraproject.org/kojihub'):
+    def __init__(self, dbpath, koji_url='http://koji.fedoraproject.org/kojihub',
+                 koji_sessions=KOJI_SESSIONS, multicall_size=MULTICALL_SIZE,
+                 flush_every=FLUSH_EVERY, open_index=True):
         self.dbpath = dbpath
-        self.create_index()
-
-        self.koji_client = koji.ClientSession('http://koji.fedoraproject.org/kojihub')
-        self.koji_client.opts['anon_retry'] = True
-        self.koji_client.opts['offline_retry'] = True
+        self.iconn = None
+        self.versionmap = {}
+        self._dirty_keys = set()
+
+        if not koji_url:
+            koji_url = 'http://koji.fedoraproject.org/kojihub'
+        self.koji_url = koji_url
+        self.koji_sessions = koji_sessions
+        self.multicall_size = multicall_size
+        self.flush_every = flush_every
+        # koji sessions are not thread safe so each pool thread gets its own
+        self._local = threading.local()
+        self.koji_client = self.get_koji_client()
         self.updated_packages = {}
         self.new_packages = {}
-        self.found_packages = {}
-        self.sconn_needs_reload = False
+        if open_index:
+            self.open_index()
+
+    def get_koji_client(self):
+        koji_client = getattr(self._local, 'koji_client', None)
+        if koji_client is None:
+            koji_client = koji.ClientSession(self.koji_url)
+            koji_client.opts['anon_retry'] = True
+            koji_client.opts['offline_retry'] = True
+            self._local.koji_client = koji_client
+
+        return koji_client
+
+    def get_tagged_builds(self, tag):
+        """ Returns (tag, {package_name: latest_build}) for a koji tag,
+            following inheritance just like getLatestBuilds does
+        """
+        print "Getting latest builds for %s" % tag
+        builds = self.get_koji_client().listTagged(tag, inherit=True,
+                                                   latest=True)
+        latest = {}
+        for build in builds:
+            latest[build['package_name']] = build
 
+        return tag, latest
 
     def create_index(self):
         self.iconn = xappy.IndexerConnection(self.dbpath)
-        self.sconn = xappy.SearchConnection(self.dbpath)
 
         # keys are filtered package names or "_last_run_"
         self.iconn.add_field_action('key', xappy.FieldActions.INDEX_EXACT)
 
-    def search(self, key):
-        if self.sconn_needs_reload:
-            self.sconn.reopen()
-        q = self.sconn.query_parse('key:%s' % filter_search_string(key)) 
-        results = self.sconn.search(q, 0, 1)
-
-        return results
+    def open_index(self):
+        """ Open the index for writing, which holds xapian's write lock
+            until close_index, and load the versionmap from it
+        """
+        self.create_index()
+        self.load_versionmap()
 
-    def get_timestamp_doc(self):
-        results = self.search('_last_run_')
-        if not results:
-            return None
-        return results[0]
+    def close_index(self):
+        """ Write out anything pending and let go of the index """
+        self.write_back()
+        self.iconn.close()
+        self.iconn = None
 
-    def get_current_timestamp(self):
-        doc = self.get_timestamp_doc()
-        if not doc:
+    def load_versionmap(self):
+        """ Read the whole versionmap into {key: [doc_id, payload]} so
+            lookups never need to parse and run a query
+        """
+        self.versionmap = {}
+        self._dirty_keys = set()
+
+        key_prefix = self.iconn._field_mappings.get_prefix('key')
+        for doc in self.iconn.iter_documents():
+            for t in doc._doc.termlist():
+                if t.term.startswith(key_prefix):
+                    key = t.term[len(key_prefix):]
+                    self.versionmap[key] = [doc.id, doc._doc.get_data()]
+                    break
+
+    def get_payload(self, key):
+        """ Returns the payload stored for key or None """
+        entry = self.versionmap.get(filter_search_string(key))
+        if entry is None:
             return None
-        time_stamp = doc._doc.get_data()
-        return time_stamp
+        return entry[1]
 
-    def update_timestamp(self, timestamp):
-        doc = self.get_timestamp_doc()
-        if doc:
-            doc._doc.set_data(str(timestamp))
-            self.iconn.replace(doc)
-            self.iconn.flush()
+    def set_payload(self, key, payload):
+        """ Stores payload for key in memory, to be written out by
+            write_back
+        """
+        key = filter_search_string(key)
+        entry = self.versionmap.get(key)
+        if entry is None:
+            self.versionmap[key] = [None, payload]
         else:
+            entry[1] = payload
+        self._dirty_keys.add(key)
+
+        if len(self._dirty_keys) >= self.flush_every:
+            self.write_back()
+
+    def write_back(self):
+        """ Write every changed entry to the index and flush it """
+        for key in self._dirty_keys:
+            entry = self.versionmap[key]
+
             doc = xappy.UnprocessedDocument()
-            doc.fields.append(xappy.Field('key', '_last_run_'))
+            doc.fields.append(xappy.Field('key', key))
+            doc.id = entry[0]
             processed_doc = self.iconn.process(doc, False)
-            processed_doc._doc.set_data(str(timestamp))
+            processed_doc._doc.set_data(entry[1])
             # preempt xappy's processing of data
             processed_doc._data = None
-            self.iconn.add(processed_doc)
-            self.iconn.flush()
+
+            if entry[0] is None:
+                entry[0] = self.iconn.add(processed_doc)
+            else:
+                self.iconn.replace(processed_doc)
+
+        self.iconn.flush()
+        self._dirty_keys = set()
+
+    def get_current_timestamp(self):
+        return self.get_payload('_last_run_')
+
+    def update_timestamp(self, timestamp):
+        self.set_payload('_last_run_', str(timestamp))
+        self.write_back()
+
+    def get_consumer_timestamp(self):
+        return self.get_payload('_consumer_last_run_')
+
+    def update_consumer_timestamp(self, timestamp):
+        """ Record when the consumer last wrote, apart from _last_run_
+            so update runs still ask koji for anything it missed
+        """
+        self.set_payload('_consumer_last_run_', str(timestamp))
+        self.write_back()
 
     def init_db(self, *args):
         """
@@ -107,6 +213,17 @@ class Mapper(object):
 
         print "Initializing Index"
         package_list = self.koji_client.listPackages()
+
+        # one listTagged call per tag, spread over a few sessions, instead
+        # of a getLatestBuilds call for every package in every tag
+        tag_names = list(set([t['tag'] for t in tags]))
+        pool = ThreadPool(min(self.koji_sessions, len(tag_names)))
+        try:
+            tagged_builds = dict(pool.map(self.get_tagged_builds, tag_names))
+        finally:
+            pool.close()
+            pool.join()
+
         i = 0
         for pkg in package_list:
             i += 1
@@ -125,43 +242,143 @@ class Mapper(object):
                     # short circuit optimization
                     continue
 
-                builds = self.koji_client.getLatestBuilds(tag, package=pkg_name)
-                if builds:
-                    build = None
-                    for b in builds:
-                        # only get builds which completed
-                        if b['state'] == koji.BUILD_STATES['COMPLETE']:
-                            build = b
-                            break
-
-                    if build:
-                        data = {'version': build['version'],
-                                'release': build['release'],
-                                'build_id': build['build_id']}
-
-                        if build.get('epoch', None) != None:
-                            data['epoch'] = str(build['epoch'])
-                            version_display = "%s:%s.%s" % (data['epoch'], data['version'], data['release'])
-                        else:
-                            version_display = "%s.%s" % (data['version'], data['release'])
-
-                        latest_builds[t['name']] = data
-                        print "    %s: %s" % (t['name'], version_display)
+                build = tagged_builds[tag].get(pkg_name)
+                # only get builds which completed
+                if build and build['state'] == koji.BUILD_STATES['COMPLETE']:
+                    data = {'version': build['version'],
+                            'release': build['release'],
+                            'build_id': build['build_id']}
+
+                    if build.get('epoch', None) != None:
+                        data['epoch'] = str(build['epoch'])
+                        version_display = "%s:%s.%s" % (data['epoch'], data['version'], data['release'])
+                    else:
+                        version_display = "%s.%s" % (data['version'], data['release'])
+
+                    latest_builds[t['name']] = data
+                    print "    %s: %s" % (t['name'], version_display)
 
             if len(latest_builds) < 2:
                 # don't process doc if there is no real data
                 # most likely this is an outdated package
                 continue
 
-            processed_doc = self.iconn.process(doc, False)
-            processed_doc._doc.set_data(json.dumps(latest_builds))
-            # preempt xappy's processing of data
-            processed_doc._data = None
-            self.iconn.add(processed_doc)
+            self.set_payload(pkg_name, json.dumps(latest_builds))
 
         print "Finished updating timestamp"
         self.update_timestamp(self.new_timestamp)
 
+    def koji_multicall(self, method, calls):
+        """ Makes each (args, kwargs) call to a koji method through
+            multicall in batches of multicall_size, returning the results
+            in order with None for any call which failed
+        """
+        koji_client = self.get_koji_client()
+        results = []
+        for i in range(0, len(calls), self.multicall_size):
+            koji_client.multicall = True
+            for args, kwargs in calls[i:i + self.multicall_size]:
+                getattr(koji_client, method)(*args, **kwargs)
+
+            for result in koji_client.multiCall():
+                if isinstance(result, dict):
+                    # a fault
+                    print "Error calling %s: %s" % (method, result.get('faultString'))
+                    results.append(None)
+                else:
+                    results.append(result[0])
+
+        return results
+
+    def update_package(self, pkg_name, dist_builds):
+        """ Apply a package's new [(dist_name, build)] to its entry, so its
+            document is rewritten at most once
+
+            Returns True if the entry changed
+        """
+        payload = self.get_payload(pkg_name)
+        if payload is None:
+            print "ran into new package %s" % pkg_name
+            self.new_packages[pkg_name] = True
+            latest_builds = {'name': pkg_name}
+        else:
+            latest_builds = json.loads(payload)
+
+        do_update = False
+        for dist_name, build in dist_builds:
+            if self.apply_build(latest_builds, dist_name, build):
+                do_update = True
+
+        if payload is not None and not do_update:
+            return False
+
+        if payload is not None:
+            self.updated_packages[pkg_name] = True
+        self.set_payload(pkg_name, json.dumps(latest_builds))
+        return True
+
+    def apply_build(self, latest_builds, dist_name, build):
+        """ Record build as the latest for dist_name if it is newer than
+            what we have
+
+            Returns True if latest_builds changed
+        """
+        build_epoch = build.get('epoch', None)
+        if build_epoch is not None:
+            build_epoch = str(build_epoch)
+
+        data = latest_builds.get(dist_name, None)
+        if data is None:
+            data = {}
+            if build_epoch is not None:
+                data['epoch'] = build_epoch
+            data['version'] = build['version']
+            data['release'] = build['release']
+            data['build_id'] = build['build_id']
+            latest_builds[dist_name] = data
+            return True
+
+        data_epoch = None
+        do_update = False
+        if 'release' not in data:
+            # do the update because we have old data
+            do_update = True
+        else:
+            data_epoch = data.get('epoch', None)
+            if data_epoch is not None:
+                data_epoch = str(data_epoch)
+
+            if rpm.labelCompare(
+                (build_epoch, build['version'], build['release']),
+                (data_epoch, data['version'], data['release'])) == 1:
+                do_update = True
+
+        if not do_update:
+            return False
+
+        build_vr = ''
+        if build_epoch is not None:
+            build_vr = "%s:%s.%s" % (build_epoch, build['version'], build['release'])
+        else:
+            build_vr = "%s.%s" % (build['version'], build['release'])
+
+        data_vr = ''
+        if data_epoch is not None:
+            data_vr = "%s:%s.%s" % (data_epoch, data['version'], data.get('release',''))
+        else:
+            data_vr = "%s.%s" % (data['version'], data.get('release', ''))
+
+        print "Updating package %s in dist %s to version %s (from %s)" % (
+                build['name'], dist_name, build_vr, data_vr)
+
+        if build_epoch is not None:
+            data['epoch'] = build_epoch
+        data['version'] = build['version']
+        data['release'] = build['release']
+        data['build_id'] = build['build_id']
+
+        return True
+
     def update_db(self, timestamp=None):
         """ ask koji for any changes after we last ran the mapper
             if a timestamp is provided in ISO format ('YYYY-MM-DD HH:MI:SS')
@@ -198,115 +415,51 @@ class Mapper(object):
             display_timestamp = timestamp
         print "Getting Task List since %s" % display_timestamp
         task_list = self.koji_client.listTasks(opts=opts)
-        print "Updating Index"
+
+        print "Resolving builds for %d tasks" % len(task_list)
+        parent_ids = []
+        seen_parent_ids = set()
         for task in task_list:
             parent_id = task['parent']
-            if parent_id:
-                builds = self.koji_client.listBuilds(taskID=parent_id)
-
-                if len(builds) < 1:
-                    continue
-
-                build = builds[0]
+            if parent_id and parent_id not in seen_parent_ids:
+                seen_parent_ids.add(parent_id)
+                parent_ids.append(parent_id)
+
+        builds = []
+        for task_builds in self.koji_multicall(
+                'listBuilds', [((), {'taskID': parent_id})
+                               for parent_id in parent_ids]):
+            if task_builds:
+                builds.append(task_builds[0])
+
+        build_ids = list(set([build['build_id'] for build in builds]))
+        build_tags = dict(zip(build_ids, self.koji_multicall(
+            'listTags', [((build_id,), {}) for build_id in build_ids])))
+
+        # coalesce everything that happened to a package so each document
+        # is only rewritten once
+        pkg_names = []
+        pkg_builds = {}
+        for build in builds:
+            dist_name = None
+            for t in build_tags.get(build['build_id']) or []:
+                dist_name = tags_to_name_map.get(t['name'], None)
+                if dist_name:
+                    break
+
+            if not dist_name:
+                continue
 
-                pkg_tags = self.koji_client.listTags(build['build_id'])
-                dist_name = None
-                for t in pkg_tags:
-                    dist_name = tags_to_name_map.get(t['name'], None)
-                    if dist_name:
-                        break
+            if build['name'] not in pkg_builds:
+                pkg_names.append(build['name'])
+                pkg_builds[build['name']] = []
+            pkg_builds[build['name']].append((dist_name, build))
 
-                if not dist_name:
-                    continue
+        print "Updating Index"
+        for pkg_name in pkg_names:
+            self.update_package(pkg_name, pkg_builds[pkg_name])
 
-                pkg_doc = None
-                if build['name'] in self.found_packages:
-                    pkg_doc = self.found_packages[build['name']]
-                else:
-                    results = self.search(build['name'])
-
-                    if results:
-                        pkg_doc = results[0]
-
-                build_epoch = build.get('epoch', None)
-                if build_epoch is not None:
-                    build_epoch = str(build_epoch)
-
-                if not pkg_doc:
-                    # TODO create new document
-                    print "ran into new package %s" % build['name']
-                    self.new_packages[build['name']] = True
-                    doc = xappy.UnprocessedDocument()
-                    filtered_name = filter_search_string(build['name'])
-                    doc.fields.append(xappy.Field('key', filtered_name))
-
-                    latest_builds = {'name': build['name']}
-                    data = {}
-                    if build_epoch is not None:
-                        data['epoch'] = build_epoch
-                    data['version'] = build['version']
-                    data['release'] = build['release']
-                    data['build_id'] = build['build_id']
-                    latest_builds[dist_name] = data
-
-                    processed_doc = self.iconn.process(doc, False)
-                    processed_doc._doc.set_data(json.dumps(latest_builds))
-                    # preempt xappy's processing of data
-                    processed_doc._data = None
-                    self.iconn.add(processed_doc)
-                    self.sconn_needs_reload = True
-                    self.iconn.flush()
-                else:
-                    latest_builds = json.loads(pkg_doc._doc.get_data())
-                    data = latest_builds.get(dist_name, {'version': '0',
-                                                         'release': '0',
-                                                         'build_id': 0})
-                    data_epoch = None
-                    do_update = False
-                    if 'release' not in data:
-                        # do the update because we have old data
-                        do_update = True
-                    else:
-                        data_epoch = data.get('epoch', None)
-                        if data_epoch is not None:
-                            data_epoch = str(data_epoch)
-
-                        if rpm.labelCompare(
-                            (build_epoch, build['version'], build['release']),
-                            (data_epoch, data['version'], data['release'])) == 1:
-                            do_update = True
-
-                    if do_update:
-                        self.updated_packages[build['name']] = True
-                        build_vr = ''
-                        if build_epoch is not None:
-                            build_vr = "%s:%s.%s" % (build_epoch, build['version'], build['release'])
-                        else:
-                            build_vr = "%s.%s" % (build['version'], build['release'])
-
-                        data_vr = ''
-                        if data_epoch is not None:
-                            data_vr = "%s:%s.%s" % (data_epoch, data['version'], data.get('release',''))
-                        else:
-                            data_vr = "%s.%s" % (data['version'], data.get('release', ''))
-
-                        print "Updating package %s in dist %s to version %s (from %s)" % (
-                                build['name'], dist_name, build_vr, data_vr)
-
-                        if build_epoch is not None:
-                            data['epoch'] = build_epoch
-                        data['version'] = build['version']
-                        data['release'] = build['release']
-                        data['build_id'] = build['build_id']
-                        latest_builds[dist_name] = data
-
-                        pkg_doc._doc.set_data(json.dumps(latest_builds))
-                        # preempt xappy's processing of data
-                        pkg_doc._data = None
-                        self.iconn.replace(pkg_doc)
-                        self.sconn_needs_reload = True
-                        self.found_packages[build['name']] = pkg_doc
-                        self.iconn.flush()
+        self.write_back()
 
         updated_count = len(self.updated_packages)
         new_count = len(self.new_packages)
@@ -317,13 +470,119 @@ class Mapper(object):
 
         self.update_timestamp(self.new_timestamp)
 
-    def cleanup(self):
-        self.iconn.close()
-        self.sconn.close()
+    def consume(self, source, batch_size=CONSUME_BATCH_SIZE,
+                max_delay=CONSUME_MAX_DELAY, lockfile=None,
+                lock_timeout=CONSUME_LOCK_TIMEOUT,
+                max_pending=CONSUME_MAX_PENDING):
+        """ Keep the index up to date from a stream of build tag events,
+            applying them in batches of at most batch_size and holding
+            none of them for longer than max_delay seconds
+
+            The index is only open, and lockfile held, while a batch is
+            written, so init and update runs can get in between batches.
+            A batch which can't get the lock is kept for the next try, up
+            to max_pending events.
+        """
+        print "Waiting for tag events"
+        batch = []
+        batch_started = None
+        for message in source:
+            if message is not None:
+                msg = message.get('msg', message)
+                if msg.get('build_id') and msg.get('tag') in tags_to_name_map:
+                    if not batch:
+                        batch_started = time.time()
+                    batch.append(msg)
+
+            if batch and (len(batch) >= batch_size or
+                          time.time() - batch_started >= max_delay):
+                if self.write_tag_events(batch, lockfile, lock_timeout):
+                    batch = []
+                else:
+                    if len(batch) > max_pending:
+                        print "Dropping %d tag events, the next update " \
+                              "will pick them up" % (len(batch) - max_pending)
+                        batch = batch[-max_pending:]
+                    # try again after another max_delay
+                    batch_started = time.time()
+
+        if batch:
+            self.write_tag_events(batch, lockfile, lock_timeout)
+
+    def write_tag_events(self, events, lockfile=None,
+                         lock_timeout=CONSUME_LOCK_TIMEOUT):
+        """ Apply a batch of tag events with the index opened, and the
+            versionmap reloaded in case another run changed it, just for
+            the batch
+
+            Returns False if the lock could not be had within lock_timeout
+        """
+        if lockfile is not None:
+            try:
+                lockfile.acquire(timeout=lock_timeout)
+            except Exception as e:
+                print "Could not lock the version map, keeping %d tag " \
+                      "events for later: %s" % (len(events), str(e))
+                return False
+
+        try:
+            self.open_index()
+            try:
+                self.apply_tag_events(events)
+            finally:
+                self.close_index()
+        finally:
+            if lockfile is not None:
+                lockfile.release()
+
+        return True
+
+    def apply_tag_events(self, events):
+        """ Resolve the builds behind a batch of tag events with one
+            multicall and write the affected packages out
+        """
+        build_ids = []
+        for msg in events:
+            if msg['build_id'] not in build_ids:
+                build_ids.append(msg['build_id'])
+
+        # tag messages carry no epoch, so ask koji for the full build
+        builds = dict(zip(build_ids, self.koji_multicall(
+            'getBuild', [((build_id,), {}) for build_id in build_ids])))
+
+        pkg_names = []
+        pkg_builds = {}
+        for msg in events:
+            build = builds.get(msg['build_id'])
+            if not build or build['state'] != koji.BUILD_STATES['COMPLETE']:
+                continue
 
-def run(cache_path, action=None, timestamp=None, koji_url=None):
+            if build['name'] not in pkg_builds:
+                pkg_names.append(build['name'])
+                pkg_builds[build['name']] = []
+            pkg_builds[build['name']].append(
+                (tags_to_name_map[msg['tag']], build))
 
+        print "Applying %d tag events to %d packages" % (len(events),
+                                                         len(pkg_names))
+        for pkg_name in pkg_names:
+            self.update_package(pkg_name, pkg_builds[pkg_name])
+
+        # writes everything out; _last_run_ is left to update runs so
+        # they still catch any events the consumer never got
+        self.update_consumer_timestamp(time.time())
+
+    def cleanup(self):
+        if self.iconn is not None:
+            self.close_index()
+
+def run(cache_path, action=None, timestamp=None, koji_url=None,
+        koji_sessions=KOJI_SESSIONS, source=None, lockfile=None):
+    """ init and update expect the caller to hold lockfile for the whole
+        run, consume takes it for each batch it writes
+    """
     versionmap_path = os.path.join(cache_path, 'versionmap')
+    open_index = True
     if action is None:
         if os.path.isdir(versionmap_path):
             # we assume we need to update because the path exists
@@ -335,11 +594,19 @@ def run(cache_path, action=None, timestamp=None, koji_url=None):
         action = Mapper.init_db
     elif action == 'update':
         action = Mapper.update_db
+    elif action == 'consume':
+        if not source:
+            print "The consume action needs an event source"
+            exit(-1)
+        action = lambda mapper, timestamp: mapper.consume(
+            make_event_source(source), lockfile=lockfile)
+        open_index = False
     else:
         print "Unknown action %s" % action
         exit(-1)
 
-    mapper = Mapper(versionmap_path, koji_url=koji_url)
+    mapper = Mapper(versionmap_path, koji_url=koji_url,
+                    koji_sessions=koji_sessions, open_index=open_index)
     action(mapper, timestamp)
     mapper.cleanup()
 
@@ -0,0 +1,78 @@
+"""
+The data stored with each document in the package search index.
+
+Documents used to carry the package dict as json, descriptions and all,
+which every search had to parse in full.  Now the descriptions of the
+package and its sub packages are split off into a zlib compressed block
+after a small json header holding everything else, so a search result
+row can be decoded without touching them:
+
+    'FCP' | version (1 byte) | header length (4 bytes) | json header |
+    zlib(description count (4 bytes) | [length (4 bytes) | utf-8]...)
+
+Data which does not start with the magic is the old plain json.
+"""
+import zlib
+import struct
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+PAYLOAD_MAGIC = 'FCP'
+PAYLOAD_VERSION = 1
+
+
+def dump_payload(pkg):
+    """ Encode a package dict as a document payload """
+    header = dict(pkg)
+    header['sub_pkgs'] = [dict(sub_pkg) for sub_pkg in pkg.get('sub_pkgs', [])]
+
+    descriptions = [header.pop('description', '') or '']
+    for sub_pkg in header['sub_pkgs']:
+        descriptions.append(sub_pkg.pop('description', '') or '')
+
+    header = json.dumps(header, separators=(',', ':'))
+
+    block = [struct.pack('>I', len(descriptions))]
+    for description in descriptions:
+        if isinstance(description, unicode):
+            description = description.encode('utf-8')
+        block.append(struct.pack('>I', len(description)))
+        block.append(description)
+
+    return ''.join([PAYLOAD_MAGIC, chr(PAYLOAD_VERSION),
+                    struct.pack('>I', len(header)), header,
+                    zlib.compress(''.join(block))])
+
+
+def load_payload(data, descriptions=True):
+    """ Decode a document payload into a package dict, leaving out the
+        package and sub package descriptions unless asked for them
+    """
+    if not data.startswith(PAYLOAD_MAGIC):
+        return json.loads(data)
+
+    version = ord(data[len(PAYLOAD_MAGIC)])
+    if version != PAYLOAD_VERSION:
+        raise ValueError('Unknown payload version %d' % version)
+
+    offset = len(PAYLOAD_MAGIC) + 1
+    (header_len,) = struct.unpack_from('>I', data, offset)
+    offset += 4
+    pkg = json.loads(data[offset:offset + header_len])
+
+    if descriptions:
+        block = zlib.decompress(data[offset + header_len:])
+        (count,) = struct.unpack_from('>I', block, 0)
+        block_offset = 4
+        pkgs = [pkg] + pkg['sub_pkgs']
+        for i in range(count):
+            (length,) = struct.unpack_from('>I', block, block_offset)
+            block_offset += 4
+            pkgs[i]['description'] = \
+                block[block_offset:block_offset + length].decode('utf-8', 'replace')
+            block_offset += length
+
+    return pkg
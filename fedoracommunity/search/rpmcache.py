@@ -1,12 +1,16 @@
 import os
+import zlib
+import errno
+import urllib2
 import tempfile
 import shutil
 import fnmatch
 
-from subprocess import Popen, PIPE
+from rpmpayload import RPMPayload, RPMPayloadError
 
 class RPMCache(object):
-    def __init__(self, pkg, yum_base, cache_dir='cache', max_retry=10):
+    def __init__(self, pkg, yum_base, cache_dir='cache', max_retry=10,
+                 file_cache=None, stream=False):
         rpm_envra = pkg.ui_envra
         if ':' in rpm_envra:
             rpm_envra = rpm_envra.split(':')[1]
@@ -14,22 +18,43 @@ class RPMCache(object):
         self.rpm_file_name = "%s.rpm" % rpm_envra
         self.rpm_envra = rpm_envra
         self.cache_dir = os.path.join(cache_dir, 'rpms')
+        self.rpm_path = os.path.join(self.cache_dir, self.rpm_file_name)
         self.retry = 0
         self.pkg = pkg
         self.yum_base = yum_base
         self.max_retry = max_retry
+        # an ExtractedFileCache shared between runs
+        self.file_cache = file_cache
+        # read payloads straight from the mirror instead of keeping
+        # downloaded rpms around
+        self.stream = stream
 
         # create cache dir if it does not exist
         if not os.path.exists(self.cache_dir):
-            os.mkdir(self.cache_dir)
+            try:
+                os.mkdir(self.cache_dir)
+            except OSError as e:
+                # another indexer worker beat us to it
+                if e.errno != errno.EEXIST:
+                    raise
 
         self.tmp_dir = None
+        # where a streamed rpm is spooled so later passes over its payload
+        # don't fetch it from the mirror again
+        self._spool_path = None
+        # globs we already made a pass over the payload for
+        self._extracted_globs = set()
+        # whether the last pass over the payload failed part way, which a
+        # fresh download may fix
+        self._extract_failed = False
 
     def open(self):
         self.tmp_dir = tempfile.mkdtemp()
+        self._spool_path = None
+        self._extracted_globs = set()
+        self._extract_failed = False
 
     def _download_rpm(self):
-        self.rpm_path = os.path.join(self.cache_dir, self.rpm_file_name)
         if not os.path.exists(self.rpm_path):
             repo = self.yum_base.repos.getRepo(self.pkg.repoid)
             repo.cache = 0
@@ -37,48 +62,131 @@ class RPMCache(object):
             print "Downloading %s" % self.rpm_path
             path = repo.getPackage(self.pkg)
 
+    def _extract_files(self, file_globs):
+        """ Extract every file matching one of file_globs into tmp_dir with
+            a single pass over the rpm payload
+        """
+        file_globs = [g for g in file_globs if g not in self._extracted_globs]
+        if not file_globs:
+            return
+
+        try:
+            self._payload().extract(file_globs, self.tmp_dir)
+        except (RPMPayloadError, IOError, OSError, zlib.error) as e:
+            print "Error extracting from %s: %s" % (self.rpm_path, e)
+            self._extract_failed = True
+            return
+
+        self._extract_failed = False
+        self._extracted_globs.update(file_globs)
+
+    def _spool_rpm(self):
+        """ Fetch the rpm from the mirror into tmp_dir, where it lives
+            until close, and return its path
+        """
+        if self._spool_path is None or not os.path.exists(self._spool_path):
+            url = self.pkg.remote_url
+            print "Streaming %s" % url
+            fd, spool_path = tempfile.mkstemp(suffix='.rpm', dir=self.tmp_dir)
+            f = os.fdopen(fd, 'wb')
+            try:
+                remote = urllib2.urlopen(url)
+                try:
+                    shutil.copyfileobj(remote, f)
+                finally:
+                    remote.close()
+            finally:
+                f.close()
+            self._spool_path = spool_path
+
+        return self._spool_path
+
+    def _payload(self):
+        """ Returns an RPMPayload reading either the downloaded rpm or,
+            when streaming, the copy of the rpm spooled from the mirror
+        """
+        if self.stream and not os.path.exists(self.rpm_path):
+            return RPMPayload(self._spool_rpm())
+
+        self._download_rpm()
+        print "Extracting from %s" % self.rpm_path
+        return RPMPayload(self.rpm_path)
+
     def _extract_file(self, file_path):
-        if self.decompress_filter == None:
-            decompress_filter =  os.path.basename(file_path)
-        else:
-            decompress_filter = self.decompress_filter
-
-        cmd = 'rpm2cpio %s | cpio -idmv --no-absolute-filenames %s' % (self.rpm_path, decompress_filter)
-        print cmd
-        p1 = Popen(['rpm2cpio', self.rpm_path],
-                   cwd=self.tmp_dir,
-                   stdout=PIPE)
-        p2 = Popen(['cpio', '-idmv', '--no-absolute-filenames', decompress_filter],
-                   cwd=self.tmp_dir,
-                   stdin=p1.stdout,
-                   stdout=PIPE)
-        p1.stdout.close()
-        output = p2.communicate()[0]
+        for file_glob in self._extracted_globs:
+            if fnmatch.fnmatch(file_path, file_glob):
+                # an earlier pass already covered this file
+                return
+
+        file_globs = [file_path]
+        if self.decompress_filter != None:
+            file_globs.append(self.decompress_filter)
+
+        self._extract_files(file_globs)
+
+    def read_files(self, file_globs):
+        """ Reads every file matching one of file_globs straight into
+            memory in a single pass
+
+            Returns {path: data}
+        """
+        try:
+            return self._payload().extract(file_globs)
+        except (RPMPayloadError, IOError, OSError, zlib.error) as e:
+            print "Error extracting from %s: %s" % (self.rpm_path, e)
+            return {}
+
+    def prefetch(self, file_glob):
+        """ Make every file matching file_glob available without going
+            back to the rpm, by extracting them unless they are all in
+            the file cache already, and load the file list into memory.
+            Done before forking processes which share this cache, so none
+            of them extract into tmp_dir or read yum's sqlite files.
+
+            Returns False if the files could not be extracted
+        """
+        paths = [path for path in self.pkg.filelist
+                 if fnmatch.fnmatch(path, file_glob)]
+        if self.file_cache:
+            paths = [path for path in paths
+                     if not self.file_cache.get(self.pkg.checksum, path)]
+
+        if paths:
+            self._extract_files([file_glob])
+            if self._extract_failed:
+                return False
+
+        # lookups of files which aren't there must not go to the rpm either
+        self._extracted_globs.add(file_glob)
+        return True
 
     def prep_file(self, file_path, decompress_filter=None):
-        self._download_rpm()
+        if self.file_cache:
+            cached_path = self.file_cache.get(self.pkg.checksum, file_path)
+            if cached_path:
+                return cached_path
+
         self.decompress_filter = decompress_filter
         full_path = self.tmp_dir + '/' + file_path
 
         if not os.path.exists(full_path):
             self._extract_file(file_path)
 
-        # retry if file did not get extracted
-        if not os.path.exists(full_path):
+        # only retry when the pass over the payload failed, a download
+        # won't bring a file which isn't in the rpm (e.g. the target of a
+        # symlink into another package)
+        while not os.path.exists(full_path) and self._extract_failed:
             print "Retrying for file %s" % full_path
-            retry = True
-            exists = False
-            while retry and not exists:
-                retry = self._retry(file_path)
-                exists = os.path.exists(full_path)
+            if not self._retry(file_path):
+                break
+
+        if not os.path.exists(full_path):
+            return None
 
-            if exists:
-                return full_path
-            else:
-                return None
+        if self.file_cache:
+            return self.file_cache.put(self.pkg.checksum, file_path, full_path)
 
-        else:
-            return full_path
+        return full_path
 
     def open_file(self, file_path, access='r', decompress_filter=None):
         full_path = self.prep_file(file_path, decompress_filter)
@@ -119,13 +227,14 @@ class RPMCache(object):
 
 
     def _retry(self, file_path):
-        if self.retry <= self.max_retry:
+        if self.retry < self.max_retry:
             self.retry += 1
-            try:
-                os.remove(self.rpm_path)
-            except OSError:
-                pass
-            self._download_rpm()
+            # the download may have been truncated or corrupt
+            for path in (self.rpm_path, self._spool_path):
+                if path and os.path.exists(path):
+                    os.remove(path)
+            self._spool_path = None
+            self._extracted_globs = set()
             self._extract_file(file_path)
             return True
         return False
@@ -0,0 +1,343 @@
+"""
+Reads the cpio payload of an rpm in a single streaming pass, pulling out
+every member that matches a set of globs without shelling out to
+rpm2cpio and cpio
+"""
+import os
+import bz2
+import errno
+import stat
+import struct
+import fnmatch
+import threading
+import zlib
+
+from subprocess import Popen, PIPE
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RPM_LEAD_SIZE = 96
+RPM_LEAD_MAGIC = '\xed\xab\xee\xdb'
+RPM_HEADER_MAGIC = '\x8e\xad\xe8'
+
+RPMTAG_PAYLOADFORMAT = 1124
+RPMTAG_PAYLOADCOMPRESSOR = 1125
+RPM_STRING_TYPE = 6
+
+CPIO_NEWC_MAGIC = ('070701', '070702')
+CPIO_HEADER_SIZE = 110
+CPIO_TRAILER = 'TRAILER!!!'
+
+# decompressors to fall back to when there is no python module for
+# the payload compression
+DECOMPRESS_COMMANDS = {'xz': ['xz', '-dc'],
+                       'lzma': ['xz', '--format=lzma', '-dc'],
+                       'zstd': ['zstd', '-dc']}
+
+READ_SIZE = 64 * 1024
+
+
+class RPMPayloadError(Exception):
+    pass
+
+
+class _Decompressor(object):
+    """ File-like wrapper which decompresses a stream as it is read """
+    def __init__(self, fileobj, compressor):
+        self.fileobj = fileobj
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.proc = None
+
+        if compressor == 'gzip':
+            z = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self._decompress = z.decompress
+        elif compressor in ('xz', 'lzma') and lzma is not None:
+            if compressor == 'lzma':
+                z = lzma.LZMADecompressor(lzma.FORMAT_ALONE)
+            else:
+                z = lzma.LZMADecompressor()
+            self._decompress = z.decompress
+        elif compressor == 'bzip2':
+            z = bz2.BZ2Decompressor()
+            self._decompress = z.decompress
+        elif compressor == 'zstd' and zstandard is not None:
+            z = zstandard.ZstdDecompressor().decompressobj()
+            self._decompress = z.decompress
+        elif compressor in DECOMPRESS_COMMANDS:
+            # one process for the whole payload
+            if isinstance(fileobj, file):
+                # start from where we logically are rather than wherever
+                # buffering left the fd
+                os.lseek(fileobj.fileno(), fileobj.tell(), os.SEEK_SET)
+                self.proc = Popen(DECOMPRESS_COMMANDS[compressor],
+                                  stdin=fileobj, stdout=PIPE)
+            else:
+                # a network stream has to be fed to the process by hand
+                self.proc = Popen(DECOMPRESS_COMMANDS[compressor],
+                                  stdin=PIPE, stdout=PIPE)
+                feeder = threading.Thread(target=self._feed,
+                                          args=(fileobj, self.proc.stdin))
+                feeder.daemon = True
+                feeder.start()
+            self.fileobj = self.proc.stdout
+            self._decompress = lambda data: data
+        else:
+            raise RPMPayloadError('Unsupported payload compressor %s'
+                                  % compressor)
+
+    def _feed(self, fileobj, pipe):
+        try:
+            while True:
+                data = fileobj.read(READ_SIZE)
+                if not data:
+                    break
+                pipe.write(data)
+        except (IOError, OSError):
+            # the reader went away early
+            pass
+        finally:
+            try:
+                pipe.close()
+            except (IOError, OSError):
+                pass
+
+    def read(self, size):
+        while len(self.buf) - self.pos < size and not self.eof:
+            data = self.fileobj.read(READ_SIZE)
+            if not data:
+                self.eof = True
+                break
+            self.buf = self.buf[self.pos:] + self._decompress(data)
+            self.pos = 0
+
+        data = self.buf[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def skip(self, size):
+        while size > 0:
+            data = self.read(min(size, READ_SIZE))
+            if not data:
+                raise RPMPayloadError('Truncated payload')
+            size -= len(data)
+
+    def close(self):
+        if self.proc:
+            self.proc.stdout.close()
+            if self.proc.poll() is None:
+                # we may have stopped reading before the end
+                self.proc.kill()
+            self.proc.wait()
+
+
+class RPMPayload(object):
+    """ Reads an rpm from rpm_path or, if given, from the already open
+        fileobj (e.g. an http response) which is only ever read forwards
+    """
+    def __init__(self, rpm_path, fileobj=None):
+        self.rpm_path = rpm_path
+        self.fileobj = fileobj
+
+    def _read_header(self, f, pad):
+        """ Read a header structure and return {tag: string_value} for
+            its string entries
+        """
+        intro = f.read(16)
+        if len(intro) != 16 or not intro.startswith(RPM_HEADER_MAGIC):
+            raise RPMPayloadError('%s: bad header magic' % self.rpm_path)
+
+        nindex, hsize = struct.unpack('>II', intro[8:16])
+        index = f.read(nindex * 16)
+        store = f.read(hsize)
+        if len(index) != nindex * 16 or len(store) != hsize:
+            raise RPMPayloadError('%s: truncated header' % self.rpm_path)
+
+        if pad:
+            # the signature header is padded to an 8 byte boundary
+            f.read((8 - (hsize % 8)) % 8)
+
+        strings = {}
+        for i in range(nindex):
+            tag, tag_type, offset, count = struct.unpack(
+                '>IIII', index[i * 16:(i + 1) * 16])
+            if tag_type == RPM_STRING_TYPE:
+                strings[tag] = store[offset:store.index('\0', offset)]
+
+        return strings
+
+    def _open_payload(self, f):
+        lead = f.read(RPM_LEAD_SIZE)
+        if not lead.startswith(RPM_LEAD_MAGIC):
+            raise RPMPayloadError('%s is not an rpm' % self.rpm_path)
+
+        self._read_header(f, pad=True)
+        header = self._read_header(f, pad=False)
+
+        payload_format = header.get(RPMTAG_PAYLOADFORMAT, 'cpio')
+        if payload_format != 'cpio':
+            raise RPMPayloadError('Unsupported payload format %s'
+                                  % payload_format)
+
+        return _Decompressor(f, header.get(RPMTAG_PAYLOADCOMPRESSOR, 'gzip'))
+
+    def _iter_members(self, payload):
+        """ Generates (name, mode, ino, nlink, size) for each member, leaving the
+            payload positioned at its data
+        """
+        while True:
+            header = payload.read(CPIO_HEADER_SIZE)
+            if len(header) != CPIO_HEADER_SIZE or \
+                    header[:6] not in CPIO_NEWC_MAGIC:
+                raise RPMPayloadError('%s: bad cpio header' % self.rpm_path)
+
+            fields = [int(header[6 + i * 8:14 + i * 8], 16) for i in range(13)]
+            ino, mode, nlink = fields[0], fields[1], fields[4]
+            size, namesize = fields[6], fields[11]
+
+            name = payload.read(namesize)[:-1]
+            payload.skip((4 - (CPIO_HEADER_SIZE + namesize) % 4) % 4)
+
+            if name == CPIO_TRAILER:
+                return
+
+            # members are stored as ./usr/...
+            if name.startswith('.'):
+                name = name[1:]
+
+            yield name, mode, ino, nlink, size
+
+            # data is padded to a 4 byte boundary
+            payload.skip((4 - size % 4) % 4)
+
+    def extract(self, file_globs, dest_dir=None):
+        """ Make one pass over the payload and extract every regular file
+            or symlink matching one of file_globs
+
+            With dest_dir the members are written under it and the result
+            is {path: full_path}, otherwise it is {path: data}
+
+            If every glob is a plain path reading stops as soon as all of
+            them have been found
+        """
+        results = {}
+        links = {}
+        hardlinks = {}
+
+        wanted = None
+        if not [g for g in file_globs if set(g) & set('*?[')]:
+            wanted = set(file_globs)
+
+        f = self.fileobj
+        if f is None:
+            f = open(self.rpm_path, 'rb')
+        try:
+            payload = self._open_payload(f)
+            try:
+                for name, mode, ino, nlink, size in self._iter_members(payload):
+                    matched = False
+                    for file_glob in file_globs:
+                        if fnmatch.fnmatch(name, file_glob):
+                            matched = True
+                            break
+
+                    # hardlinked members only carry data on the last link,
+                    # which has to be read for the links that matched even
+                    # if it doesn't match itself
+                    names = []
+                    if stat.S_ISREG(mode) and nlink > 1:
+                        names = hardlinks.pop(ino, [])
+                        if matched:
+                            names.append(name)
+                        if size == 0:
+                            if names:
+                                hardlinks[ino] = names
+                            continue
+                    elif matched:
+                        names = [name]
+
+                    if not names or \
+                            not (stat.S_ISREG(mode) or stat.S_ISLNK(mode)):
+                        payload.skip(size)
+                        continue
+
+                    data = payload.read(size)
+                    if len(data) != size:
+                        raise RPMPayloadError('%s: truncated payload'
+                                              % self.rpm_path)
+
+                    if stat.S_ISLNK(mode):
+                        links[name] = os.path.normpath(
+                            os.path.join(os.path.dirname(name), data))
+                        continue
+
+                    for link_name in names:
+                        results[link_name] = self._store(link_name, data,
+                                                         dest_dir)
+
+                    if wanted is not None and wanted.issubset(results):
+                        break
+            finally:
+                payload.close()
+        finally:
+            if self.fileobj is None:
+                f.close()
+
+        # empty hardlinked files never get any data
+        for names in hardlinks.values():
+            for name in names:
+                results[name] = self._store(name, '', dest_dir)
+
+        # resolve symlinks which point at something we extracted
+        for name, target in links.items():
+            seen = set()
+            while target in links and target not in seen:
+                seen.add(target)
+                target = links[target]
+            if target in results:
+                if dest_dir is None:
+                    results[name] = results[target]
+                else:
+                    f = open(results[target], 'rb')
+                    results[name] = self._store(name, f.read(), dest_dir)
+                    f.close()
+
+        return results
+
+    def _store(self, name, data, dest_dir):
+        if dest_dir is None:
+            return data
+
+        # never write outside of dest_dir whatever the member is called
+        dest_dir = os.path.normpath(dest_dir)
+        full_path = os.path.normpath(os.path.join(dest_dir, name.lstrip('/')))
+        if not full_path.startswith(dest_dir + os.sep):
+            raise RPMPayloadError('%s: %s is outside of %s'
+                                  % (self.rpm_path, name, dest_dir))
+
+        dir_name = os.path.dirname(full_path)
+        if not os.path.isdir(dir_name):
+            try:
+                os.makedirs(dir_name)
+            except OSError as e:
+                # someone else extracting into dest_dir made it first
+                if e.errno != errno.EEXIST:
+                    raise
+
+        f = open(full_path, 'wb')
+        f.write(data)
+        f.close()
+
+        return full_path
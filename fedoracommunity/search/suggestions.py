@@ -0,0 +1,94 @@
+"""
+A synonym table, written next to the search index, which maps the names
+people search for (application names from .desktop files, virtual
+provides) to the packages which carry them.  The search falls back on it,
+along with xapian's spelling data, when a query finds next to nothing.
+
+The file is json, {filtered_word: [package_name, ...]}.
+"""
+import os
+import re
+import tempfile
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from utils import filter_search_string
+
+SUGGESTIONS_FILE = 'suggestions'
+
+# a word is dropped once it maps to more packages than this, it is too
+# vague to be worth suggesting
+MAX_SYNONYM_PKGS = 5
+
+# provides worth searching for, which leaves out sonames, perl(...),
+# config(...) and the like
+PLAIN_PROVIDE_RE = re.compile(r'^[A-Za-z][A-Za-z0-9._+-]*$')
+
+
+def is_plain_provide(provide):
+    return bool(PLAIN_PROVIDE_RE.match(provide))
+
+
+def write_suggestions(dbpath, synonyms, pkg_names):
+    """ Write the synonym table into dbpath
+
+        synonyms maps words to sets of package names, words which are
+        themselves package names are left out since the normal search
+        already finds those
+    """
+    pkg_names = set([filter_search_string(name) for name in pkg_names])
+
+    table = {}
+    for word, names in synonyms.items():
+        word = ' '.join(filter_search_string(word).split())
+        if not word or word in pkg_names:
+            continue
+        names = table.setdefault(word, set()) | set(names)
+        table[word] = names
+
+    for word, names in table.items():
+        if len(names) > MAX_SYNONYM_PKGS:
+            del table[word]
+        else:
+            table[word] = sorted(names)
+
+    # write then rename so a reader never sees a partial table
+    fd, tmp_path = tempfile.mkstemp(dir=dbpath)
+    f = os.fdopen(fd, 'w')
+    json.dump(table, f, separators=(',', ':'))
+    f.close()
+    os.chmod(tmp_path, 0644)
+    os.rename(tmp_path, os.path.join(dbpath, SUGGESTIONS_FILE))
+
+
+class Suggestions(object):
+    """ The synonym table of an index, loaded into memory """
+    def __init__(self, dbpath):
+        self.synonyms = {}
+
+        path = os.path.join(dbpath, SUGGESTIONS_FILE)
+        if not os.path.exists(path):
+            # indexes built before suggestions were added
+            return
+
+        f = open(path)
+        try:
+            self.synonyms = json.load(f)
+        finally:
+            f.close()
+
+    def synonyms_for(self, search_string):
+        """ Returns the names of the packages the whole filtered search
+            string or any of its words are another name for
+        """
+        words = search_string.split()
+        names = []
+        for word in [' '.join(words)] + words:
+            for name in self.synonyms.get(word, []):
+                if name not in names:
+                    names.append(name)
+
+        return names
@@ -1,3 +1,6 @@
+import os
+import re
+import shutil
 import urllib
 
 words_translation = {'d-bus': 'dbus',
@@ -5,6 +8,10 @@ words_translation = {'d-bus': 'dbus',
 
 reserved_chars = ['+', '-', '\'', '"']
 
+# prefix of the boolean terms the indexer adds for base and sub package
+# names so a package's document can be looked up without a query
+PACKAGE_NAME_PREFIX = 'XPKG:'
+
 
 def filter_search_string (string):
     """Replaces xapian reserved characters with underscore, lowercases
@@ -23,3 +30,63 @@ def filter_search_string (string):
         string = string.replace(char, '_')
 
     return string
+
+
+def package_name_term(name):
+    """Returns the boolean term identifying the document of the base or
+       sub package called name
+    """
+    return PACKAGE_NAME_PREFIX + name
+
+
+def list_generations(dest_dir, name):
+    """Returns the generation numbers of the name.<generation>
+       directories published in dest_dir
+    """
+    gen_re = re.compile(r'^%s\.(\d+)$' % re.escape(name))
+    generations = []
+    for file_name in os.listdir(dest_dir):
+        m = gen_re.match(file_name)
+        if m and os.path.isdir(os.path.join(dest_dir, file_name)):
+            generations.append(int(m.group(1)))
+
+    return sorted(generations)
+
+
+def publish_generation(src_dir, dest_dir, name, move=False, keep=2):
+    """Publishes src_dir as dest_dir/name.<generation> and then atomically
+       flips the dest_dir/name symlink over to it, so readers opening
+       dest_dir/name only ever see a complete database.  The newest keep
+       generations are kept around for readers which still have an older
+       one open.
+
+       Returns the new generation number
+    """
+    link_path = os.path.join(dest_dir, name)
+
+    if os.path.isdir(link_path) and not os.path.islink(link_path):
+        # switch over from the old layout of files published in place
+        os.rename(link_path, os.path.join(dest_dir, '%s.0' % name))
+
+    old_generations = list_generations(dest_dir, name)
+    generation = max(old_generations + [0]) + 1
+    generation_name = '%s.%d' % (name, generation)
+    generation_path = os.path.join(dest_dir, generation_name)
+
+    if move:
+        shutil.move(src_dir, generation_path)
+    else:
+        shutil.copytree(src_dir, generation_path)
+
+    tmp_link_path = link_path + '.new'
+    if os.path.lexists(tmp_link_path):
+        os.remove(tmp_link_path)
+    os.symlink(generation_name, tmp_link_path)
+    # rename(2) replaces the old link atomically
+    os.rename(tmp_link_path, link_path)
+
+    for old_generation in old_generations[:max(len(old_generations) - keep + 1, 0)]:
+        shutil.rmtree(os.path.join(dest_dir, '%s.%d' % (name, old_generation)),
+                      ignore_errors=True)
+
+    return generation
@@ -0,0 +1,69 @@
+""" Builds small synthetic rpms for the tests of the rpm readers """
+import stat
+import zlib
+import struct
+
+from subprocess import Popen, PIPE
+
+RPM_LEAD_MAGIC = '\xed\xab\xee\xdb'
+RPM_HEADER_MAGIC = '\x8e\xad\xe8\x01'
+
+RPMTAG_PAYLOADFORMAT = 1124
+RPMTAG_PAYLOADCOMPRESSOR = 1125
+RPM_STRING_TYPE = 6
+
+
+def _header(strings):
+    """ A header structure holding {tag: string} """
+    index = []
+    store = ''
+    for tag, value in sorted(strings.items()):
+        index.append(struct.pack('>IIII', tag, RPM_STRING_TYPE,
+                                 len(store), 1))
+        store += value + '\0'
+
+    return RPM_HEADER_MAGIC + '\0' * 4 + \
+        struct.pack('>II', len(index), len(store)) + ''.join(index) + store
+
+
+def _pad(data):
+    return data + '\0' * ((4 - len(data) % 4) % 4)
+
+
+def cpio_member(name, data='', mode=stat.S_IFREG | 0644, ino=1, nlink=1):
+    fields = [ino, mode, 0, 0, nlink, 0, len(data), 0, 0, 0, 0,
+              len(name) + 1, 0]
+    header = '070701' + ''.join(['%08x' % field for field in fields])
+    return _pad(header + name + '\0') + _pad(data)
+
+
+def cpio_archive(members):
+    """ A newc cpio archive of members, a list of cpio_member()s """
+    return ''.join(members) + cpio_member('TRAILER!!!', nlink=1, ino=0)
+
+
+def compress(data, compressor):
+    if compressor == 'gzip':
+        z = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return z.compress(data) + z.flush()
+    elif compressor == 'xz':
+        try:
+            import lzma
+            return lzma.compress(data)
+        except ImportError:
+            proc = Popen(['xz', '-c'], stdin=PIPE, stdout=PIPE)
+            return proc.communicate(data)[0]
+
+    raise ValueError('Unsupported compressor %s' % compressor)
+
+
+def build_rpm(members, compressor='gzip'):
+    """ The bytes of an rpm whose payload is a cpio archive of members """
+    lead = RPM_LEAD_MAGIC + '\0' * (96 - len(RPM_LEAD_MAGIC))
+    # an empty signature header needs no padding
+    signature = _header({})
+    header = _header({RPMTAG_PAYLOADFORMAT: 'cpio',
+                      RPMTAG_PAYLOADCOMPRESSOR: compressor})
+
+    return lead + signature + header + \
+        compress(cpio_archive(members), compressor)
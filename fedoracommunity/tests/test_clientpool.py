@@ -0,0 +1,85 @@
+""" Tests for the pool of clients connectors check out per request """
+import unittest
+
+from fedoracommunity.connectors.api import connector
+from fedoracommunity.connectors.api.connector import ClientPool
+
+
+class FakeClock(object):
+    """ Stands in for the time module the pool reads the time from """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class TestClientPool(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self._time = connector.time
+        connector.time = self.clock
+        self.pool = ClientPool(max_idle=2, max_age=3600, max_total=3,
+                               max_idle_time=600)
+        self.created = 0
+
+    def tearDown(self):
+        connector.time = self._time
+
+    def factory(self):
+        self.created += 1
+        return 'client %d' % self.created
+
+    def checkout(self, key):
+        client, created = self.pool.acquire(key, self.factory)
+        self.pool.release(key, client, created)
+        return client
+
+    def test_reuses_idle_clients(self):
+        self.assertEqual(self.checkout('a'), 'client 1')
+        self.assertEqual(self.checkout('a'), 'client 1')
+        self.assertEqual(self.checkout('b'), 'client 2')
+        self.assertEqual((self.pool.hits, self.pool.misses), (1, 2))
+
+    def test_max_idle_per_key(self):
+        clients = [self.pool.acquire('a', self.factory) for i in range(3)]
+        for client, created in clients:
+            self.pool.release('a', client, created)
+        self.assertEqual(self.pool.idle_count(), 2)
+
+    def test_max_total(self):
+        for key in ('a', 'b', 'c'):
+            self.checkout(key)
+            self.clock.now += 1
+        self.checkout('d')
+
+        # the client idle the longest made room
+        self.assertEqual(self.pool.idle_count(), 3)
+        self.assertEqual(self.checkout('a'), 'client 5')
+        self.assertEqual(self.checkout('c'), 'client 3')
+
+    def test_reaps_idle_clients_of_every_key(self):
+        self.checkout('a')
+        self.checkout('b')
+        self.clock.now += 300
+        self.checkout('b')
+        self.clock.now += 301
+
+        # asking for any key drops what other keys left idle too long
+        self.checkout('c')
+        self.assertEqual(self.pool.idle_count(), 2)
+        self.assertEqual(self.checkout('a'), 'client 4')
+        self.assertEqual(self.checkout('b'), 'client 2')
+
+    def test_max_age(self):
+        self.checkout('a')
+        for i in range(8):
+            self.clock.now += 500
+            self.checkout('a')
+        self.assertEqual(self.checkout('a'), 'client 2')
+
+
+if __name__ == '__main__':
+    unittest.main()
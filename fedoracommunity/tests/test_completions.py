@@ -0,0 +1,82 @@
+""" Tests for the package name completions table """
+import os
+import shutil
+import tempfile
+import unittest
+
+from fedoracommunity.search.completions import write_completions, \
+    Completions, COMPLETIONS_FILE
+
+
+def base_pkg(name, *sub_pkgs):
+    return {'name': name,
+            'sub_pkgs': [{'name': sub_name} for sub_name in sub_pkgs]}
+
+
+PACKAGES = [base_pkg('gtk+', 'gtk+-devel'),
+            base_pkg('gtk2', 'gtk2-devel', 'gtk2-engines'),
+            base_pkg('gtk3'),
+            base_pkg('pygtk2'),
+            base_pkg('dbus', 'dbus-libs', 'dbus-x11'),
+            base_pkg('d-feet'),
+            base_pkg('NetworkManager', 'NetworkManager-glib')]
+
+
+class TestCompletions(unittest.TestCase):
+
+    def setUp(self):
+        self.dbpath = tempfile.mkdtemp()
+        write_completions(self.dbpath, PACKAGES)
+        self.completions = Completions(self.dbpath)
+
+    def tearDown(self):
+        shutil.rmtree(self.dbpath)
+
+    def complete(self, prefix, limit=10):
+        return self.completions.complete(prefix, limit)
+
+    def test_base_packages_first(self):
+        self.assertEqual(self.complete('gtk'),
+                         [('gtk+', ''), ('gtk2', ''), ('gtk3', ''),
+                          ('gtk+-devel', 'gtk+'), ('gtk2-devel', 'gtk2'),
+                          ('gtk2-engines', 'gtk2')])
+
+    def test_filtered_prefixes(self):
+        # names and prefixes go through the same filter, so "gtk+" only
+        # completes gtk+ and "d-bus" is looked up as "dbus"
+        self.assertEqual(self.complete('gtk+'),
+                         [('gtk+', ''), ('gtk+-devel', 'gtk+')])
+        self.assertEqual(self.complete('d-bus'),
+                         [('dbus', ''), ('dbus-x11', 'dbus'),
+                          ('dbus-libs', 'dbus')])
+        self.assertEqual(self.complete('gtk+-d'),
+                         [('gtk+-devel', 'gtk+')])
+        self.assertEqual(self.complete('d-'), [('d-feet', '')])
+
+    def test_case_and_whitespace(self):
+        self.assertEqual(self.complete(' networkmanager-g '),
+                         [('NetworkManager-glib', 'NetworkManager')])
+
+    def test_limit(self):
+        self.assertEqual(self.complete('gtk', limit=2),
+                         [('gtk+', ''), ('gtk2', '')])
+
+    def test_no_matches(self):
+        self.assertEqual(self.complete('zzz'), [])
+        self.assertEqual(self.complete(''), [])
+        self.assertEqual(self.complete('  '), [])
+
+    def test_rewrite(self):
+        write_completions(self.dbpath, [base_pkg('gtk4')])
+        self.assertEqual(os.listdir(self.dbpath), [COMPLETIONS_FILE])
+        self.assertEqual(Completions(self.dbpath).complete('gtk'),
+                         [('gtk4', '')])
+
+    def test_missing_table(self):
+        # indexes built before completions were added
+        completions = Completions(tempfile.gettempdir() + '/nonexistent')
+        self.assertEqual(completions.complete('gtk'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
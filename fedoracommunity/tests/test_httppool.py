@@ -0,0 +1,178 @@
+""" Tests for the shared keep-alive connection pool, against a stub server """
+import time
+import socket
+import urllib2
+import httplib
+import unittest
+import threading
+import BaseHTTPServer
+import SocketServer
+
+from fedoracommunity.connectors.api import httppool
+from fedoracommunity.connectors.api.httppool import HTTPConnectionPool, \
+    PoolTimeout
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # write the response in one go, or delayed acks slow every request down
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body, headers=()):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == '/missing':
+            self.reply(404, 'not here')
+        elif self.path == '/loop':
+            self.reply(302, '', [('Location', '/loop')])
+        elif self.path == '/redirect':
+            self.reply(302, '', [('Location', '/data')])
+        else:
+            self.reply(200, 'data for ' + self.path)
+
+        if self.path == '/once':
+            # hang up without telling the client
+            self.close_connection = 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.posts += 1
+        self.reply(200, 'posted')
+        if self.path == '/once':
+            self.close_connection = 1
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    posts = 0
+
+    def handle_error(self, request, client_address):
+        # clients hanging up on purpose
+        pass
+
+
+class TestHTTPConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.pool = HTTPConnectionPool(max_connections=2, timeout=5,
+                                       slot_timeout=5)
+        self._is_dropped = httppool._is_dropped
+
+    def tearDown(self):
+        httppool._is_dropped = self._is_dropped
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuses_connections(self):
+        for i in range(3):
+            self.assertEqual(self.pool.urlopen(self.url + '/data').read(),
+                             'data for /data')
+        self.assertEqual(self.pool.misses, 1)
+        self.assertEqual(self.pool.hits, 2)
+
+    def test_follows_redirects(self):
+        response = self.pool.urlopen(self.url + '/redirect')
+        self.assertEqual(response.read(), 'data for /data')
+
+    def test_errors_release_their_slot(self):
+        # more errors than there are slots, a leaked slot would hang here
+        for i in range(5):
+            try:
+                self.pool.urlopen(self.url + '/missing')
+            except urllib2.HTTPError, e:
+                self.assertEqual(e.code, 404)
+                self.assertEqual(e.read(), 'not here')
+            else:
+                self.fail('no HTTPError raised')
+
+        self.assertEqual(self.pool.urlopen(self.url + '/data').read(),
+                         'data for /data')
+
+    def test_redirect_loops_release_their_slot(self):
+        for i in range(3):
+            self.assertRaises(urllib2.HTTPError,
+                              self.pool.urlopen, self.url + '/loop')
+
+        self.assertEqual(self.pool.urlopen(self.url + '/data').read(),
+                         'data for /data')
+
+    def test_closed_responses_release_their_slot(self):
+        for i in range(5):
+            self.pool.urlopen(self.url + '/data').close()
+
+        self.assertEqual(self.pool.urlopen(self.url + '/data').read(),
+                         'data for /data')
+
+    def test_dropped_responses_release_their_slot(self):
+        for i in range(5):
+            # never read nor closed
+            self.pool.urlopen(self.url + '/data')
+
+        self.assertEqual(self.pool.urlopen(self.url + '/data').read(),
+                         'data for /data')
+
+    def test_slot_timeout(self):
+        self.pool.slot_timeout = 0.2
+        held = [self.pool.urlopen(self.url + '/data') for i in range(2)]
+        self.assertRaises(PoolTimeout, self.pool.urlopen, self.url + '/data')
+
+        held[0].read()
+        self.assertEqual(self.pool.urlopen(self.url + '/data').read(),
+                         'data for /data')
+
+    def test_skips_connections_closed_by_the_server(self):
+        self.pool.urlopen(self.url + '/once', data='x').read()
+        # give the close time to arrive
+        time.sleep(0.1)
+        self.assertEqual(self.pool.urlopen(self.url + '/once',
+                                           data='x').read(), 'posted')
+        self.assertEqual(self.server.posts, 2)
+
+    def test_retries_only_idempotent_requests(self):
+        # as if the close had not arrived yet when the connection was reused
+        httppool._is_dropped = lambda conn: False
+
+        self.pool.urlopen(self.url + '/once').read()
+        time.sleep(0.1)
+        self.assertEqual(self.pool.urlopen(self.url + '/data').read(),
+                         'data for /data')
+
+        self.pool.urlopen(self.url + '/once', data='x').read()
+        time.sleep(0.1)
+        self.assertRaises((httplib.HTTPException, socket.error),
+                          self.pool.urlopen, self.url + '/once', data='x')
+        self.assertEqual(self.server.posts, 1)
+
+    def test_failed_connections_release_their_slot(self):
+        # a port nothing listens on
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        for i in range(3):
+            self.assertRaises(socket.error, self.pool.request, 'GET',
+                              'http://127.0.0.1:%d/data' % port)
+
+        slot = self.pool._slot(('http', '127.0.0.1', port, False))
+        for i in range(self.pool.max_connections):
+            self.assertTrue(slot.acquire(False))
+
+
+if __name__ == '__main__':
+    unittest.main()
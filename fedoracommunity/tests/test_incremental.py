@@ -0,0 +1,192 @@
+""" Tests for the package checksums incremental index runs compare """
+import unittest
+
+from fedoracommunity.search import index
+from fedoracommunity.search.index import Indexer
+
+
+class FakeYumPkg(object):
+    def __init__(self, nevra, checksum='abc'):
+        self.ui_nevra = nevra
+        self.checksum = checksum
+
+
+class FakeIconCache(object):
+    def __init__(self, themes):
+        self._themes = themes
+        self.closed = False
+
+    def themes(self):
+        return list(self._themes)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeIndexerConnection(object):
+    def __init__(self):
+        self.deleted = []
+        self.flushed = False
+
+    def delete(self, doc_id):
+        self.deleted.append(doc_id)
+
+    def flush(self):
+        self.flushed = True
+
+
+def base_pkg(name, version='1.0-1.fc20', sub_pkgs=(), owner='alice'):
+    return {'name': name,
+            'devel_owner': owner,
+            'src_pkg': FakeYumPkg('%s-%s.src' % (name, version)),
+            'pkg': FakeYumPkg('%s-%s.x86_64' % (name, version)),
+            'sub_pkgs': [{'name': sub_name,
+                          'pkg': FakeYumPkg('%s-%s.x86_64' % (sub_name,
+                                                              version))}
+                         for sub_name in sub_pkgs]}
+
+
+class IndexerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # only what the checksums and incremental runs need, without
+        # setting up yum or opening an index
+        self.indexer = Indexer.__new__(Indexer)
+        self.indexer.tagger_cache = None
+        self.indexer.icon_cache = FakeIconCache(
+            ['gnome-icon-theme-3.10.0-1.fc20.noarch', 'oxygen-icon-theme'])
+
+
+class TestPkgChecksum(IndexerTestCase):
+
+    def checksum(self, pkg):
+        return self.indexer.pkg_checksum(pkg)
+
+    def test_stable(self):
+        pkg = base_pkg('foo', sub_pkgs=['foo-devel', 'foo-libs'])
+        same = base_pkg('foo', sub_pkgs=['foo-libs', 'foo-devel'])
+        self.assertEqual(self.checksum(pkg), self.checksum(same))
+
+    def test_package_changes(self):
+        checksum = self.checksum(base_pkg('foo'))
+        for changed in (base_pkg('foo', '1.0-2.fc20'),
+                        base_pkg('foo', owner='bob'),
+                        base_pkg('foo', sub_pkgs=['foo-devel'])):
+            self.assertNotEqual(checksum, self.checksum(changed))
+
+        pkg = base_pkg('foo')
+        pkg['pkg'].checksum = 'def'
+        self.assertNotEqual(checksum, self.checksum(pkg))
+
+    def test_tags(self):
+        checksum = self.checksum(base_pkg('foo'))
+        self.indexer.tagger_cache = {'foo': [{'tag': 'editor', 'total': 1}]}
+        self.assertNotEqual(checksum, self.checksum(base_pkg('foo')))
+
+    def test_icon_themes(self):
+        checksum = self.checksum(base_pkg('foo'))
+        self.indexer.icon_cache = FakeIconCache(
+            ['gnome-icon-theme-3.10.0-2.fc20.noarch', 'oxygen-icon-theme'])
+        self.assertNotEqual(checksum, self.checksum(base_pkg('foo')))
+
+        self.indexer.icon_cache = FakeIconCache(
+            ['gnome-icon-theme-3.10.0-1.fc20.noarch'])
+        self.assertNotEqual(checksum, self.checksum(base_pkg('foo')))
+
+    def test_icon_sizes(self):
+        checksum = self.checksum(base_pkg('foo'))
+        icon_sizes = index.ICON_SIZES
+        index.ICON_SIZES = (128, 64)
+        try:
+            self.assertNotEqual(checksum, self.checksum(base_pkg('foo')))
+        finally:
+            index.ICON_SIZES = icon_sizes
+
+    def test_format_version(self):
+        checksum = self.checksum(base_pkg('foo'))
+        index.INDEX_FORMAT_VERSION += 1
+        try:
+            self.assertNotEqual(checksum, self.checksum(base_pkg('foo')))
+        finally:
+            index.INDEX_FORMAT_VERSION -= 1
+
+
+class TestIndexIncremental(IndexerTestCase):
+
+    def setUp(self):
+        IndexerTestCase.setUp(self)
+        self.iconn = FakeIndexerConnection()
+        self.stored = []
+        self.completions = []
+        self._write_completions = index.write_completions
+        index.write_completions = \
+            lambda dbpath, pkgs: self.completions.extend(pkgs)
+
+        indexer = self.indexer
+        indexer.dbpath = '/nonexistent'
+        indexer.iconn = self.iconn
+        indexer.build_pkg_docs = \
+            lambda pkgs, jobs: [('doc', pkg) for pkg in pkgs]
+        indexer.store_pkg_doc = \
+            lambda doc, pkg, replace=False: self.stored.append(
+                (pkg['name'], replace))
+        indexer.build_suggestions = lambda: None
+        indexer.prune_file_cache = lambda: None
+
+    def tearDown(self):
+        index.write_completions = self._write_completions
+
+    def run_incremental(self, pkgs, indexed):
+        self.indexer.index_yum_pkgs = \
+            lambda: dict((pkg['name'], pkg) for pkg in pkgs)
+        self.indexer.get_indexed_checksums = lambda: indexed
+        return self.indexer.index_pkgs_incremental()
+
+    def indexed(self, *pkgs):
+        checksum = self.indexer.pkg_checksum
+        return dict((pkg['name'], (pkg['name'], checksum(pkg)))
+                    for pkg in pkgs)
+
+    def test_skips_unchanged(self):
+        indexed = self.indexed(base_pkg('foo'), base_pkg('bar'))
+        count = self.run_incremental(
+            [base_pkg('foo'), base_pkg('bar', '2.0-1.fc20', ['bar-devel'])],
+            indexed)
+
+        self.assertEqual(count, 2)
+        self.assertEqual(self.stored, [('bar', True)])
+        self.assertEqual(self.iconn.deleted, [])
+        self.assertTrue(self.iconn.flushed)
+        self.assertTrue(self.indexer.icon_cache.closed)
+        # completions always cover every package
+        self.assertEqual(sorted(pkg['name'] for pkg in self.completions),
+                         ['bar', 'foo'])
+
+    def test_new_and_removed(self):
+        indexed = self.indexed(base_pkg('foo'), base_pkg('gone'))
+        self.run_incremental([base_pkg('foo'), base_pkg('new')], indexed)
+
+        self.assertEqual(self.stored, [('new', True)])
+        self.assertEqual(self.iconn.deleted, ['gone'])
+
+    def test_generated_doc_ids(self):
+        # documents from older runs were given generated ids and are
+        # replaced by ones named after the package
+        indexed = {'foo': ('1f', 'old checksum')}
+        self.run_incremental([base_pkg('foo')], indexed)
+
+        self.assertEqual(self.iconn.deleted, ['1f'])
+        self.assertEqual(self.stored, [('foo', True)])
+
+    def test_icon_theme_update(self):
+        indexed = self.indexed(base_pkg('foo'), base_pkg('bar'))
+        self.indexer.icon_cache = FakeIconCache(
+            ['gnome-icon-theme-3.10.0-2.fc20.noarch', 'oxygen-icon-theme'])
+        self.run_incremental([base_pkg('foo'), base_pkg('bar')], indexed)
+
+        self.assertEqual(sorted(self.stored),
+                         [('bar', True), ('foo', True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+""" Tests for encoding connector results as a stream of json chunks """
+import zlib
+import unittest
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from fedoracommunity.connectors.api import jsonstream
+from fedoracommunity.connectors.api.jsonstream import json_chunks, \
+    gzip_chunks
+
+
+def dumps(obj):
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def rows(count):
+    return [{'id': i,
+             'summary': u'row %d \u2603 "quoted" \\ <b>' % i,
+             'owner': 'alice',
+             'tags': ['a', 'b', None],
+             'score': i / 3.0,
+             'closed': bool(i % 2)}
+            for i in range(count)]
+
+
+class TestJsonChunks(unittest.TestCase):
+
+    def encode(self, obj, chunk_size=jsonstream.CHUNK_SIZE):
+        return ''.join(json_chunks(obj, chunk_size))
+
+    def assertEncodes(self, obj):
+        self.assertEqual(self.encode(obj), dumps(obj))
+        self.assertEqual(self.encode(obj, chunk_size=1), dumps(obj))
+
+    def test_scalars(self):
+        for obj in (None, True, 0, -1.5, 'foo', u'sn\xf8w \u2603', ''):
+            self.assertEncodes(obj)
+
+    def test_empty_containers(self):
+        for obj in ({}, [], {'rows': []}, {'rows': {}}, [[]], [{}]):
+            self.assertEncodes(obj)
+
+    def test_result(self):
+        # {"total_rows": n, "rows": [...]} as returned by queries
+        self.assertEncodes({'total_rows': 250,
+                            'rows_per_page': 250,
+                            'visible_rows': 250,
+                            'rows': rows(250)})
+
+    def test_nested(self):
+        # deeper than the levels walked in python
+        self.assertEncodes({'tree': {'name': 'src',
+                                     'children': [{'name': 'main.c',
+                                                   'children': []}]},
+                            'lists': [[1, [2, [3]]], [], [{}]],
+                            'tuple': (1, 2, (3, 4))})
+
+    def test_slices(self):
+        for count in (jsonstream.SLICE_SIZE - 1, jsonstream.SLICE_SIZE,
+                      jsonstream.SLICE_SIZE + 1, jsonstream.SLICE_SIZE * 2):
+            self.assertEncodes({'rows': range(count)})
+            self.assertEncodes([range(count)])
+
+    def test_unicode(self):
+        self.assertEncodes({u'sn\xf8w': [u'\u2603', u'\U0001f600'],
+                            u'\u2603': {u'\xe9': u'caf\xe9'},
+                            'utf-8': u'caf\xe9'.encode('utf-8'),
+                            'controls': u'\x00\t\n\u2028'})
+
+    def test_keys(self):
+        self.assertEncodes({1: 'one', 2.5: 'two and a half', None: 'none',
+                            True: 'true', 'str': {3: [4]}})
+
+    def test_chunk_size(self):
+        obj = {'rows': rows(1000)}
+        chunks = list(json_chunks(obj, chunk_size=4096))
+        self.assertTrue(len(chunks) > 1)
+        for chunk in chunks[:-1]:
+            self.assertTrue(len(chunk) >= 4096)
+        self.assertEqual(''.join(chunks), dumps(obj))
+
+
+class TestGzipChunks(unittest.TestCase):
+
+    def gunzip(self, data):
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+    def test_round_trip(self):
+        obj = {'rows': rows(1000)}
+        data = ''.join(gzip_chunks(json_chunks(obj, chunk_size=4096)))
+        self.assertEqual(self.gunzip(data), dumps(obj))
+        self.assertEqual(data[:2], '\x1f\x8b')
+
+    def test_empty(self):
+        self.assertEqual(self.gunzip(''.join(gzip_chunks([]))), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
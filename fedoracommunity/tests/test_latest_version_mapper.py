@@ -0,0 +1,470 @@
+""" Tests for building the versionmap from a fake koji hub """
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from fedoracommunity.search import latest_version_mapper
+from fedoracommunity.search.latest_version_mapper import Mapper
+from fedoracommunity.search.distmappings import tags
+
+COMPLETE = latest_version_mapper.koji.BUILD_STATES['COMPLETE']
+FAILED = latest_version_mapper.koji.BUILD_STATES['FAILED']
+
+
+def build(name, version, release, build_id, epoch=None, state=COMPLETE):
+    return {'package_name': name, 'name': name, 'version': version,
+            'release': release, 'epoch': epoch, 'build_id': build_id,
+            'state': state}
+
+# what listTagged(tag, inherit=True, latest=True) answers for each tag
+TAGGED = {
+    'f21': [build('foo', '2.0', '1.fc21', 3, epoch=1),
+            build('bar', '0.9', '1.fc21', 4)],
+    'f20-updates': [build('foo', '1.1', '1.fc20', 2,
+                          state=FAILED)],
+    'f20': [build('foo', '1.0', '1.fc20', 1)],
+}
+
+# what getBuild answers for each build id
+BUILDS = {
+    5: build('foo', '2.1', '1.fc21', 5, epoch=1),
+    6: build('bar', '1.0', '1.fc20', 6),
+    7: build('bar', '1.1', '1.fc20', 7, state=FAILED),
+    8: build('baz', '0.1', '1.fc21', 8),
+    9: build('foo', '1.9', '1.fc21', 9, epoch=1),
+}
+
+# the tagBuild tasks listTasks answers with, and what listBuilds and
+# listTags answer for their parent tasks and builds
+TASKS = [{'id': 1, 'parent': 100}, {'id': 2, 'parent': 100},
+         {'id': 3, 'parent': 101}, {'id': 4, 'parent': None},
+         {'id': 5, 'parent': 102}, {'id': 6, 'parent': 103},
+         {'id': 7, 'parent': 104}, {'id': 8, 'parent': 105},
+         {'id': 9, 'parent': 106}]
+TASK_BUILDS = {100: [BUILDS[5]], 101: [BUILDS[6]], 102: [BUILDS[8]],
+               103: [], 104: [BUILDS[9]],
+               105: [build('bar', '1.1', '1.fc20', 10)],
+               106: [BUILDS[5]]}
+BUILD_TAGS = {5: [{'name': 'f21'}],
+              6: [{'name': 'f20-updates-candidate'}, {'name': 'f20'}],
+              10: [{'name': 'f20'}],
+              8: [{'name': 'f21'}],
+              9: [{'name': 'f21'}]}
+
+
+class FakeKojiSession(object):
+    """ Answers the calls the mapper makes and records who made them.
+        Calls made while multicall is set are queued up for multiCall,
+        which returns a fault for any call on an id in hub.faults
+    """
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.opts = {}
+        self.threads = set()
+        self.multicall = False
+        self._calls = []
+        hub.sessions.append(self)
+
+    def _record(self, call):
+        self.threads.add(threading.current_thread().ident)
+        self.hub.lock.acquire()
+        try:
+            self.hub.calls.append(call)
+        finally:
+            self.hub.lock.release()
+
+    def _call(self, name, answer, arg):
+        if self.multicall:
+            self._calls.append((name, answer, arg))
+            return None
+        self._record((name, arg))
+        return answer(arg)
+
+    def multiCall(self):
+        self.multicall = False
+        results = []
+        for name, answer, arg in self._calls:
+            self._record((name, arg))
+            if arg in self.hub.faults:
+                results.append({'faultCode': 1000,
+                                'faultString': 'no %s for %s' % (name, arg)})
+            else:
+                results.append([answer(arg)])
+        self.hub.multicalls.append(len(self._calls))
+        self._calls = []
+        return results
+
+    def listPackages(self):
+        self._record(('listPackages',))
+        return [{'package_name': name} for name in ('foo', 'bar', 'baz')]
+
+    def listTagged(self, tag, **kwargs):
+        self._record(('listTagged', tag, kwargs))
+        return TAGGED.get(tag, [])
+
+    def getBuild(self, build_id):
+        return self._call('getBuild', BUILDS.get, build_id)
+
+    def listTasks(self, opts=None):
+        self._record(('listTasks', opts))
+        return TASKS
+
+    def listBuilds(self, taskID=None):
+        return self._call('listBuilds', TASK_BUILDS.get, taskID)
+
+    def listTags(self, build_id):
+        return self._call('listTags', BUILD_TAGS.get, build_id)
+
+
+class MapperTestCase(unittest.TestCase):
+    """ Runs a Mapper against a fake koji hub, with the versionmap kept
+        in memory instead of a xapian index
+    """
+
+    def setUp(self):
+        self.sessions = []
+        self.calls = []
+        self.multicalls = []
+        self.faults = set()
+        self.lock = threading.Lock()
+        self.index_log = []
+        self._client_session = latest_version_mapper.koji.ClientSession
+        latest_version_mapper.koji.ClientSession = \
+            lambda url: FakeKojiSession(self)
+
+        # everything Mapper.__init__ sets up except the xapian index
+        self.mapper = Mapper.__new__(Mapper)
+        self.mapper.koji_url = 'http://koji.example.com/kojihub'
+        self.mapper.koji_sessions = 3
+        self.mapper.multicall_size = 2
+        self.mapper.flush_every = 1000
+        self.mapper._local = threading.local()
+        self.mapper.koji_client = self.mapper.get_koji_client()
+        self.mapper.updated_packages = {}
+        self.mapper.new_packages = {}
+        self.mapper.iconn = None
+        self.mapper.versionmap = {}
+        self.mapper._dirty_keys = set()
+        self.mapper.write_back = lambda: self.index_log.append('write')
+        self.mapper.open_index = lambda: self.index_log.append('open')
+        self.mapper.close_index = lambda: self.index_log.append('close')
+
+    def tearDown(self):
+        latest_version_mapper.koji.ClientSession = self._client_session
+
+    def payload(self, name):
+        payload = self.mapper.get_payload(name)
+        if payload is None:
+            return None
+        return json.loads(payload)
+
+
+class TestInitDB(MapperTestCase):
+
+    def setUp(self):
+        MapperTestCase.setUp(self)
+        self.mapper.init_db()
+
+    def test_one_listing_per_tag(self):
+        listed = [call[1] for call in self.calls if call[0] == 'listTagged']
+        self.assertEqual(sorted(listed),
+                         sorted(set([t['tag'] for t in tags])))
+        for call in self.calls:
+            if call[0] == 'listTagged':
+                self.assertEqual(call[2], {'inherit': True, 'latest': True})
+        self.assertEqual(
+            [call for call in self.calls if call[0] == 'listPackages'],
+            [('listPackages',)])
+
+    def test_sessions(self):
+        # the main session plus at most one for each pool thread
+        self.assertTrue(len(self.sessions) <= 1 + self.mapper.koji_sessions)
+        for session in self.sessions:
+            self.assertEqual(len(session.threads), 1)
+            self.assertEqual(session.opts, {'anon_retry': True,
+                                            'offline_retry': True})
+
+    def test_latest_builds(self):
+        self.assertEqual(self.payload('foo'), {
+            'name': 'foo',
+            'Rawhide': {'epoch': '1', 'version': '2.0',
+                        'release': '1.fc21', 'build_id': 3},
+            # the failed update is passed over for the base tag
+            'Fedora 20': {'version': '1.0', 'release': '1.fc20',
+                          'build_id': 1},
+        })
+        self.assertEqual(self.payload('bar'), {
+            'name': 'bar',
+            'Rawhide': {'version': '0.9', 'release': '1.fc21',
+                        'build_id': 4},
+        })
+
+    def test_no_builds(self):
+        self.assertEqual(self.payload('baz'), None)
+
+    def test_timestamp(self):
+        self.assertEqual(self.mapper.get_current_timestamp(),
+                         str(self.mapper.new_timestamp))
+
+
+class TestUpdateDB(MapperTestCase):
+
+    def setUp(self):
+        MapperTestCase.setUp(self)
+        self.mapper.set_payload('_last_run_', '1000.0')
+        self.mapper.set_payload('foo', json.dumps({
+            'name': 'foo',
+            'Rawhide': {'epoch': '1', 'version': '2.0',
+                        'release': '1.fc21', 'build_id': 3}}))
+        self.mapper._dirty_keys = set()
+
+    def calls_to(self, method):
+        return [call[1] for call in self.calls if call[0] == method]
+
+    def test_update(self):
+        self.mapper.update_db()
+
+        self.assertEqual(self.calls_to('listTasks'),
+                         [{'completedAfter': 1000.0, 'method': 'tagBuild',
+                           'decode': True}])
+        # one listBuilds per parent task and one listTags per build, all
+        # through multicalls of multicall_size
+        self.assertEqual(self.calls_to('listBuilds'),
+                         [100, 101, 102, 103, 104, 105, 106])
+        self.assertEqual(sorted(self.calls_to('listTags')), [5, 6, 8, 9, 10])
+        self.assertEqual(self.multicalls, [2, 2, 2, 1, 2, 2, 1])
+
+        self.assertEqual(self.payload('foo')['Rawhide']['build_id'], 5)
+        self.assertEqual(self.payload('bar')['Fedora 20']['build_id'], 10)
+        self.assertEqual(self.payload('baz')['Rawhide']['build_id'], 8)
+        self.assertEqual(sorted(self.mapper.updated_packages), ['foo'])
+        self.assertEqual(sorted(self.mapper.new_packages), ['bar', 'baz'])
+
+        # written out once, then again with the timestamp
+        self.assertEqual(self.index_log, ['write', 'write'])
+        self.assertEqual(self.mapper.get_current_timestamp(),
+                         str(self.mapper.new_timestamp))
+
+    def test_faults(self):
+        # a task whose builds can't be listed and a build whose tags
+        # can't be listed are skipped, the rest still go in
+        self.faults.update([102, 10])
+        self.mapper.update_db()
+
+        self.assertEqual(self.payload('baz'), None)
+        # the first of a build's tags which maps to a dist is used
+        self.assertEqual(self.payload('bar')['Fedora 20']['build_id'], 6)
+        self.assertEqual(self.payload('foo')['Rawhide']['build_id'], 5)
+
+    def test_timestamp_argument(self):
+        self.mapper.update_db(timestamp='1500.5')
+        self.assertEqual(self.calls_to('listTasks')[0]['completedAfter'],
+                         1500.5)
+
+
+class TestVersionMapStorage(unittest.TestCase):
+    """ write_back and load_versionmap against a real index """
+
+    def setUp(self):
+        self.sessions = []
+        self.calls = []
+        self.lock = threading.Lock()
+        self._client_session = latest_version_mapper.koji.ClientSession
+        latest_version_mapper.koji.ClientSession = \
+            lambda url: FakeKojiSession(self)
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dbpath = os.path.join(self.tmp_dir, 'versionmap')
+        self.mapper = None
+
+    def tearDown(self):
+        if self.mapper is not None:
+            self.mapper.cleanup()
+        latest_version_mapper.koji.ClientSession = self._client_session
+        shutil.rmtree(self.tmp_dir)
+
+    def reopen(self, **kwargs):
+        if self.mapper is not None:
+            self.mapper.cleanup()
+        self.mapper = Mapper(self.dbpath, **kwargs)
+        return self.mapper
+
+    def test_round_trip(self):
+        mapper = self.reopen()
+        mapper.set_payload('foo', '{"name": "foo"}')
+        mapper.set_payload('Bar-Baz', '{"name": "Bar-Baz"}')
+        mapper.update_timestamp(1000.0)
+
+        mapper = self.reopen()
+        self.assertEqual(sorted(mapper.versionmap),
+                         ['_last_run_', 'bar_baz', 'foo'])
+        self.assertEqual(mapper.get_payload('foo'), '{"name": "foo"}')
+        self.assertEqual(mapper.get_payload('bar-baz'),
+                         '{"name": "Bar-Baz"}')
+        self.assertEqual(mapper.get_current_timestamp(), '1000.0')
+
+    def test_replaces_documents(self):
+        mapper = self.reopen()
+        mapper.set_payload('foo', '{"version": 1}')
+        mapper.write_back()
+        doc_id = mapper.versionmap['foo'][0]
+
+        mapper = self.reopen()
+        mapper.set_payload('foo', '{"version": 2}')
+        mapper.write_back()
+        self.assertEqual(mapper.versionmap['foo'][0], doc_id)
+
+        mapper = self.reopen()
+        self.assertEqual(mapper.iconn.get_doccount(), 1)
+        self.assertEqual(mapper.get_payload('foo'), '{"version": 2}')
+
+    def test_flush_every(self):
+        mapper = self.reopen(flush_every=2)
+        mapper.set_payload('foo', '{}')
+        self.assertEqual(mapper.versionmap['foo'][0], None)
+
+        # the second change fills the buffer and both are written out
+        mapper.set_payload('bar', '{}')
+        self.assertEqual(mapper._dirty_keys, set())
+        self.assertNotEqual(mapper.versionmap['foo'][0], None)
+        self.assertNotEqual(mapper.versionmap['bar'][0], None)
+
+    def test_unopened(self):
+        mapper = self.reopen(open_index=False)
+        self.assertEqual(mapper.iconn, None)
+        self.assertFalse(os.path.exists(self.dbpath))
+
+        mapper.open_index()
+        mapper.set_payload('foo', '{}')
+        mapper.close_index()
+        self.assertEqual(mapper.iconn, None)
+
+        mapper = self.reopen()
+        self.assertEqual(mapper.get_payload('foo'), '{}')
+
+
+class FakeLockFile(object):
+
+    def __init__(self, test, fail=0):
+        self.test = test
+        self.fail = fail
+
+    def acquire(self, timeout=None):
+        self.test.assertTrue(timeout is not None)
+        if self.fail:
+            self.fail -= 1
+            raise Exception('timed out')
+        self.test.index_log.append('lock')
+
+    def release(self):
+        self.test.index_log.append('unlock')
+
+
+def tag_event(build_id, tag):
+    return {'topic': 'org.fedoraproject.prod.buildsys.tag',
+            'msg': {'build_id': build_id, 'tag': tag, 'name': 'foo'}}
+
+
+class TestConsume(MapperTestCase):
+
+    def setUp(self):
+        MapperTestCase.setUp(self)
+        self.mapper.set_payload('_last_run_', '1000.0')
+        self.mapper.set_payload('foo', json.dumps({
+            'name': 'foo',
+            'Rawhide': {'epoch': '1', 'version': '2.0',
+                        'release': '1.fc21', 'build_id': 3}}))
+        self.mapper._dirty_keys = set()
+
+    def test_apply_tag_events(self):
+        self.mapper.apply_tag_events([
+            {'build_id': 5, 'tag': 'f21'},
+            {'build_id': 6, 'tag': 'f20'},
+            {'build_id': 7, 'tag': 'f20-updates'},
+            {'build_id': 9, 'tag': 'f21'},
+            {'build_id': 5, 'tag': 'f21'},
+            {'build_id': 8, 'tag': 'f21'},
+        ])
+        # one getBuild for each distinct build, over multicalls of 2
+        self.assertEqual(self.multicalls, [2, 2, 1])
+        self.assertEqual(sorted([call[1] for call in self.calls]),
+                         [5, 6, 7, 8, 9])
+
+        # the older foo build doesn't win over the newer one
+        self.assertEqual(self.payload('foo')['Rawhide']['build_id'], 5)
+        # failed builds are skipped
+        self.assertEqual(self.payload('bar')['Fedora 20']['build_id'], 6)
+        self.assertEqual(self.payload('baz')['Rawhide']['build_id'], 8)
+        self.assertEqual(sorted(self.mapper.updated_packages), ['foo'])
+        self.assertEqual(sorted(self.mapper.new_packages), ['bar', 'baz'])
+
+        # update runs carry on from their own timestamp
+        self.assertEqual(self.mapper.get_current_timestamp(), '1000.0')
+        self.assertTrue(self.mapper.get_consumer_timestamp())
+
+    def test_apply_faults(self):
+        self.faults.add(5)
+        self.mapper.apply_tag_events([{'build_id': 5, 'tag': 'f21'},
+                                      {'build_id': 8, 'tag': 'f21'}])
+        self.assertEqual(self.payload('foo')['Rawhide']['build_id'], 3)
+        self.assertEqual(self.payload('baz')['Rawhide']['build_id'], 8)
+
+    def test_batches(self):
+        events = [tag_event(5, 'f21'),
+                  tag_event(6, 'not-a-dist-tag'),
+                  {'msg': {'tag': 'f21'}},
+                  None,
+                  tag_event(8, 'f21'),
+                  tag_event(6, 'f20')]
+        self.mapper.consume(iter(events), batch_size=2, max_delay=60,
+                            lockfile=FakeLockFile(self))
+
+        # only the tag events on dist tags count towards a batch, and each
+        # batch is written with the lock and the index held just for it
+        self.assertEqual(self.multicalls, [2, 1])
+        self.assertEqual(self.index_log,
+                         ['lock', 'open', 'write', 'close', 'unlock',
+                          'lock', 'open', 'write', 'close', 'unlock'])
+        self.assertEqual(self.payload('bar')['Fedora 20']['build_id'], 6)
+
+    def test_delay(self):
+        events = [tag_event(5, 'f21'), None]
+        self.mapper.consume(iter(events), batch_size=10, max_delay=0)
+        self.assertEqual(self.multicalls, [1])
+        self.assertEqual(self.index_log, ['open', 'write', 'close'])
+
+    def test_lock_timeout(self):
+        events = [tag_event(5, 'f21'), tag_event(6, 'f20'),
+                  tag_event(8, 'f21')]
+        self.mapper.consume(iter(events), batch_size=1, max_delay=60,
+                            lockfile=FakeLockFile(self, fail=1))
+
+        # the batch which timed out is written along with the next one
+        self.assertEqual(self.multicalls, [2, 1])
+        self.assertEqual(self.payload('foo')['Rawhide']['build_id'], 5)
+        self.assertEqual(self.payload('baz')['Rawhide']['build_id'], 8)
+
+    def test_max_pending(self):
+        events = [tag_event(5, 'f21'), tag_event(6, 'f20'),
+                  tag_event(8, 'f21')]
+        self.mapper.consume(iter(events), batch_size=1, max_delay=60,
+                            lockfile=FakeLockFile(self, fail=2),
+                            max_pending=1)
+
+        # only the newest events are kept while the lock can't be had
+        self.assertEqual(self.multicalls, [2])
+        self.assertEqual(self.payload('foo')['Rawhide']['build_id'], 3)
+        self.assertEqual(self.payload('bar')['Fedora 20']['build_id'], 6)
+        self.assertEqual(self.payload('baz')['Rawhide']['build_id'], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+""" Tests for the owners list the indexer keeps between runs """
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from fedora.client import ServerError
+
+from fedoracommunity.search.index import Indexer
+
+
+class StubPackageDB(object):
+    def __init__(self, error=False):
+        self.error = error
+        self.calls = 0
+
+    def get_bugzilla_acls(self):
+        self.calls += 1
+        if self.error:
+            raise ServerError('https://admin.fedoraproject.org/pkgdb', 500,
+                              'Internal Server Error')
+        return {'Fedora': {'foo': {'owner': 'alice', 'qacontact': None},
+                           'bar': {'owner': 'bob', 'qacontact': None}}}
+
+
+class TestLoadOwners(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_path = tempfile.mkdtemp()
+        # only what load_owners needs, without opening an index
+        self.indexer = Indexer.__new__(Indexer)
+        self.indexer.owners_path = os.path.join(self.cache_path,
+                                                'owners.json')
+        self.indexer.owners_max_age = 60
+        self.indexer.pkgdb_client = StubPackageDB()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_path)
+
+    def save(self, data):
+        f = open(self.indexer.owners_path, 'w')
+        f.write(data)
+        f.close()
+
+    def saved(self):
+        return json.load(open(self.indexer.owners_path))
+
+    def test_missing(self):
+        owners = self.indexer.load_owners()
+        self.assertEqual(owners, {'foo': 'alice', 'bar': 'bob'})
+        self.assertEqual(self.indexer.pkgdb_client.calls, 1)
+        self.assertEqual(self.saved()['owners'], owners)
+
+    def test_fresh(self):
+        self.save(json.dumps({'timestamp': time.time() - 10,
+                              'owners': {'foo': 'carol'}}))
+        self.assertEqual(self.indexer.load_owners(), {'foo': 'carol'})
+        self.assertEqual(self.indexer.pkgdb_client.calls, 0)
+
+    def test_stale(self):
+        self.save(json.dumps({'timestamp': time.time() - 120,
+                              'owners': {'foo': 'carol'}}))
+        self.assertEqual(self.indexer.load_owners(),
+                         {'foo': 'alice', 'bar': 'bob'})
+        self.assertEqual(self.indexer.pkgdb_client.calls, 1)
+        self.assertTrue(time.time() - self.saved()['timestamp'] < 60)
+
+    def test_stale_when_pkgdb_is_down(self):
+        self.save(json.dumps({'timestamp': time.time() - 120,
+                              'owners': {'foo': 'carol'}}))
+        self.indexer.pkgdb_client = StubPackageDB(error=True)
+        self.assertEqual(self.indexer.load_owners(), {'foo': 'carol'})
+
+    def test_missing_when_pkgdb_is_down(self):
+        self.indexer.pkgdb_client = StubPackageDB(error=True)
+        self.assertRaises(ServerError, self.indexer.load_owners)
+
+    def test_malformed(self):
+        for data in ('{"timestamp": 12', '[]', '{}',
+                     json.dumps({'timestamp': time.time()}),
+                     json.dumps({'timestamp': 'yesterday', 'owners': {}}),
+                     json.dumps({'timestamp': time.time(), 'owners': []})):
+            self.save(data)
+            self.indexer.pkgdb_client = StubPackageDB()
+            self.assertEqual(self.indexer.load_owners(),
+                             {'foo': 'alice', 'bar': 'bob'})
+            self.assertEqual(self.indexer.pkgdb_client.calls, 1)
+
+    def test_malformed_when_pkgdb_is_down(self):
+        self.save('{"owners": {"foo": "carol"}}')
+        self.indexer.pkgdb_client = StubPackageDB(error=True)
+        self.assertRaises(ServerError, self.indexer.load_owners)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+""" Tests for the payloads stored with package documents """
+import unittest
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from fedoracommunity.search.payload import dump_payload, load_payload, \
+    PAYLOAD_MAGIC
+
+
+def package():
+    return {'name': 'foo',
+            'summary': u'A foo \u2603',
+            'description': u'Foo does things\nwith sn\xf8w.',
+            'devel_owner': 'alice',
+            'icon': 'foo',
+            'checksum': 'abc',
+            'sub_pkgs': [{'name': 'foo-devel',
+                          'summary': 'Headers for foo',
+                          'description': 'Headers.',
+                          'icon': 'package_128x128'},
+                         {'name': 'foo-doc',
+                          'summary': 'Documentation for foo',
+                          'description': None,
+                          'icon': 'package_128x128'}]}
+
+
+class TestPayload(unittest.TestCase):
+
+    def test_round_trip(self):
+        pkg = package()
+        loaded = load_payload(dump_payload(pkg))
+
+        # a missing description comes back empty
+        pkg['sub_pkgs'][1]['description'] = ''
+        self.assertEqual(loaded, pkg)
+        self.assertEqual(loaded['description'],
+                         u'Foo does things\nwith sn\xf8w.')
+
+    def test_utf8_descriptions(self):
+        pkg = package()
+        pkg['description'] = u'sn\xf8w'.encode('utf-8')
+        self.assertEqual(load_payload(dump_payload(pkg))['description'],
+                         u'sn\xf8w')
+
+    def test_without_descriptions(self):
+        loaded = load_payload(dump_payload(package()), descriptions=False)
+
+        self.assertFalse('description' in loaded)
+        for sub_pkg in loaded['sub_pkgs']:
+            self.assertFalse('description' in sub_pkg)
+        self.assertEqual(loaded['summary'], u'A foo \u2603')
+        self.assertEqual([s['name'] for s in loaded['sub_pkgs']],
+                         ['foo-devel', 'foo-doc'])
+
+    def test_leaves_package_alone(self):
+        pkg = package()
+        dump_payload(pkg)
+        self.assertEqual(pkg, package())
+
+    def test_no_sub_packages(self):
+        pkg = package()
+        del pkg['sub_pkgs']
+        loaded = load_payload(dump_payload(pkg))
+        self.assertEqual(loaded['sub_pkgs'], [])
+        self.assertEqual(loaded['description'], pkg['description'])
+
+    def test_plain_json(self):
+        # documents indexed before the compact payloads
+        pkg = package()
+        self.assertEqual(load_payload(json.dumps(pkg)), pkg)
+
+    def test_unknown_version(self):
+        data = dump_payload(package())
+        data = PAYLOAD_MAGIC + chr(99) + data[len(PAYLOAD_MAGIC) + 1:]
+        self.assertRaises(ValueError, load_payload, data)
+
+
+if __name__ == '__main__':
+    unittest.main()
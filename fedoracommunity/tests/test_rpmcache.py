@@ -0,0 +1,92 @@
+""" Tests for RPMCache streaming rpms from a stub mirror """
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from fedoracommunity.search import rpmcache
+from fedoracommunity.search.rpmcache import RPMCache
+from fedoracommunity.tests.fakerpm import build_rpm, cpio_member
+
+RPM_DATA = build_rpm([
+    cpio_member('./usr/share/applications/foo.desktop', 'Icon=foo\n', ino=1),
+    cpio_member('./usr/share/icons/foo.png', 'PNGDATA', ino=2),
+])
+
+
+class FakePackage(object):
+    ui_envra = '0:foo-1.0-1.fc20.x86_64'
+    checksum = 'abc123'
+    remote_url = 'http://mirror.example.com/foo-1.0-1.fc20.x86_64.rpm'
+    filelist = ['/usr/share/applications/foo.desktop',
+                '/usr/share/icons/foo.png',
+                '/usr/share/icons/missing.png']
+
+
+class TestStreamingRPMCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.responses = []
+        self.urls = []
+        self._urlopen = rpmcache.urllib2.urlopen
+        rpmcache.urllib2.urlopen = self.urlopen
+
+        self.cache = RPMCache(FakePackage(), None, self.cache_dir,
+                              max_retry=2, stream=True)
+        self.cache.open()
+
+    def tearDown(self):
+        self.cache.close()
+        rpmcache.urllib2.urlopen = self._urlopen
+        shutil.rmtree(self.cache_dir)
+
+    def urlopen(self, url):
+        self.urls.append(url)
+        if self.responses:
+            return StringIO(self.responses.pop(0))
+        return StringIO(RPM_DATA)
+
+    def test_fetches_once_per_package(self):
+        f = self.cache.open_file('/usr/share/applications/foo.desktop',
+                                 decompress_filter='*.desktop')
+        self.assertEqual(f.read(), 'Icon=foo\n')
+        f.close()
+
+        paths = self.cache.find_files('foo.png', '*.png')
+        self.assertEqual([open(path).read() for path in paths], ['PNGDATA'])
+        self.assertEqual(self.urls, [FakePackage.remote_url])
+
+    def test_no_retry_for_missing_files(self):
+        self.assertEqual(self.cache.find_file('missing.png', '*.png'), None)
+        self.assertEqual(len(self.urls), 1)
+
+    def test_retries_failed_downloads(self):
+        self.responses = [RPM_DATA[:len(RPM_DATA) / 2]]
+        path = self.cache.find_file('foo.png', '*.png')
+        self.assertEqual(open(path).read(), 'PNGDATA')
+        self.assertEqual(len(self.urls), 2)
+
+    def test_gives_up_after_max_retry(self):
+        self.responses = [RPM_DATA[:100]] * 5
+        self.assertEqual(self.cache.find_file('foo.png', '*.png'), None)
+        self.assertEqual(len(self.urls), 3)
+
+    def test_prefetch(self):
+        self.assertTrue(self.cache.prefetch('*.png'))
+        self.assertEqual(len(self.urls), 1)
+
+        # nothing goes back to the rpm afterwards, found or not
+        path = self.cache.find_file('foo.png', '*.png')
+        self.assertEqual(open(path).read(), 'PNGDATA')
+        self.assertEqual(self.cache.find_file('missing.png', '*.png'), None)
+        self.assertEqual(len(self.urls), 1)
+
+    def test_failed_prefetch(self):
+        self.responses = [RPM_DATA[:100]]
+        self.assertFalse(self.cache.prefetch('*.png'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+""" Tests for reading rpm payloads in process, on synthetic rpms """
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+
+from subprocess import Popen, PIPE
+
+from fedoracommunity.search.rpmpayload import RPMPayload, RPMPayloadError
+from fedoracommunity.tests.fakerpm import build_rpm, cpio_member
+
+MEMBERS = [
+    cpio_member('./usr', mode=stat.S_IFDIR | 0755, ino=1),
+    cpio_member('./usr/share/applications/foo.desktop',
+                '[Desktop Entry]\nName=Foo\n', ino=2),
+    cpio_member('./usr/share/icons/foo.png', 'PNGDATA', ino=3),
+    # hardlinks only carry their data on the last link
+    cpio_member('./usr/bin/foo', '', ino=4, nlink=2),
+    cpio_member('./usr/bin/foo-alias', '#!/bin/sh\n', ino=4, nlink=2),
+    cpio_member('./usr/share/pixmaps/foo.png', '../icons/foo.png',
+                mode=stat.S_IFLNK | 0777, ino=5),
+    cpio_member('./usr/share/pixmaps/dangling.png', '../icons/none.png',
+                mode=stat.S_IFLNK | 0777, ino=6),
+]
+
+
+def have_xz():
+    try:
+        import lzma
+        return True
+    except ImportError:
+        try:
+            Popen(['xz', '--version'], stdout=PIPE).communicate()
+            return True
+        except OSError:
+            return False
+
+
+class RPMPayloadTestCase(object):
+    compressor = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.rpm_path = os.path.join(self.tmp_dir, 'foo.rpm')
+        f = open(self.rpm_path, 'wb')
+        f.write(build_rpm(MEMBERS, self.compressor))
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_reads_matching_files(self):
+        files = RPMPayload(self.rpm_path).extract(['*.desktop'])
+        self.assertEqual(files, {'/usr/share/applications/foo.desktop':
+                                 '[Desktop Entry]\nName=Foo\n'})
+
+    def test_hardlinks(self):
+        files = RPMPayload(self.rpm_path).extract(['/usr/bin/*'])
+        self.assertEqual(files, {'/usr/bin/foo': '#!/bin/sh\n',
+                                 '/usr/bin/foo-alias': '#!/bin/sh\n'})
+
+    def test_symlinks(self):
+        files = RPMPayload(self.rpm_path).extract(['*.png'])
+        self.assertEqual(files, {'/usr/share/icons/foo.png': 'PNGDATA',
+                                 '/usr/share/pixmaps/foo.png': 'PNGDATA'})
+
+    def test_symlink_target_not_matched(self):
+        # the target has to be extracted too for the link to resolve
+        files = RPMPayload(self.rpm_path).extract(['/usr/share/pixmaps/*'])
+        self.assertEqual(files, {})
+
+    def test_extracts_to_dir(self):
+        dest_dir = os.path.join(self.tmp_dir, 'dest')
+        files = RPMPayload(self.rpm_path).extract(['*.png', '/usr/bin/*'],
+                                                  dest_dir)
+        self.assertEqual(sorted(files), ['/usr/bin/foo', '/usr/bin/foo-alias',
+                                         '/usr/share/icons/foo.png',
+                                         '/usr/share/pixmaps/foo.png'])
+        for name, full_path in files.items():
+            self.assertEqual(full_path,
+                             os.path.join(dest_dir, name.lstrip('/')))
+        self.assertEqual(open(files['/usr/share/pixmaps/foo.png']).read(),
+                         'PNGDATA')
+
+    def write_rpm(self, members):
+        rpm_path = os.path.join(self.tmp_dir, 'other.rpm')
+        f = open(rpm_path, 'wb')
+        f.write(build_rpm(members, self.compressor))
+        f.close()
+        return rpm_path
+
+    def test_hardlink_data_on_unmatched_link(self):
+        rpm_path = self.write_rpm([
+            cpio_member('./usr/share/icons/a/foo.png', '', ino=1, nlink=3),
+            cpio_member('./usr/share/icons/b/foo.png', '', ino=1, nlink=3),
+            cpio_member('./usr/lib/foo/icon', 'PNGDATA', ino=1, nlink=3),
+        ])
+        files = RPMPayload(rpm_path).extract(['/usr/share/icons/a/foo.png'])
+        self.assertEqual(files, {'/usr/share/icons/a/foo.png': 'PNGDATA'})
+
+    def test_refuses_paths_outside_dest_dir(self):
+        rpm_path = self.write_rpm([
+            cpio_member('./usr/share/icons/../../../../escaped.png',
+                        'PNGDATA', ino=1),
+        ])
+        dest_dir = os.path.join(self.tmp_dir, 'dest')
+        self.assertRaises(RPMPayloadError, RPMPayload(rpm_path).extract,
+                          ['*.png'], dest_dir)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tmp_dir, 'escaped.png')))
+
+    def test_reads_from_fileobj(self):
+        f = open(self.rpm_path, 'rb')
+        try:
+            files = RPMPayload(self.rpm_path, fileobj=f).extract(
+                ['/usr/share/icons/foo.png'])
+        finally:
+            f.close()
+        self.assertEqual(files, {'/usr/share/icons/foo.png': 'PNGDATA'})
+
+
+class TestGzipPayload(RPMPayloadTestCase, unittest.TestCase):
+    compressor = 'gzip'
+
+    def test_truncated_rpm(self):
+        data = open(self.rpm_path, 'rb').read()
+        f = open(self.rpm_path, 'wb')
+        f.write(data[:len(data) / 2])
+        f.close()
+        self.assertRaises(RPMPayloadError,
+                          RPMPayload(self.rpm_path).extract, ['*'])
+
+    def test_not_an_rpm(self):
+        f = open(self.rpm_path, 'wb')
+        f.write('not an rpm' * 20)
+        f.close()
+        self.assertRaises(RPMPayloadError,
+                          RPMPayload(self.rpm_path).extract, ['*'])
+
+
+class TestXzPayload(RPMPayloadTestCase, unittest.TestCase):
+    compressor = 'xz'
+
+    def setUp(self):
+        if not have_xz():
+            self.skipTest('no xz support')
+        RPMPayloadTestCase.setUp(self)
+
+
+if __name__ == '__main__':
+    unittest.main()
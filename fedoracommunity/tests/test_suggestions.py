@@ -0,0 +1,190 @@
+""" Tests for the synonym table and the search falling back on it """
+import shutil
+import tempfile
+import unittest
+
+from fedoracommunity.connectors import xapianconnector
+from fedoracommunity.connectors.xapianconnector import XapianConnector, \
+    SearchResultCache, SUGGEST_BELOW_HITS
+from fedoracommunity.search.payload import dump_payload
+from fedoracommunity.search.suggestions import write_suggestions, \
+    Suggestions, MAX_SYNONYM_PKGS
+
+
+class TestSuggestions(unittest.TestCase):
+
+    def setUp(self):
+        self.dbpath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dbpath)
+
+    def suggestions(self, synonyms, pkg_names):
+        write_suggestions(self.dbpath, synonyms, pkg_names)
+        return Suggestions(self.dbpath)
+
+    def test_synonyms(self):
+        suggestions = self.suggestions(
+            {'GNU Image Manipulation Program': set(['gimp']),
+             'Photoshop': set(['gimp']),
+             'web browser': set(['firefox', 'epiphany'])},
+            ['gimp', 'firefox', 'epiphany'])
+
+        self.assertEqual(suggestions.synonyms_for('photoshop'), ['gimp'])
+        self.assertEqual(
+            suggestions.synonyms_for('gnu image manipulation program'),
+            ['gimp'])
+        self.assertEqual(suggestions.synonyms_for('web  browser'),
+                         ['epiphany', 'firefox'])
+        self.assertEqual(suggestions.synonyms_for('photoshop web'),
+                         ['gimp'])
+        self.assertEqual(suggestions.synonyms_for('emacs'), [])
+
+    def test_merges_filtered_words(self):
+        suggestions = self.suggestions({'System Bus': set(['dbus']),
+                                        'system  bus': set(['dbus-x11'])},
+                                       ['dbus', 'dbus-x11'])
+        self.assertEqual(suggestions.synonyms,
+                         {'system bus': ['dbus', 'dbus-x11']})
+
+    def test_leaves_out_package_names(self):
+        suggestions = self.suggestions({'Firefox': set(['firefox-wayland'])},
+                                       ['firefox', 'firefox-wayland'])
+        self.assertEqual(suggestions.synonyms, {})
+
+    def test_leaves_out_vague_words(self):
+        names = set(['editor%d' % i for i in range(MAX_SYNONYM_PKGS + 1)])
+        suggestions = self.suggestions({'editor': names}, names)
+        self.assertEqual(suggestions.synonyms, {})
+
+    def test_missing_table(self):
+        # indexes built before suggestions were added
+        self.assertEqual(Suggestions(self.dbpath).synonyms_for('gimp'), [])
+
+
+class FakeMatch(object):
+    def __init__(self, pkg):
+        self.document = self
+        self._data = dump_payload(pkg)
+
+    def get_data(self):
+        return self._data
+
+
+class FakeMSet(list):
+    def get_matches_estimated(self):
+        return len(self)
+
+
+class FakeDatabase(object):
+    """ Stands in for a _PooledDatabase and its xapian database """
+    def __init__(self, generation, spelling):
+        self.generation = generation
+        self.db = self
+        self.spelling = spelling
+
+    def get_spelling_suggestion(self, term):
+        return self.spelling.get(term, '')
+
+
+class FakeDatabasePool(object):
+    def __init__(self, database):
+        self.database = database
+
+    def get(self, path, reopen=False):
+        return self.database
+
+
+def package(name, summary=''):
+    return {'name': name, 'summary': summary, 'description': '',
+            'sub_pkgs': []}
+
+
+class TestSuggestFallback(unittest.TestCase):
+
+    def setUp(self):
+        # a new generation each time so the synonym table is reloaded
+        self.dbpath = tempfile.mkdtemp()
+        write_suggestions(self.dbpath, {'photoshop': set(['gimp'])},
+                          ['gimp', 'krita'])
+        self.spelling = {}
+        self.hits = {}
+        self.queries = []
+
+        self._database_pool = xapianconnector.database_pool
+        self._get_search_cache = xapianconnector.get_search_cache
+        xapianconnector.database_pool = FakeDatabasePool(
+            FakeDatabase(self.dbpath, self.spelling))
+        cache = SearchResultCache()
+        xapianconnector.get_search_cache = lambda: cache
+
+        self.connector = XapianConnector.__new__(XapianConnector)
+        self.connector._search_db_path = 'xapian/search'
+        self.connector.do_search = self.do_search
+
+    def tearDown(self):
+        xapianconnector.database_pool = self._database_pool
+        xapianconnector.get_search_cache = self._get_search_cache
+        shutil.rmtree(self.dbpath)
+
+    def do_search(self, search_string, start_row=None, rows_per_page=None,
+                  order=-1, sort_col=None):
+        """ Finds the packages of every word of hits in the query """
+        self.queries.append(search_string)
+        matches = FakeMSet()
+        for word, pkgs in self.hits.items():
+            if '*%s*' % word in search_string:
+                matches.extend([FakeMatch(pkg) for pkg in pkgs])
+        return matches
+
+    def search(self, search_string):
+        return self.connector.search_packages(
+            start_row=0, rows_per_page=10, filters={'search': search_string})
+
+    def test_enough_hits(self):
+        self.hits['editor'] = [package('editor%d' % i)
+                               for i in range(SUGGEST_BELOW_HITS)]
+        self.spelling['editor'] = 'editors'
+
+        count, rows = self.search('editor')
+        self.assertEqual(count, SUGGEST_BELOW_HITS)
+        self.assertEqual(len(self.queries), 1)
+
+    def test_synonyms(self):
+        self.hits['photoshop'] = [package('photoshop-brushes')]
+        self.hits['gimp'] = [package('gimp', 'GNU Image Manipulation Program')]
+
+        count, rows = self.search('Photoshop')
+        self.assertEqual(len(self.queries), 2)
+        self.assertTrue(self.queries[1].startswith(self.queries[0] + ' OR ('))
+        self.assertEqual(count, 2)
+        self.assertEqual(sorted(row['name'] for row in rows),
+                         ['<span class="match">gimp</span>',
+                          '<span class="match">photoshop</span>-brushes'])
+
+    def test_spelling(self):
+        self.hits['inkscape'] = [package('inkscape')]
+        self.spelling['inksape'] = 'inkscape'
+
+        count, rows = self.search('inksape')
+        self.assertEqual(len(self.queries), 2)
+        self.assertEqual(count, 1)
+        self.assertEqual(rows[0]['name'],
+                         '<span class="match">inkscape</span>')
+
+    def test_nothing_to_suggest(self):
+        self.hits['krita'] = [package('krita')]
+
+        count, rows = self.search('krita')
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(count, 1)
+
+    def test_cached(self):
+        self.hits['gimp'] = [package('gimp')]
+        self.search('photoshop')
+        self.search('PhotoShop ')
+        self.assertEqual(len(self.queries), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -167,7 +167,7 @@
 
     connector_query_model: function(connector, path, callback) {
         path = '/query_model/' + path;
-        fcomm.connector_load(connector, path, {}, callback, this.$overlay_div);
+        fcomm.batch_load(connector, path, {}, callback, this.$overlay_div);
     },
 
     connector_query: function(connector, path, dispatch_data, callback) {
@@ -175,7 +175,7 @@
         if (dispatch_data)
             path = path + '/' + JSON.stringify(dispatch_data);
 
-        fcomm.connector_load(connector, path, {}, callback, this.$overlay_div);
+        fcomm.batch_load(connector, path, {}, callback, this.$overlay_div);
     },
 
     request_data_refresh: function(event) {